@@ -0,0 +1,78 @@
+import numpy as np
+
+# Availability snapshots as fixed-width bitsets.
+#
+# Bit i (most significant bit first, as np.packbits lays it out) is set when stall
+# number i is available. availabilitysnapshots.available_bitset uses this layout and
+# is filled by the availability_bitset() trigger; available_count holds the popcount.
+# Delta encoding XORs each bitset with the previous one; the first stays as is.
+
+
+def bitset_width(n_stalls):
+    """Bytes needed for stall numbers 0 .. n_stalls - 1."""
+    return (n_stalls + 7) // 8
+
+
+def encode_bitset(stall_numbers, n_stalls):
+    bits = np.zeros(bitset_width(n_stalls) * 8, dtype=bool)
+    bits[np.asarray(list(stall_numbers), dtype=np.int64)] = True
+    return np.packbits(bits).tobytes()
+
+
+def decode_bitset(blob, n_stalls):
+    """Bool array of length n_stalls; a shorter blob is zero-padded."""
+    return decode_many([blob], n_stalls)[0]
+
+
+def stall_numbers_from_bitset(blob, n_stalls):
+    return np.flatnonzero(decode_bitset(blob, n_stalls)).tolist()
+
+
+def bitset_count(blob):
+    return int(np.unpackbits(np.frombuffer(bytes(blob), dtype=np.uint8)).sum())
+
+
+def delta_encode(blobs):
+    """XOR every bitset with its predecessor. Unchanged snapshots become all-zero bytes."""
+    matrix = _as_byte_matrix(blobs)
+    if not len(matrix):
+        return []
+    out = matrix.copy()
+    out[1:] ^= matrix[:-1]
+    return [row.tobytes() for row in out]
+
+
+def delta_decode(blobs):
+    return [row.tobytes() for row in np.bitwise_xor.accumulate(_as_byte_matrix(blobs), axis=0)]
+
+
+def _as_byte_matrix(blobs, width=None):
+    """(n_snapshots, width) uint8 matrix from a sequence of bitsets, zero-padding short ones."""
+    blobs = [bytes(b) for b in blobs]
+    if width is None:
+        width = max((len(b) for b in blobs), default=0)
+    if any(len(b) != width for b in blobs):
+        blobs = [b[:width].ljust(width, b"\0") for b in blobs]
+    return np.frombuffer(b"".join(blobs), dtype=np.uint8).reshape(len(blobs), width)
+
+
+def decode_many(blobs, n_stalls, delta=False):
+    """(n_snapshots, n_stalls) bool matrix: row = snapshot, column = stall number."""
+    matrix = _as_byte_matrix(blobs, bitset_width(n_stalls))
+    if delta and len(matrix):
+        matrix = np.bitwise_xor.accumulate(matrix, axis=0)
+    return np.unpackbits(matrix, axis=1, count=n_stalls).astype(bool)
+
+
+def free_intervals(times, available):
+    """Runs of True in `available` as (start, end) pairs of `times`.
+
+    A run that lasts to the final snapshot ends at times[-1].
+    """
+    flags = np.concatenate(([0], np.asarray(available, dtype=np.int8), [0]))
+    change = np.diff(flags)
+    starts = np.flatnonzero(change == 1)
+    ends = np.flatnonzero(change == -1)
+    times = np.asarray(times)
+    end_times = times[np.minimum(ends, len(times) - 1)]
+    return list(zip(times[starts].tolist(), end_times.tolist()))
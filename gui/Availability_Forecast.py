@@ -0,0 +1,190 @@
+import os
+import time
+import asyncio
+import zoneinfo
+import numpy as np
+from datetime import datetime, timezone
+from ParkingLot_Database_Utils import get_connection_pool
+from Query_Registry import run_query
+from Occupancy_Heatmap import local_hour_grid, HOURS_PER_WEEK, SECONDS_PER_HOUR
+from Lot_Calendar import DEFAULT_TIMEZONE
+
+# Short-range availability forecasts from a seasonal profile.
+#
+# Each lot's profile is the exponentially weighted mean and spread of its snapshot
+# counts per (day of week x 30-minute bin) in the lot's time zone. Weights halve every
+# FORECAST_HALF_LIFE_DAYS, so the profile follows slow drift, and because decay is
+# multiplicative the profile can be advanced with only the snapshots that arrived
+# since the last fit. A forecast is the profile ahead of now plus today's current
+# deviation from it, fading out over FORECAST_DEVIATION_TAU_SEC.
+#
+# Profiles are advanced in an executor while requests read them on the event loop, so
+# a profile is never changed in place: advancing builds new arrays in a new profile,
+# and the lot's model is replaced by a single assignment once it is complete.
+
+BINS_PER_HOUR = 2
+BIN_SECONDS = SECONDS_PER_HOUR // BINS_PER_HOUR
+N_BINS = HOURS_PER_WEEK * BINS_PER_HOUR
+
+FORECAST_HISTORY_DAYS = int(os.getenv("FORECAST_HISTORY_DAYS", "56"))   # initial fit
+FORECAST_HALF_LIFE_DAYS = float(os.getenv("FORECAST_HALF_LIFE_DAYS", "28"))
+FORECAST_REFRESH_SEC = 60           # a lot's profile is advanced at most this often
+FORECAST_INGEST_LAG_SEC = 60        # snapshots younger than this may not be committed yet
+FORECAST_DEVIATION_TAU_SEC = 2 * SECONDS_PER_HOUR
+FORECAST_MAX_HOURS = 24
+BAND_Z = 1.2816                     # 10th / 90th percentile of a normal spread
+
+
+def week_bins(epochs, tz):
+    """Day-of-week x half-hour bin (Monday 00:00 = 0) of each epoch, in local time."""
+    epochs = np.asarray(epochs, dtype=np.float64)
+    if not len(epochs):
+        return np.zeros(0, dtype=np.int64)
+    bounds, how, _ = local_hour_grid(float(epochs.min()), float(epochs.max()) + 1, tz)
+    hour = np.clip(np.searchsorted(bounds, epochs, side="right") - 1, 0, len(how) - 1)
+    half = ((epochs - bounds[hour]) >= BIN_SECONDS).astype(np.int64)
+    return how[hour] * BINS_PER_HOUR + half
+
+
+class SeasonalProfile:
+    """Weighted sums per week bin, all expressed as of `fitted_until`. Not changed once
+    built; advanced() returns a new profile."""
+
+    def __init__(self, tz, half_life_sec=FORECAST_HALF_LIFE_DAYS * 86400):
+        self.tz = tz
+        self.half_life_sec = half_life_sec
+        self.w = np.zeros(N_BINS)
+        self.wx = np.zeros(N_BINS)
+        self.wxx = np.zeros(N_BINS)
+        self.fitted_until = None
+        self.observations = 0
+        self.last_epoch = None
+        self.last_value = None
+
+    def advanced(self, epochs, values, until):
+        """A new profile with snapshots from (fitted_until, until] folded in, as of `until`."""
+        epochs = np.asarray(epochs, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float64)
+        decay = 1.0 if self.fitted_until is None else 0.5 ** ((until - self.fitted_until) / self.half_life_sec)
+        new = SeasonalProfile(self.tz, self.half_life_sec)
+        new.w, new.wx, new.wxx = self.w * decay, self.wx * decay, self.wxx * decay
+        new.observations, new.last_epoch, new.last_value = self.observations, self.last_epoch, self.last_value
+        if len(epochs):
+            weight = 0.5 ** ((until - epochs) / self.half_life_sec)
+            bins = week_bins(epochs, self.tz)
+            new.w += np.bincount(bins, weights=weight, minlength=N_BINS)
+            new.wx += np.bincount(bins, weights=weight * values, minlength=N_BINS)
+            new.wxx += np.bincount(bins, weights=weight * values * values, minlength=N_BINS)
+            new.observations += len(epochs)
+            latest = int(np.argmax(epochs))
+            new.last_epoch, new.last_value = float(epochs[latest]), float(values[latest])
+        new.fitted_until = until
+        return new
+
+    def mean_std(self):
+        """Per-bin mean and standard deviation; bins never observed take the overall values."""
+        total = self.w.sum()
+        overall = self.wx.sum() / total if total > 0 else 0.0
+        seen = self.w > 0
+        mean = np.full(N_BINS, overall)
+        np.divide(self.wx, self.w, out=mean, where=seen)
+        var = np.zeros(N_BINS)
+        np.divide(self.wxx, self.w, out=var, where=seen)
+        var = np.where(seen, var - mean ** 2, np.nan)
+        overall_var = np.nanmean(var) if seen.any() else 0.0
+        std = np.sqrt(np.clip(np.where(seen, var, overall_var), 0.0, None))
+        return mean, std
+
+    def forecast(self, now_epoch, hours, capacity=None):
+        """(target epochs, predicted, low, high) every 30 minutes for the next `hours`."""
+        start = (np.floor(now_epoch / BIN_SECONDS) + 1) * BIN_SECONDS
+        targets = start + BIN_SECONDS * np.arange(int(hours * BINS_PER_HOUR))
+        mean, std = self.mean_std()
+        bins = week_bins(targets, self.tz)
+        predicted = mean[bins].copy()
+        if self.last_epoch is not None:
+            # today's deviation from the usual level, fading with lead time
+            deviation = self.last_value - mean[week_bins([self.last_epoch], self.tz)[0]]
+            predicted += deviation * np.exp(-(targets - self.last_epoch) / FORECAST_DEVIATION_TAU_SEC)
+        low, high = predicted - BAND_Z * std[bins], predicted + BAND_Z * std[bins]
+        upper = capacity if capacity is not None else np.inf
+        return (targets, np.clip(predicted, 0, upper), np.clip(low, 0, upper), np.clip(high, 0, upper))
+
+
+def fetch_snapshots(conn, lot_id, start_epoch, end_epoch):
+    """(epochs, counts) of the lot's snapshots in [start, end)."""
+    start = datetime.fromtimestamp(start_epoch, timezone.utc).replace(tzinfo=None)
+    end = datetime.fromtimestamp(end_epoch, timezone.utc).replace(tzinfo=None)
+    epochs, counts = run_query(conn, "availability_series", (lot_id, start, end), binary=True).fetchone()
+    return np.asarray(epochs, dtype=np.float64), np.asarray(counts, dtype=np.float64)
+
+
+class _LotModel:
+    __slots__ = ("profile", "capacity", "refreshed_at")
+
+    def __init__(self, profile, capacity, refreshed_at=0.0):
+        self.profile = profile
+        self.capacity = capacity
+        self.refreshed_at = refreshed_at
+
+
+class ForecastModels:
+    """A SeasonalProfile per lot, advanced with new snapshots on use. `timezone_of` is a
+    callable lot_id -> ZoneInfo; a lot whose zone changed is fitted again."""
+
+    def __init__(self, timezone_of=None):
+        self.timezone_of = timezone_of or (lambda lot_id: zoneinfo.ZoneInfo(DEFAULT_TIMEZONE))
+        self._models = {}
+        self._locks = {}
+
+    def refresh(self, lot_id):
+        """Fit (first call) or advance a lot's profile. Blocking. Readers keep the model
+        they hold; the lot's entry is swapped for the new one when it is ready."""
+        until = time.time() - FORECAST_INGEST_LAG_SEC
+        tz = self.timezone_of(lot_id)
+        model = self._models.get(lot_id)
+        profile = model.profile if model is not None and model.profile.tz == tz else None
+        with get_connection_pool().connection() as conn:
+            capacity = run_query(conn, "lot_stall_count", (lot_id,)).fetchone()[0]
+            if profile is None:
+                profile = SeasonalProfile(tz)
+                since = until - FORECAST_HISTORY_DAYS * 86400
+            else:
+                since = profile.fitted_until
+            epochs, counts = fetch_snapshots(conn, lot_id, since, until)
+        model = _LotModel(profile.advanced(epochs, counts, until), capacity, time.time())
+        self._models[lot_id] = model
+        return model
+
+    async def get(self, lot_id):
+        model = self._models.get(lot_id)
+        if model is not None and time.time() - model.refreshed_at < FORECAST_REFRESH_SEC:
+            return model
+        lock = self._locks.setdefault(lot_id, asyncio.Lock())
+        async with lock:
+            model = self._models.get(lot_id)
+            if model is not None and time.time() - model.refreshed_at < FORECAST_REFRESH_SEC:
+                return model
+            return await asyncio.get_running_loop().run_in_executor(None, self.refresh, lot_id)
+
+    async def forecast(self, lot_id, hours):
+        """Forecast payload for the endpoint, or None for a lot without stalls."""
+        model = await self.get(lot_id)
+        if not model.capacity:
+            return None
+        profile = model.profile
+        targets, predicted, low, high = profile.forecast(time.time(), hours, model.capacity)
+        return {
+            "lot_id": lot_id,
+            "timezone": str(profile.tz),
+            "labels": [datetime.fromtimestamp(t, profile.tz).strftime("%a %I:%M %p") for t in targets.tolist()],
+            "t": (targets * 1000).astype(np.int64).tolist(),
+            "data": np.round(predicted).astype(int).tolist(),
+            "low": np.floor(low).astype(int).tolist(),
+            "high": np.ceil(high).astype(int).tolist(),
+            "last_observed": (None if profile.last_epoch is None else {
+                "at": datetime.fromtimestamp(profile.last_epoch, profile.tz).isoformat(),
+                "available": int(profile.last_value),
+            }),
+            "observations": profile.observations,
+        }
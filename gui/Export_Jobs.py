@@ -0,0 +1,317 @@
+import os
+import csv
+import glob
+import io
+import time
+import uuid
+import secrets
+import hashlib
+import threading
+from typing import NamedTuple, Callable
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from zipfile import ZipFile, ZIP_DEFLATED
+import numpy as np
+import psycopg
+from ParkingLot_Database_Utils import get_connection_pool, get_conninfo
+from ParkingLot_Queries import SESSIONS_EXPORT_COPY_SQL
+from Query_Registry import run_query
+from Occupancy_Heatmap import daily_occupied_hours
+
+# Background export jobs.
+#
+# A job is planned on submit: its range is resolved and the lot's sessions overlapping
+# that range are fingerprinted (the lot_sessions_version query). Range plus fingerprint
+# name the artifact under FILES_VOLUME/exports, so a repeated request is answered from
+# disk until a session is added or closes, from any worker process. While a session in
+# the range is open its hours grow, so the range end, rounded to the precision the
+# export is written at, is part of the fingerprint as well. Otherwise the job runs on
+# a small executor that caps concurrent exports; the rest wait queued. Requesters of
+# the same artifact share its job. Each submit gets its own hold token, and cancelling
+# releases only that hold; the job is cancelled once no hold is left.
+
+FILES_VOLUME = os.getenv("FILES_VOLUME", "/data/shared")
+EXPORT_DIR = os.path.join(FILES_VOLUME, "exports")
+EXPORT_JOB_WORKERS = int(os.getenv("EXPORT_JOB_WORKERS", "2"))
+EXPORT_MAX_QUEUED = 20
+JOB_RETENTION_SEC = 3600          # finished jobs stay pollable this long
+ARTIFACT_MAX_AGE_SEC = 7 * 86400  # artifacts nobody rebuilt for a week are removed
+HISTORY_HOURS_DECIMALS = 2        # occupied hours in the stall history CSVs
+HISTORY_END_STEP_SEC = 36         # 0.01 h: histories run up to now rounded down to this
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+class ExportBusyError(Exception):
+    """Too many export jobs are queued already."""
+
+
+class ExportPlan(NamedTuple):
+    key: str                      # artifact name without extension: <prefix>_<data version>
+    prefix: str                   # same request, any data version
+    filename: str                 # name offered to the client
+    total: int                    # work units for progress
+    build: Callable               # build(job, path)
+
+
+class ExportJob:
+    def __init__(self, kind, lot_id, plan, path):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.lot_id = lot_id
+        self.plan = plan
+        self.path = path
+        self.status = "queued"            # queued | running | done | failed | cancelled
+        self.progress = 0.0
+        self.cached = False
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.holds = set()                 # one token per submit sharing this job; guarded by the manager's lock
+        self._cancel = threading.Event()
+
+    def report(self, done):
+        """Record progress (work units done) and stop here if the job was cancelled."""
+        if self.plan.total:
+            self.progress = min(1.0, done / self.plan.total)
+        if self._cancel.is_set():
+            raise ExportCancelled
+
+    def to_dict(self):
+        out = {
+            "id": self.id,
+            "kind": self.kind,
+            "lot_id": self.lot_id,
+            "status": self.status,
+            "progress": round(self.progress, 3),
+            "cached": self.cached,
+            "filename": self.plan.filename,
+            "created_at": datetime.fromtimestamp(self.created_at, timezone.utc).isoformat(),
+            "finished_at": (datetime.fromtimestamp(self.finished_at, timezone.utc).isoformat()
+                            if self.finished_at else None),
+        }
+        if self.error:
+            out["error"] = self.error
+        if self.status == "done":
+            out["download_url"] = f"/api/exports/{self.id}/download"
+        return out
+
+
+# ----- plans -------------------------------------------------------------
+def _sessions_version(conn, lot_id, start_utc, end_utc):
+    total, closed, last_id, exit_sum = run_query(conn, "lot_sessions_version",
+                                                 {"lot_id": lot_id, "start": start_utc, "end": end_utc}).fetchone()
+    version = f"{total}:{closed}:{last_id}:{exit_sum}"
+    if closed < total:                    # open sessions count up to the range end
+        version += f":{end_utc:%Y%m%dT%H%M%S}"
+    digest = hashlib.sha1(version.encode()).hexdigest()[:12]
+    return total, digest
+
+
+def _days_suffix(days):
+    return {"all": "all_time", "365": "12months", "30": "30days", "7": "7days"}.get(days, f"{days}days")
+
+
+def plan_stall_histories(conn, lot_id, local_tz, days="7"):
+    """Per-stall daily occupied hours as one CSV per stall in a ZIP, the layout of
+    /api/stall_histories_zip. Computed lot-wide from a single session query, up to now
+    rounded down to HISTORY_END_STEP_SEC."""
+    now_ts = time.time()
+    now = datetime.fromtimestamp(now_ts - now_ts % HISTORY_END_STEP_SEC, local_tz)
+    if days == "all":
+        first = run_query(conn, "lot_first_session", (lot_id,)).fetchone()[0]
+        first_day = first.astimezone(local_tz).date() if first else now.date()
+        start_dt = datetime(first_day.year, first_day.month, first_day.day, tzinfo=local_tz)
+    else:
+        start_dt = now.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=int(days) - 1)
+    start_utc, end_utc = start_dt.astimezone(timezone.utc), now.astimezone(timezone.utc)
+    suffix = _days_suffix(days)
+    # relative ranges move every day, so today's date is part of the name
+    prefix = f"stall_histories_lot{lot_id}_{suffix}_{now:%Y%m%d}"
+    _, version = _sessions_version(conn, lot_id, start_utc, end_utc)
+    stalls = run_query(conn, "stall_numbers", (lot_id,)).fetchall()
+
+    def build(job, path):
+        with get_connection_pool().connection() as c:
+            n_stalls = run_query(c, "lot_stall_count", (lot_id,)).fetchone()[0]
+            numbers, entries, exits = run_query(c, "lot_sessions_in_range",
+                                                (lot_id, start_utc, end_utc, start_utc,
+                                                 start_utc, end_utc, end_utc), binary=True).fetchone()
+        job.report(1)
+        dates, hours = daily_occupied_hours(numbers, entries, exits, n_stalls,
+                                            start_dt.timestamp(), now.timestamp(), local_tz)
+        labels = [d.strftime("%b %d, %Y") for d in dates]
+        # all-time histories start at each stall's own first session, as the stall view does
+        numbers = np.asarray(numbers, dtype=np.int64)
+        first_col = {}
+        if days == "all" and len(numbers):
+            day_starts = np.array([datetime(d.year, d.month, d.day, tzinfo=local_tz).timestamp()
+                                   for d in dates])
+            order = np.argsort(entries)
+            seen, idx = np.unique(numbers[order], return_index=True)
+            first_entry = np.asarray(entries)[order][idx]
+            first_col = dict(zip(seen.tolist(),
+                                 (np.searchsorted(day_starts, first_entry, side="right") - 1).tolist()))
+        job.report(2)
+
+        with ZipFile(path, "w", ZIP_DEFLATED) as z:
+            for i, (_, snum) in enumerate(stalls):
+                num = int(snum)
+                buf = io.StringIO()
+                w = csv.writer(buf)
+                w.writerow(["date", "occupied_hours"])
+                if days == "all" and num not in first_col:
+                    w.writerow([now.date().strftime("%b %d, %Y"), 0.0])
+                else:
+                    row = hours[num] if num < n_stalls else np.zeros(len(labels))
+                    lo = max(first_col.get(num, 0), 0)
+                    w.writerows(zip(labels[lo:], np.round(row[lo:], HISTORY_HOURS_DECIMALS).tolist()))
+                z.writestr(f"lot{lot_id}_stall_{snum}_{suffix}.csv", buf.getvalue())
+                job.report(3 + i)
+
+    return ExportPlan(f"{prefix}_{version}", prefix, f"lot{lot_id}_stall_histories_{suffix}.zip",
+                      3 + len(stalls), build)
+
+
+def plan_sessions(conn, lot_id, local_tz, start_dt=None, end_dt=None):
+    """Raw sessions whose entry falls in [start_dt, end_dt) as CSV, via COPY TO STDOUT."""
+    start_utc, end_utc = start_dt.astimezone(timezone.utc), end_dt.astimezone(timezone.utc)
+    prefix = f"sessions_lot{lot_id}_{start_utc:%Y%m%dT%H%M}_{end_utc:%Y%m%dT%H%M}"
+    total, version = _sessions_version(conn, lot_id, start_utc, end_utc)
+
+    def build(job, path):
+        rows = 0
+        with psycopg.connect(autocommit=True, **get_conninfo()) as c, open(path, "wb") as f:
+            c.execute("SELECT set_config('TimeZone', %s, false)", (str(local_tz),))
+            with c.cursor().copy(SESSIONS_EXPORT_COPY_SQL, (lot_id, start_utc, end_utc)) as copy:
+                for data in copy:
+                    f.write(data)
+                    rows += 1
+                    if rows % 10000 == 0:
+                        job.report(rows)      # raising here cancels the COPY
+
+    filename = f"lot{lot_id}_sessions_{start_dt:%Y%m%d}_{end_dt:%Y%m%d}.csv"
+    return ExportPlan(f"{prefix}_{version}", prefix, filename, total + 1, build)
+
+
+EXPORT_KINDS = {
+    "stall_histories": (plan_stall_histories, ".zip"),
+    "sessions": (plan_sessions, ".csv"),
+}
+
+
+# ----- jobs ---------------------------------------------------------------
+class ExportJobManager:
+    def __init__(self, export_dir=EXPORT_DIR, workers=EXPORT_JOB_WORKERS):
+        self.export_dir = export_dir
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="export-job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, kind, lot_id, local_tz, **params):
+        """Plan an export and start it, or reuse a running job / finished artifact.
+        Returns (job, hold); the hold token is what cancel() releases.
+        Blocks on a couple of small queries, so call it off the event loop."""
+        plan_fn, ext = EXPORT_KINDS[kind]
+        with get_connection_pool().connection() as conn:
+            plan = plan_fn(conn, lot_id, local_tz, **params)
+        path = os.path.join(self.export_dir, plan.key + ext)
+
+        hold = secrets.token_urlsafe(16)
+        with self._lock:
+            self._prune()
+            for job in self._jobs.values():
+                if job.path == path and (job.status in ("queued", "running") and not job._cancel.is_set()
+                                         or job.status == "done" and os.path.exists(path)):
+                    job.holds.add(hold)
+                    return job, hold
+            job = ExportJob(kind, lot_id, plan, path)
+            job.holds.add(hold)
+            if os.path.exists(path):
+                job.status, job.progress, job.cached = "done", 1.0, True
+                job.finished_at = time.time()
+            else:
+                if sum(j.status == "queued" for j in self._jobs.values()) >= EXPORT_MAX_QUEUED:
+                    raise ExportBusyError
+                self._executor.submit(self._run, job, ext)
+            self._jobs[job.id] = job
+        return job, hold
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id, hold):
+        """Release one submit's hold; the job itself stops when none is left.
+        A hold that was never issued for this job, or was released already, changes nothing."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if job.status not in ("queued", "running"):
+                return job
+            if hold not in job.holds:
+                return job
+            job.holds.discard(hold)
+            if job.holds:
+                return job
+            job._cancel.set()
+            if job.status == "queued":
+                job.status, job.finished_at = "cancelled", time.time()
+        return job
+
+    def _run(self, job, ext):
+        if job._cancel.is_set():
+            return
+        job.status = "running"
+        os.makedirs(self.export_dir, exist_ok=True)
+        tmp = f"{job.path}.{job.id}.tmp"
+        try:
+            job.plan.build(job, tmp)
+            os.replace(tmp, job.path)         # readers never see a partial artifact
+            job.status, job.progress = "done", 1.0
+            self._remove_stale(job.plan.prefix, ext, keep=job.path)
+        except ExportCancelled:
+            job.status = "cancelled"
+        except Exception as e:
+            if job._cancel.is_set():
+                job.status = "cancelled"
+            else:
+                print(f"Export job {job.id} ({job.kind}) failed: {e}")
+                job.status, job.error = "failed", "Export failed"
+        finally:
+            job.finished_at = time.time()
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def _remove_stale(self, prefix, ext, keep):
+        """Artifacts of the same request built from older data, and any left unused for long."""
+        stale = set(glob.glob(os.path.join(self.export_dir, glob.escape(prefix) + "_*" + ext)))
+        cutoff = time.time() - ARTIFACT_MAX_AGE_SEC
+        for entry in os.scandir(self.export_dir):
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                stale.add(entry.path)
+        stale.discard(keep)
+        for old in stale:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+
+    def _prune(self):
+        cutoff = time.time() - JOB_RETENTION_SEC
+        for job_id in [j.id for j in self._jobs.values()
+                       if j.finished_at and j.finished_at < cutoff]:
+            del self._jobs[job_id]
+
+    def stats(self):
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+        return counts
+
+
+export_jobs = ExportJobManager()
@@ -0,0 +1,178 @@
+import time
+import threading
+import traceback
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from psycopg_pool import ConnectionPool
+
+# ConnectionPool with checkout accounting.
+#
+# Every checkout records how long the caller waited and, on return, how long it
+# held the connection, under the endpoint in `current_endpoint` (set per request
+# by the middleware in main.py). Connections held longer than `leak_after` seconds
+# are reported once, with the stack that checked them out.
+
+current_endpoint = contextvars.ContextVar("db_endpoint", default="-")
+# RequestProfile of the request being profiled (Request_Profiler.py), if any
+current_profile = contextvars.ContextVar("request_profile", default=None)
+
+SAMPLES_PER_SERIES = 2000           # recent wait / hold samples kept for percentiles
+
+
+class ContextThreadPoolExecutor(ThreadPoolExecutor):
+    """ThreadPoolExecutor that runs each task in the submitter's contextvars context.
+
+    loop.run_in_executor() does not carry context over to the worker thread, so
+    without this the pool would not know which endpoint a checkout belongs to.
+    """
+
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def reset_session(conn):
+    """Pool `reset` callback: undo whatever a borrower changed on the session."""
+    conn.autocommit = True
+    conn.execute("RESET ALL")           # back to the startup options, statement_timeout included
+    conn.autocommit = False
+
+
+class TimingSeries:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = deque(maxlen=SAMPLES_PER_SERIES)
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        self.samples.append(value)
+
+    def summary(self):
+        if not self.count:
+            return {"count": 0}
+        p50, p95, p99 = np.percentile(np.fromiter(self.samples, dtype=np.float64), [50, 95, 99])
+        return {
+            "count": self.count,
+            "avg_ms": round(1000 * self.total / self.count, 2),
+            "p50_ms": round(1000 * p50, 2),
+            "p95_ms": round(1000 * p95, 2),
+            "p99_ms": round(1000 * p99, 2),
+            "max_ms": round(1000 * self.max, 2),
+        }
+
+
+class _Checkout:
+    __slots__ = ("endpoint", "since", "stack", "reported")
+
+    def __init__(self, endpoint, since, stack):
+        self.endpoint = endpoint
+        self.since = since
+        self.stack = stack
+        self.reported = False
+
+
+class InstrumentedConnectionPool(ConnectionPool):
+    def __init__(self, *args, leak_after=30.0, **kwargs):
+        self.leak_after = leak_after
+        self._lock = threading.Lock()
+        self._wait = {}                  # endpoint -> TimingSeries (checkout wait)
+        self._hold = {}                  # endpoint -> TimingSeries (checkout to return)
+        self._failed = {}                # endpoint -> failed checkouts
+        self._out = {}                   # id(conn) -> _Checkout
+        self._peak_in_use = 0
+        self._saturated_checkouts = 0    # checkouts that found no idle connection
+        self._leaks_reported = 0
+        super().__init__(*args, **kwargs)
+        self._watch = threading.Thread(target=self._watch_leaks, name="pool-leak-watch", daemon=True)
+        self._watch.start()
+
+    # ----- checkout / return ---------------------------------------------
+    def getconn(self, timeout=None):
+        endpoint = current_endpoint.get()
+        saturated = self.get_stats().get("pool_available", 0) == 0
+        t0 = time.monotonic()
+        try:
+            conn = super().getconn(timeout=timeout)
+        except Exception:
+            with self._lock:
+                self._failed[endpoint] = self._failed.get(endpoint, 0) + 1
+            raise
+        now = time.monotonic()
+        profile = current_profile.get()
+        if profile is not None:
+            profile.add_pool_wait(now - t0)
+        with self._lock:
+            self._wait.setdefault(endpoint, TimingSeries()).add(now - t0)
+            self._out[id(conn)] = _Checkout(endpoint, now, traceback.extract_stack(limit=12)[:-1])
+            self._peak_in_use = max(self._peak_in_use, len(self._out))
+            if saturated:
+                self._saturated_checkouts += 1
+        return conn
+
+    def putconn(self, conn):
+        with self._lock:
+            checkout = self._out.pop(id(conn), None)
+            if checkout is not None:
+                self._hold.setdefault(checkout.endpoint, TimingSeries()).add(time.monotonic() - checkout.since)
+        super().putconn(conn)
+
+    # ----- leak detection ------------------------------------------------
+    def held_connections(self):
+        """(endpoint, seconds held, checkout stack) for every connection currently out."""
+        now = time.monotonic()
+        with self._lock:
+            return [(c.endpoint, now - c.since, c.stack) for c in self._out.values()]
+
+    def _watch_leaks(self):
+        while not self.closed:
+            time.sleep(min(5.0, self.leak_after / 2))
+            now = time.monotonic()
+            with self._lock:
+                overdue = [c for c in self._out.values()
+                           if not c.reported and now - c.since > self.leak_after]
+                for c in overdue:
+                    c.reported = True
+                    self._leaks_reported += 1
+            for c in overdue:
+                print(f"Connection held for over {self.leak_after:.0f}s by {c.endpoint}, checked out at:\n"
+                      + "".join(traceback.format_list(c.stack[-4:])))
+
+    # ----- reporting ------------------------------------------------------
+    def instrumentation(self):
+        pool_stats = self.get_stats()
+        now = time.monotonic()
+        with self._lock:
+            endpoints = sorted(set(self._wait) | set(self._hold) | set(self._failed))
+            per_endpoint = {
+                ep: {
+                    "wait": self._wait[ep].summary() if ep in self._wait else {"count": 0},
+                    "hold": self._hold[ep].summary() if ep in self._hold else {"count": 0},
+                    "failed_checkouts": self._failed.get(ep, 0),
+                }
+                for ep in endpoints
+            }
+            in_use = len(self._out)
+            longest = max((now - c.since for c in self._out.values()), default=0.0)
+            overdue = sum(now - c.since > self.leak_after for c in self._out.values())
+            totals = {
+                "in_use": in_use,
+                "peak_in_use": self._peak_in_use,
+                "saturation": round(in_use / self.max_size, 3),
+                "saturated_checkouts": self._saturated_checkouts,
+                "failed_checkouts": sum(self._failed.values()),
+                "longest_held_ms": round(1000 * longest, 1),
+                "held_past_threshold": overdue,
+                "leaks_reported": self._leaks_reported,
+            }
+        return {
+            "pool": {"min_size": self.min_size, "max_size": self.max_size,
+                     "size": pool_stats.get("pool_size"), "idle": pool_stats.get("pool_available"),
+                     "waiting": pool_stats.get("requests_waiting", 0),
+                     "leak_threshold_sec": self.leak_after, **totals},
+            "endpoints": per_endpoint,
+        }
@@ -0,0 +1,151 @@
+import os
+import time
+import asyncio
+import threading
+import numpy as np
+from Availability_Bitset import encode_bitset, bitset_count
+
+# Current stall state per lot, kept in Redis.
+#
+# Each lot is one Redis string used as a bitmap, in the Availability_Bitset layout:
+# bit i (most significant bit first, which is also how SETBIT numbers bits) is set
+# while stall number i is vacant. The write path in ParkingLot_Database_Utils.py
+# sets bits after each commit; rebuilds replace whole bitmaps from public.stalls.
+# Reads of any number of lots are one pipelined round trip of GETs.
+#
+# A bit is only ever set on a lot whose bitmap exists, so a write can never create
+# a partial bitmap that would read as "every other stall occupied"; a missing
+# bitmap means "ask Postgres". Redis is best effort: after an error it is left
+# alone for LIVE_STATE_RETRY_SEC and reads fall back to Postgres. Writes missed
+# meanwhile, or overwritten by a rebuild racing them, are corrected by the next
+# periodic rebuild (maintain()).
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis-stack:6379/0")
+LIVE_STATE_ENABLED = os.getenv("LIVE_STALL_STATE", "1") != "0"
+LIVE_STATE_PREFIX = "live_stalls:vacant:"
+LIVE_STATE_TIMEOUT_SEC = 0.25         # socket timeout; reads are expected well under a millisecond
+LIVE_STATE_RETRY_SEC = 30             # how long Redis is skipped after an error
+LIVE_STATE_REBUILD_SEC = float(os.getenv("LIVE_STATE_REBUILD_SEC", "300"))
+
+# SETBIT only when the lot's bitmap exists; returns -1 otherwise.
+_SETBIT_IF_EXISTS = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return redis.call('SETBIT', KEYS[1], ARGV[1], ARGV[2])
+end
+return -1
+"""
+
+
+def lot_key(lot_id):
+    return f"{LIVE_STATE_PREFIX}{lot_id}"
+
+
+def vacant_from_bitmap(blob):
+    """Vacant stall numbers and their count from a lot's bitmap."""
+    numbers = np.flatnonzero(np.unpackbits(np.frombuffer(blob, dtype=np.uint8))).tolist()
+    return numbers, bitset_count(blob)
+
+
+class LiveStallState:
+    def __init__(self, redis_url=REDIS_URL, enabled=LIVE_STATE_ENABLED):
+        self.redis_url = redis_url
+        self.enabled = enabled
+        self._redis = None
+        self._setbit = None
+        self._lock = threading.Lock()
+        self._down_until = 0.0
+        self.needs_rebuild = True             # set again whenever a write may have been lost
+
+    def _client(self):
+        """Redis client, or None while disabled or backing off after an error."""
+        if not self.enabled or time.monotonic() < self._down_until:
+            return None
+        if self._redis is None:
+            with self._lock:
+                if self._redis is None:
+                    import redis              # only processes that use live state load redis-py
+                    client = redis.Redis.from_url(self.redis_url, decode_responses=False,
+                                                  socket_timeout=LIVE_STATE_TIMEOUT_SEC,
+                                                  socket_connect_timeout=LIVE_STATE_TIMEOUT_SEC)
+                    self._setbit = client.register_script(_SETBIT_IF_EXISTS)
+                    self._redis = client
+        return self._redis
+
+    def _failed(self, action, e):
+        print(f"Live stall state {action} error: {e}")
+        self._down_until = time.monotonic() + LIVE_STATE_RETRY_SEC
+        self.needs_rebuild = True
+
+    def available(self):
+        return self._client() is not None
+
+    # ----- writes ------------------------------------------------------
+    def set_status(self, lot_id, stall_number, status):
+        """Write through one committed status change. Returns False if it was not applied."""
+        client = self._client()
+        if client is None:
+            if self.enabled:
+                self.needs_rebuild = True
+            return False
+        try:
+            return self._setbit(keys=[lot_key(lot_id)],
+                                args=[int(stall_number), 1 if status == "Vacant" else 0]) != -1
+        except Exception as e:
+            self._failed("write", e)
+            return False
+
+    def store(self, lots, replace=True):
+        """Write whole bitmaps: lots maps lot_id -> (vacant stall numbers, n_stalls).
+
+        replace=False only fills in lots without a bitmap (read repair)."""
+        client = self._client()
+        if client is None or not lots:
+            return False
+        try:
+            pipe = client.pipeline(transaction=True)
+            for lot_id, (vacant, n_stalls) in lots.items():
+                pipe.set(lot_key(lot_id), encode_bitset(vacant, n_stalls), nx=not replace)
+            pipe.execute()
+            return True
+        except Exception as e:
+            self._failed("store", e)
+            return False
+
+    # ----- reads -------------------------------------------------------
+    def read(self, lot_ids):
+        """lot_id -> bitmap bytes for every lot with a bitmap in Redis; {} if Redis is unavailable."""
+        client = self._client()
+        if client is None:
+            return {}
+        try:
+            pipe = client.pipeline(transaction=False)
+            for lot_id in lot_ids:
+                pipe.get(lot_key(lot_id))
+            blobs = pipe.execute()
+        except Exception as e:
+            self._failed("read", e)
+            return {}
+        return {lot_id: blob for lot_id, blob in zip(lot_ids, blobs) if blob is not None}
+
+    # ----- maintenance -------------------------------------------------
+    async def maintain(self, rebuild, interval=LIVE_STATE_REBUILD_SEC):
+        """Background task: rebuild on start, every `interval` seconds, and as soon as
+        Redis is reachable again after writes may have been lost. `rebuild` is blocking."""
+        if not self.enabled:
+            return
+        loop = asyncio.get_running_loop()
+        last = 0.0
+        while True:
+            due = time.monotonic() - last >= interval or self.needs_rebuild
+            if due and self.available():
+                self.needs_rebuild = False
+                try:
+                    await loop.run_in_executor(None, rebuild)
+                except Exception as e:
+                    print(f"Live stall state rebuild error: {e}")
+                    self.needs_rebuild = True
+                last = time.monotonic()
+            await asyncio.sleep(1)
+
+
+live_stalls = LiveStallState()
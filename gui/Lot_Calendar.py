@@ -0,0 +1,221 @@
+import sys
+import json
+import time
+import asyncio
+import argparse
+import threading
+import zoneinfo
+import numpy as np
+from datetime import datetime, date, timezone
+from User_Authentication import load_env
+from ParkingLot_Database_Utils import get_connection_pool, close_connection_pool
+from Query_Registry import run_query
+
+# Lot time zones and the local calendar of each zone.
+#
+# Every lot reports in its own IANA zone (public.lot_settings, migration 6). Day
+# and clock-hour boundaries of a zone come from a calendar instead of converting
+# each timestamp:
+#   - in Postgres, public.local_days holds each local day with its UTC bounds, and
+#     the day-based queries join it (stall_history, lot_portfolio_today);
+#   - in process, LocalCalendar keeps the UTC epoch of every local midnight from
+#     CALENDAR_FIRST_DAY to CALENDAR_LAST_DAY, and cuts ranges into local clock
+#     hours (and from there 30-minute bins) with array arithmetic; only the hours of
+#     a DST change day are converted one by one.
+#
+#   python Lot_Calendar.py show
+#   python Lot_Calendar.py set-timezone --lot 2 Europe/Berlin
+
+DEFAULT_TIMEZONE = "America/Edmonton"        # lot_settings.timezone default
+CALENDAR_FIRST_DAY = date(2000, 1, 1)        # span of public.local_days
+CALENDAR_LAST_DAY = date(2050, 12, 31)
+LOT_SETTINGS_TTL_SEC = 60                    # zone changes reach other processes this fast
+
+SECONDS_PER_HOUR = 3600
+SECONDS_PER_DAY = 86400
+
+
+class LocalCalendar:
+    """Local days of one zone as UTC epochs, and clock-hour grids cut from them."""
+
+    def __init__(self, tz, first_day=CALENDAR_FIRST_DAY, last_day=CALENDAR_LAST_DAY):
+        self.tz = tz
+        self.first_ordinal = first_day.toordinal()
+        ordinals = np.arange(self.first_ordinal, last_day.toordinal() + 2)
+        # n_days + 1 midnights: day i is [day_starts[i], day_starts[i + 1])
+        self.day_starts = np.fromiter(
+            (datetime.combine(date.fromordinal(o), datetime.min.time(), tz).timestamp()
+             for o in ordinals.tolist()), dtype=np.float64, count=len(ordinals))
+        self.weekdays = (ordinals[:-1] - 1) % 7           # date.weekday(): ordinal 1 was a Monday
+        self.dst_days = np.flatnonzero(np.diff(self.day_starts) != SECONDS_PER_DAY)
+
+    def covers(self, start_epoch, end_epoch):
+        return self.day_starts[0] <= start_epoch and end_epoch <= self.day_starts[-1]
+
+    def day_index(self, epochs):
+        """Index of the local day each epoch falls on."""
+        return np.searchsorted(self.day_starts, epochs, side="right") - 1
+
+    def midnight(self, d):
+        """Local midnight starting date `d`, as an aware UTC datetime."""
+        i = d.toordinal() - self.first_ordinal
+        if not 0 <= i < len(self.day_starts) - 1:
+            return datetime.combine(d, datetime.min.time(), self.tz).astimezone(timezone.utc)
+        return datetime.fromtimestamp(float(self.day_starts[i]), timezone.utc)
+
+    def today(self, now_utc=None):
+        """(local date, its midnight in UTC) for now."""
+        now_utc = now_utc or datetime.now(timezone.utc)
+        d = now_utc.astimezone(self.tz).date()
+        return d, self.midnight(d)
+
+    def hour_grid(self, start_epoch, end_epoch):
+        """UTC epochs of the local clock-hour boundaries covering [start, end), plus the
+        hour-of-week (Monday 00:00 = 0) and local date ordinal of each hour they start."""
+        if not self.covers(start_epoch, end_epoch + SECONDS_PER_DAY):
+            return _converted_hour_grid(start_epoch, end_epoch, self.tz)
+        day = self.day_index(start_epoch)
+        # the grid is aligned to the local day's midnight; DST shifts are whole hours in practice
+        origin = self.day_starts[day]
+        first = origin + np.floor((start_epoch - origin) / SECONDS_PER_HOUR) * SECONDS_PER_HOUR
+        bounds = np.arange(first, end_epoch + SECONDS_PER_HOUR, SECONDS_PER_HOUR)
+        starts = bounds[:-1]
+        days = self.day_index(starts)
+        hour = ((starts - self.day_starts[days]) // SECONDS_PER_HOUR).astype(np.int64)
+        how = self.weekdays[days] * 24 + hour
+        ordinal = days + self.first_ordinal
+        # hours after the change on a 23 / 25 hour day are off by one by arithmetic
+        for d in self.dst_days[np.isin(self.dst_days, days)].tolist():
+            for k in np.flatnonzero(days == d).tolist():
+                local = datetime.fromtimestamp(float(starts[k]), self.tz)
+                how[k] = local.weekday() * 24 + local.hour
+        return bounds, how, ordinal
+
+
+def _converted_hour_grid(start_epoch, end_epoch, tz):
+    """hour_grid() for ranges outside the calendar: every hour converted on its own."""
+    offset = datetime.fromtimestamp(start_epoch, tz).utcoffset().total_seconds()
+    first = np.floor((start_epoch + offset) / SECONDS_PER_HOUR) * SECONDS_PER_HOUR - offset
+    bounds = np.arange(first, end_epoch + SECONDS_PER_HOUR, SECONDS_PER_HOUR)
+    local = [datetime.fromtimestamp(b, tz) for b in bounds[:-1].tolist()]
+    how = np.fromiter((d.weekday() * 24 + d.hour for d in local), dtype=np.int64, count=len(local))
+    day = np.fromiter((d.toordinal() for d in local), dtype=np.int64, count=len(local))
+    return bounds, how, day
+
+
+_calendars = {}
+_calendars_lock = threading.Lock()
+
+
+def calendar_for(tz):
+    """The shared LocalCalendar of a zone (a ZoneInfo or its name), built on first use."""
+    key = str(tz)
+    cal = _calendars.get(key)
+    if cal is None:
+        with _calendars_lock:
+            cal = _calendars.get(key)
+            if cal is None:
+                cal = _calendars[key] = LocalCalendar(tz if isinstance(tz, zoneinfo.ZoneInfo)
+                                                      else zoneinfo.ZoneInfo(key))
+    return cal
+
+
+class LotTimezones:
+    """lot_id -> ZoneInfo from public.lot_settings, and stall_id -> lot_id from public.stalls.
+
+    Lookups only read the cache, so request handlers can call them on the event loop.
+    maintain() reloads both maps in the executor every LOT_SETTINGS_TTL_SEC, and soon
+    after a lookup of a stall or lot it does not know yet; scripts call load() once. Lots
+    without settings (no stalls yet) and unknown stalls get DEFAULT_TIMEZONE.
+    """
+
+    def __init__(self, ttl=LOT_SETTINGS_TTL_SEC):
+        self.ttl = ttl
+        self._zones = {}
+        self._stall_lots = {}
+        self._lots = frozenset()             # lots with stalls or settings
+        self.needs_reload = True             # set again by a lookup of an unknown stall or lot
+
+    def load(self):
+        """Reload both maps (blocking); each is swapped in whole."""
+        with get_connection_pool().connection() as conn:
+            zones = run_query(conn, "lot_timezones").fetchall()
+            stall_lots = run_query(conn, "stall_lots").fetchall()
+        zones = {lot_id: zoneinfo.ZoneInfo(name) for lot_id, name in zones}
+        for tz in {*zones.values(), zoneinfo.ZoneInfo(DEFAULT_TIMEZONE)}:
+            calendar_for(tz)                 # built here rather than by the first request
+        self._zones = zones
+        self._stall_lots = dict(stall_lots)
+        self._lots = frozenset(self._stall_lots.values()) | frozenset(zones)
+        self.needs_reload = False
+
+    async def maintain(self):
+        """Background task: load on start, every `ttl` seconds and when a lookup missed."""
+        loop = asyncio.get_running_loop()
+        last = 0.0
+        while True:
+            if self.needs_reload or time.monotonic() - last >= self.ttl:
+                try:
+                    await loop.run_in_executor(None, self.load)
+                except Exception as e:
+                    # keep serving the zones we have; retry on the next pass
+                    print(f"Lot time zones reload error: {e}")
+                last = time.monotonic()
+            await asyncio.sleep(1)
+
+    def get(self, lot_id):
+        return self._zones.get(lot_id) or zoneinfo.ZoneInfo(DEFAULT_TIMEZONE)
+
+    def lot_exists(self, lot_id):
+        if lot_id in self._lots:
+            return True
+        self.needs_reload = True             # a lot created since the last load shows up within a second
+        return False
+
+    def for_stall(self, stall_id):
+        lot_id = self._stall_lots.get(stall_id)
+        if lot_id is None:
+            self.needs_reload = True
+            return zoneinfo.ZoneInfo(DEFAULT_TIMEZONE)
+        return self.get(lot_id)
+
+    def calendar(self, lot_id):
+        return calendar_for(self.get(lot_id))
+
+
+lot_timezones = LotTimezones()
+
+
+def set_lot_timezone(conn, lot_id, tz_name):
+    """Set a lot's zone; its local days are filled by the lot_settings trigger."""
+    zoneinfo.ZoneInfo(tz_name)               # unknown names fail here rather than in Postgres
+    with conn.transaction():
+        conn.execute("""
+            INSERT INTO public.lot_settings (lot_id, timezone) VALUES (%s, %s)
+            ON CONFLICT (lot_id) DO UPDATE SET timezone = EXCLUDED.timezone
+        """, (lot_id, tz_name))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Lot time zones.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("show")
+    set_tz = sub.add_parser("set-timezone")
+    set_tz.add_argument("--lot", type=int, required=True)
+    set_tz.add_argument("timezone", help="IANA name, e.g. Europe/Berlin")
+    args = parser.parse_args()
+
+    load_env("./.env")
+    if get_connection_pool() is None:
+        print("Error: Database connection pool not initialized.")
+        sys.exit(1)
+    with get_connection_pool().connection() as conn:
+        if args.command == "set-timezone":
+            try:
+                set_lot_timezone(conn, args.lot, args.timezone)
+            except (zoneinfo.ZoneInfoNotFoundError, ValueError) as e:
+                print(f"Error: unknown time zone {args.timezone!r}: {e}")
+                sys.exit(1)
+        rows = run_query(conn, "lot_timezones").fetchall()
+    print(json.dumps({str(lot_id): name for lot_id, name in rows}, indent=2))
+    close_connection_pool()
@@ -0,0 +1,83 @@
+from datetime import date
+import numpy as np
+from Lot_Calendar import calendar_for
+
+# Stall occupancy per local clock hour from session intervals, in one vectorised
+# pass, then summed into an hour-of-week heatmap or into daily totals.
+#
+# The range is cut into the lot's local clock hours (so DST days have 23 or 25 of
+# them), taken from the zone's LocalCalendar. Each session adds its partial first
+# and last hour directly, and its full hours in between through a difference array,
+# so no session is ever looped over.
+
+HOURS_PER_WEEK = 168
+SECONDS_PER_HOUR = 3600
+
+
+def local_hour_grid(start_epoch, end_epoch, tz):
+    """UTC epochs of the local clock-hour boundaries covering [start, end), plus the
+    hour-of-week (Monday 00:00 = 0) and local date ordinal of each hour they start."""
+    return calendar_for(tz).hour_grid(start_epoch, end_epoch)
+
+
+def occupied_seconds_per_hour(stall_index, entries, exits, n_stalls, bounds, start_epoch, end_epoch):
+    """(n_stalls, len(bounds) - 1) occupied seconds of each stall in each hour of the grid.
+
+    `entries` / `exits` are epoch seconds; they are clipped to [start_epoch, end_epoch].
+    """
+    n_hours = len(bounds) - 1
+    stall_index = np.asarray(stall_index, dtype=np.int64)
+    entries = np.clip(np.asarray(entries, dtype=np.float64), start_epoch, end_epoch)
+    exits = np.clip(np.asarray(exits, dtype=np.float64), start_epoch, end_epoch)
+    keep = (exits > entries) & (stall_index >= 0) & (stall_index < n_stalls)
+    stall_index, entries, exits = stall_index[keep], entries[keep], exits[keep]
+
+    t0 = bounds[0]
+    k0 = np.minimum(((entries - t0) // SECONDS_PER_HOUR).astype(np.int64), n_hours - 1)
+    k1 = np.minimum(((exits - t0) // SECONDS_PER_HOUR).astype(np.int64), n_hours - 1)
+    row = stall_index * (n_hours + 1)
+    size = n_stalls * (n_hours + 1)
+
+    same = k0 == k1
+    # partial hours at both ends (or the whole session when it fits in one hour)
+    partial = np.bincount(row[same] + k0[same], weights=exits[same] - entries[same], minlength=size)
+    multi = ~same
+    partial += np.bincount(row[multi] + k0[multi], weights=bounds[k0[multi] + 1] - entries[multi],
+                           minlength=size)
+    partial += np.bincount(row[multi] + k1[multi], weights=exits[multi] - bounds[k1[multi]],
+                           minlength=size)
+    # full hours k0+1 .. k1-1 through a difference array
+    full = np.bincount(row[multi] + k0[multi] + 1, minlength=size) \
+        - np.bincount(row[multi] + k1[multi], minlength=size)
+    seconds = partial.reshape(n_stalls, n_hours + 1)[:, :n_hours] \
+        + np.cumsum(full.reshape(n_stalls, n_hours + 1), axis=1)[:, :n_hours] * SECONDS_PER_HOUR
+    return seconds
+
+
+def hour_of_week_occupancy(stall_index, entries, exits, n_stalls, start_epoch, end_epoch, tz):
+    """(n_stalls, 168) occupied fraction and (168,) observed hours per hour-of-week."""
+    bounds, how, _ = local_hour_grid(start_epoch, end_epoch, tz)
+    seconds = occupied_seconds_per_hour(stall_index, entries, exits, n_stalls, bounds,
+                                        start_epoch, end_epoch)
+    # seconds of each hour that fall inside the range (first and last may be partial)
+    observed = np.minimum(bounds[1:], end_epoch) - np.maximum(bounds[:-1], start_epoch)
+    observed_how = np.bincount(how, weights=observed, minlength=HOURS_PER_WEEK)
+    for_stall = np.arange(n_stalls)[:, None] * HOURS_PER_WEEK + how[None, :]
+    occupied_how = np.bincount(for_stall.ravel(), weights=seconds.ravel(),
+                               minlength=n_stalls * HOURS_PER_WEEK).reshape(n_stalls, HOURS_PER_WEEK)
+
+    fraction = np.divide(occupied_how, observed_how, out=np.zeros_like(occupied_how),
+                         where=observed_how > 0)
+    return np.clip(fraction, 0.0, 1.0), observed_how / SECONDS_PER_HOUR
+
+
+def daily_occupied_hours(stall_index, entries, exits, n_stalls, start_epoch, end_epoch, tz):
+    """Local dates in the range and the (n_stalls, n_dates) occupied hours on each."""
+    bounds, _, day = local_hour_grid(start_epoch, end_epoch, tz)
+    seconds = occupied_seconds_per_hour(stall_index, entries, exits, n_stalls, bounds,
+                                        start_epoch, end_epoch)
+    if not len(day):
+        return [], np.zeros((n_stalls, 0))
+    starts = np.flatnonzero(np.diff(day, prepend=day[0] - 1))
+    hours = np.add.reduceat(seconds, starts, axis=1) / SECONDS_PER_HOUR
+    return [date.fromordinal(int(d)) for d in day[starts]], hours
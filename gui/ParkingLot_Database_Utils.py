@@ -1,29 +1,40 @@
 import psycopg
 import os
 from User_Authentication import load_env
-from psycopg_pool import ConnectionPool
+from Instrumented_Pool import InstrumentedConnectionPool, reset_session
 from datetime import datetime, timezone, date, timedelta # Import datetime and timezone
 import time
+from Query_Registry import run_query
+from Live_Stall_State import live_stalls, vacant_from_bitmap
 
 # Global connection pool
 pool = None
 
+def get_conninfo():
+    """Connection parameters shared by the pool and the dedicated (LISTEN, export) connections."""
+    return {
+        "dbname": os.getenv("PG_DBNAME", "your_db"),
+        "user": os.getenv("PG_USER", "your_user"),
+        "password": os.getenv("PG_PASSWORD", "your_password"),
+        "host": os.getenv("PG_HOST", "localhost"),
+        "port": os.getenv("PG_PORT", "5432")
+    }
+
 def get_connection_pool():
     global pool
     if pool is None:
         min_conn = int(os.getenv("PG_MIN_CONNECTIONS", "1"))
         max_conn = int(os.getenv("PG_MAX_CONNECTIONS", "10"))
+        statement_timeout_ms = int(os.getenv("PG_STATEMENT_TIMEOUT_MS", "15000"))
         try:
-            pool = ConnectionPool(
+            pool = InstrumentedConnectionPool(
                 min_size=min_conn,
                 max_size=max_conn,
-                kwargs={
-                    "dbname": os.getenv("PG_DBNAME", "your_db"),
-                    "user": os.getenv("PG_USER", "your_user"),
-                    "password": os.getenv("PG_PASSWORD", "your_password"),
-                    "host": os.getenv("PG_HOST", "localhost"),
-                    "port": os.getenv("PG_PORT", "5432")
-                }
+                # a checkout that cannot be served in time fails instead of queueing forever
+                timeout=float(os.getenv("PG_POOL_TIMEOUT_SEC", "10")),
+                leak_after=float(os.getenv("PG_POOL_LEAK_SEC", "30")),
+                reset=reset_session,
+                kwargs={**get_conninfo(), "options": f"-c statement_timeout={statement_timeout_ms}"}
             )
         except Exception as e:
             print(f"Failed to create connection pool: {e}")
@@ -87,6 +98,7 @@ def insert_stalls_in_stalls_table(lot_id, stall_number, stall_type, current_stat
         if conn:
             pool.putconn(conn)
 
+    live_stalls.set_status(lot_id, stall_number, current_status)
     return 0
 
 def reset_all_stalls():
@@ -115,6 +127,7 @@ def reset_all_stalls():
         if conn:
             pool.putconn(conn)
     
+    rebuild_live_stall_state()
     return 0
 
 def get_all_vacant_stall_number_from_db(lot_id):
@@ -123,29 +136,63 @@ def get_all_vacant_stall_number_from_db(lot_id):
         print("Error: Database connection pool not initialized.")
         return []
 
-    conn = None
-    cur = None
     try:
-        conn = pool.getconn()
-        conn.autocommit = True  # Set autocommit to True for read-only operation
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT stall_number FROM public.stalls
-             WHERE current_status = %s AND lot_id = %s
-             ORDER BY stall_number;
-        """, ("Vacant", lot_id))
-        
-        rows = cur.fetchall()
+        with pool.connection() as conn:
+            rows = run_query(conn, "vacant_stall_numbers", (lot_id,)).fetchall()
         vacant_stalls = [int(row[0]) for row in rows]
         return vacant_stalls
     except Exception as e:
         print(f"SQL command execution error: {e}")
         return []
-    finally:
-        if cur:
-            cur.close()
-        if conn:
-            pool.putconn(conn)
+
+def load_live_stall_state(conn, lot_ids=None):
+    """lot_id -> (vacant stall numbers, n_stalls) from public.stalls; lot_ids None: every lot."""
+    rows = run_query(conn, "live_stall_state",
+                     {"lot_ids": list(lot_ids) if lot_ids is not None else None}).fetchall()
+    return {lot_id: (vacant, n_stalls) for lot_id, vacant, n_stalls in rows}
+
+def rebuild_live_stall_state():
+    """Replace every lot's live-state bitmap in Redis with the state in Postgres."""
+    pool = get_connection_pool()
+    if pool is None or not live_stalls.available():
+        return 1
+    try:
+        with pool.connection() as conn:
+            lots = load_live_stall_state(conn)
+    except Exception as e:
+        print(f"SQL command execution error: {e}")
+        return 1
+    live_stalls.store(lots)
+    return 0
+
+def get_vacant_stalls(lot_ids):
+    """
+    Vacant stall numbers of several lots in one call, from the live state in Redis.
+    Lots without a bitmap there (or all, while Redis is unavailable) are read from
+    Postgres in one query, and their bitmaps are written for the next read.
+    Returns ({lot_id: {"vacant": [...], "count": n}}, source), source being
+    "redis", "db" or "mixed"; lots without stalls are left out.
+    """
+    lot_ids = list(dict.fromkeys(lot_ids))
+    result = {lot_id: dict(zip(("vacant", "count"), vacant_from_bitmap(blob)))
+              for lot_id, blob in live_stalls.read(lot_ids).items()}
+    missing = [lot_id for lot_id in lot_ids if lot_id not in result]
+    if not missing:
+        return result, "redis"
+    pool = get_connection_pool()
+    if pool is None:
+        print("Error: Database connection pool not initialized.")
+        return result, "redis"
+    try:
+        with pool.connection() as conn:
+            lots = load_live_stall_state(conn, missing)
+    except Exception as e:
+        print(f"SQL command execution error: {e}")
+        return result, "redis"
+    live_stalls.store(lots, replace=False)
+    for lot_id, (vacant, _) in lots.items():
+        result[lot_id] = {"vacant": sorted(vacant), "count": len(vacant)}
+    return result, ("db" if len(missing) == len(lot_ids) else "mixed")
 
 def get_stall_id_using_stall_number_and_lot_id(stall_number, lot_id):
     if not isinstance(stall_number, str):
@@ -159,25 +206,14 @@ def get_stall_id_using_stall_number_and_lot_id(stall_number, lot_id):
         print("Error: Database connection pool not initialized.")
         return []
 
-    conn = None
-    cur = None
     try:
-        conn = pool.getconn()
-        conn.autocommit = True  # Set autocommit to True for read-only operation
-        cur = conn.cursor()
-
-        cur.execute("SELECT stall_id FROM public.stalls WHERE stall_number = %s AND lot_id = %s;", (stall_number, lot_id))
-        stall_id = cur.fetchone()[0]
+        with pool.connection() as conn:
+            stall_id = run_query(conn, "stall_id_by_number", (stall_number, lot_id)).fetchone()[0]
         return stall_id
 
     except Exception as e:
         print(f"SQL command execution error: {e}")
         return []
-    finally:
-        if cur:
-            cur.close()
-        if conn:
-            pool.putconn(conn)
 
 
 
@@ -193,11 +229,13 @@ def start_session(db_stall_id, timestamp_now,vehicle_identifier="default"):
         conn = pool.getconn()            
         cur = conn.cursor()
 
-        cur.execute("""INSERT INTO public.parkingsessions 
-                    (stall_id, entry_timestamp, vehicle_identifier) 
-                    VALUES (%s,%s,%s);""", 
-                    (db_stall_id, timestamp_now, vehicle_identifier))
+        run_query(cur, "start_session", (db_stall_id, timestamp_now, vehicle_identifier))
+        # the live state mirrors stalls.current_status, so both change together
+        run_query(cur, "set_stall_status", ("Occupied", db_stall_id))
+        stall = run_query(cur, "notify_stall_event", ("start_session", "Occupied", timestamp_now, db_stall_id)).fetchone()
         conn.commit()
+        if stall:
+            live_stalls.set_status(stall[0], stall[1], "Occupied")
         return 0
     except Exception as e:
         print(f"SQL command execution error: {e}")
@@ -219,18 +257,15 @@ def end_session(db_stall_id, timestamp_now):
     try:
         conn = pool.getconn()
         cur = conn.cursor()
-        cur.execute("""UPDATE public.parkingsessions
-                    SET exit_timestamp = %s
-                    WHERE session_id = (
-                        SELECT session_id
-                        FROM public.parkingsessions
-                        WHERE stall_id = %s
-                        AND exit_timestamp IS NULL
-                        ORDER BY entry_timestamp DESC
-                        LIMIT 1
-                    );""", 
-                    (timestamp_now, db_stall_id))
+        if run_query(cur, "end_session", (timestamp_now, db_stall_id)).rowcount == 0:
+            conn.rollback()
+            print(f"No open session for stall {db_stall_id}")
+            return 1
+        run_query(cur, "set_stall_status", ("Vacant", db_stall_id))
+        stall = run_query(cur, "notify_stall_event", ("end_session", "Vacant", timestamp_now, db_stall_id)).fetchone()
         conn.commit() # Corrected from conn.commit
+        if stall:
+            live_stalls.set_status(stall[0], stall[1], "Vacant")
         return 0
     except Exception as e:
         print(f"SQL command execution error: {e}")
@@ -262,9 +297,11 @@ def update_stall_status(lot_id, db_stall_id, status):
     try:
         conn = pool.getconn()            
         cur = conn.cursor()
-        cur.execute("""UPDATE public.stalls SET current_status = %s 
-                    WHERE lot_id = %s and stall_id = %s;""", (status, lot_id, db_stall_id))
+        run_query(cur, "update_stall_status", (status, lot_id, db_stall_id))
+        stall = run_query(cur, "notify_stall_event", ("update_stall_status", status, get_utc_now(), db_stall_id)).fetchone()
         conn.commit()
+        if stall:
+            live_stalls.set_status(stall[0], stall[1], status)
         return 0
     except Exception as e:
         print(f"SQL command execution error: {e}")
@@ -0,0 +1,468 @@
+"""SQL used by the dashboard endpoints and the stall/session write path.
+
+Kept in one place so the endpoints and the query-plan checks in
+ParkingLot_Schema_Migrations.py always look at the same statements. The request
+path runs them by name through Query_Registry.py.
+"""
+
+STALL_NUMBERS_SQL = """
+    SELECT stall_id, stall_number from public.stalls
+    WHERE lot_id = %s
+    ORDER BY CAST(stall_number AS INTEGER);
+"""
+
+STALL_LOTS_SQL = """
+    SELECT stall_id, lot_id FROM public.stalls
+"""
+
+LOT_TIMEZONES_SQL = """
+    SELECT lot_id, timezone FROM public.lot_settings
+"""
+
+STALL_NUMBER_BY_ID_SQL = """
+    SELECT stall_number FROM public.stalls WHERE stall_id = %s
+"""
+
+STALL_ID_BY_NUMBER_SQL = """
+    SELECT stall_id FROM public.stalls WHERE stall_number = %s AND lot_id = %s;
+"""
+
+VACANT_STALL_NUMBERS_SQL = """
+    SELECT stall_number FROM public.stalls
+    WHERE current_status = 'Vacant' AND lot_id = %s
+    ORDER BY stall_number;
+"""
+
+# The snapshot range compares the column with the parameters themselves (as naive
+# UTC), so a prepared plan prunes to the day's partition when it starts.
+# Params: start, now, lot_id.
+AVAILABILITY_TODAY_SQL = """
+WITH bounds AS (
+    SELECT
+        %(start)s::timestamptz AS start_utc,
+        %(now)s::timestamptz AS now_utc
+),
+-- bins are 30 minutes counted from local midnight (start_utc), not from the UTC hour,
+-- so zones offset by :45 or :30 get their own bins
+end_bin AS (
+    SELECT
+        start_utc
+        + floor(extract(epoch FROM now_utc - start_utc) / 1800) * interval '30 minutes' AS end_bin_utc
+    FROM bounds
+),
+grid AS (
+    SELECT gs AS ts_utc
+    FROM bounds, end_bin,
+        generate_series(
+            (SELECT start_utc   FROM bounds),
+            (SELECT end_bin_utc FROM end_bin),      -- inclusive current bin
+            interval '30 minutes'
+        ) gs
+),
+snap AS (
+    SELECT
+        timestamp AT TIME ZONE 'UTC' AS ts_utc,
+        available_count AS avail
+    FROM public.availabilitysnapshots
+    WHERE lot_id = %(lot_id)s
+        AND timestamp >= %(start)s::timestamptz AT TIME ZONE 'UTC'
+        AND timestamp <  %(now)s::timestamptz AT TIME ZONE 'UTC'  -- don't look into the future
+),
+binned AS (
+    SELECT
+        bin_utc,
+        avail,
+        row_number() OVER (PARTITION BY bin_utc ORDER BY ts_utc DESC) AS rn
+    FROM (
+        SELECT
+            start_utc
+            + floor(extract(epoch FROM ts_utc - start_utc) / 1800) * interval '30 minutes' AS bin_utc,
+            avail,
+            ts_utc
+        FROM snap, bounds
+    ) s
+)
+SELECT g.ts_utc, b.avail
+FROM grid g
+LEFT JOIN binned b ON b.bin_utc = g.ts_utc AND b.rn = 1
+ORDER BY g.ts_utc;
+"""
+
+STALL_DURATIONS_SQL = """
+    SELECT
+        s.stall_id,
+        s.stall_number,
+        COALESCE(
+            SUM(
+                EXTRACT(
+                    EPOCH FROM (
+                        COALESCE(LEAST(ps.exit_timestamp, %s), %s) - ps.entry_timestamp
+                    )
+                )
+            ) / 3600.0,
+        0) AS total_duration
+    FROM public.stalls s
+    LEFT JOIN public.parkingsessions ps
+        ON s.stall_id = ps.stall_id
+        AND ps.entry_timestamp >= %s
+        AND ps.entry_timestamp < %s
+        -- no exit filter: we include ongoing sessions
+    WHERE s.lot_id = %s
+    GROUP BY s.stall_id, s.stall_number
+    ORDER BY CAST(s.stall_number AS INTEGER);
+"""
+
+# MIN of the bare column, so the oldest partition's index answers it
+STALL_FIRST_SESSION_DATE_SQL = """
+    SELECT (MIN(entry_timestamp) AT TIME ZONE %s)::date
+    FROM public.parkingsessions
+    WHERE stall_id = %s
+"""
+
+# Entry time of the stall's session in progress at `at`: its latest session entering
+# before then, if that one had not ended by then. No row: the stall was vacant.
+STALL_SESSION_AT_SQL = """
+    SELECT entry_timestamp
+    FROM (
+        SELECT entry_timestamp, exit_timestamp
+        FROM public.parkingsessions
+        WHERE stall_id = %(stall_id)s
+          AND entry_timestamp < %(at)s
+        ORDER BY entry_timestamp DESC
+        LIMIT 1
+    ) prev
+    WHERE prev.exit_timestamp IS NULL OR prev.exit_timestamp > %(at)s;
+"""
+
+# Daily occupied hours of a stall, for the local days of zone tz from public.local_days.
+# Sessions of a stall never overlap, so the ones reaching into [start, end) entered from
+# `since` on: the entry of the session in progress at start (STALL_SESSION_AT_SQL), or
+# start itself. The entry range is plain parameters, so the plan only touches its
+# months' partitions. Each session then picks the local days it overlaps off the
+# (timezone, start_utc) index: none is longer than 25 hours, so they start at most
+# 25 hours before the session does. Days without any session have no row.
+# Params: tz, start, end, since, stall_id.
+STALL_HISTORY_SQL = """
+WITH sess AS (
+    SELECT
+      ps.entry_timestamp                                       AS entry_utc,
+      COALESCE(ps.exit_timestamp, %(end)s::timestamptz)        AS exit_utc
+    FROM public.parkingsessions ps
+    WHERE ps.stall_id = %(stall_id)s
+      AND ps.entry_timestamp >= %(since)s::timestamptz
+      AND ps.entry_timestamp <  %(end)s::timestamptz
+      AND COALESCE(ps.exit_timestamp, %(end)s::timestamptz) > %(start)s::timestamptz
+)
+SELECT
+  d.local_date,
+  SUM(EXTRACT(EPOCH FROM LEAST(s.exit_utc, d.end_utc)
+                         - GREATEST(s.entry_utc, d.start_utc))) / 3600.0 AS hours
+FROM sess s
+CROSS JOIN LATERAL (
+    SELECT local_date, start_utc, end_utc
+    FROM public.local_days
+    WHERE timezone = %(tz)s
+      AND start_utc >= GREATEST(%(start)s::timestamptz, s.entry_utc - interval '25 hours')
+      AND start_utc <  s.exit_utc
+      AND end_utc   >  s.entry_utc
+) d
+GROUP BY d.local_date
+ORDER BY d.local_date;
+"""
+
+START_SESSION_SQL = """
+    INSERT INTO public.parkingsessions
+    (stall_id, entry_timestamp, vehicle_identifier)
+    VALUES (%s,%s,%s);
+"""
+
+# The entry time (the partition key) lets the update touch only the session's partition.
+END_SESSION_SQL = """
+    UPDATE public.parkingsessions
+    SET exit_timestamp = %s
+    WHERE (session_id, entry_timestamp) = (
+        SELECT session_id, entry_timestamp
+        FROM public.parkingsessions
+        WHERE stall_id = %s
+        AND exit_timestamp IS NULL
+        ORDER BY entry_timestamp DESC
+        LIMIT 1
+    );
+"""
+
+UPDATE_STALL_STATUS_SQL = """
+    UPDATE public.stalls SET current_status = %s
+    WHERE lot_id = %s AND stall_id = %s;
+"""
+
+# start_session / end_session keep the stall's status in step with its sessions, in the
+# same transaction. Params: status, stall_id.
+SET_STALL_STATUS_SQL = """
+    UPDATE public.stalls SET current_status = %s
+    WHERE stall_id = %s;
+"""
+
+# Delivered to LISTEN stall_events on commit; see Stall_Event_Stream.py.
+# Params: event name, status after the event, event time, stall_id.
+# Returns the stall's lot_id and stall_number for the live-state write-through.
+STALL_EVENT_CHANNEL = "stall_events"
+
+NOTIFY_STALL_EVENT_SQL = """
+    SELECT lot_id, stall_number, pg_notify('stall_events', json_build_object(
+        'event',        %s::text,
+        'status',       %s::text,
+        'at',           %s::timestamptz,
+        'lot_id',       lot_id,
+        'stall_id',     stall_id,
+        'stall_number', stall_number
+    )::text)
+    FROM public.stalls
+    WHERE stall_id = %s;
+"""
+
+# Vacant stall numbers and stall count per lot, for Live_Stall_State.py bitmaps.
+# lot_ids NULL: every lot.
+LIVE_STALL_STATE_SQL = """
+    SELECT
+        lot_id,
+        COALESCE(array_agg(CAST(stall_number AS INTEGER)) FILTER (WHERE current_status = 'Vacant'), '{}'),
+        MAX(CAST(stall_number AS INTEGER)) + 1
+    FROM public.stalls
+    WHERE %(lot_ids)s::int[] IS NULL OR lot_id = ANY(%(lot_ids)s::int[])
+    GROUP BY lot_id;
+"""
+
+STALL_STATUSES_SQL = """
+    SELECT stall_id, stall_number, current_status FROM public.stalls
+    WHERE lot_id = %s
+    ORDER BY CAST(stall_number AS INTEGER);
+"""
+
+# Whole series in one row of two arrays: decoded straight into NumPy by a binary cursor.
+# "timestamp" is naive UTC, so the bounds are passed as naive UTC as well.
+AVAILABILITY_SERIES_SQL = """
+    SELECT
+        COALESCE(array_agg(EXTRACT(EPOCH FROM "timestamp" AT TIME ZONE 'UTC')::float8
+                           ORDER BY "timestamp"), '{}'),
+        COALESCE(array_agg(available_count ORDER BY "timestamp"), '{}')
+    FROM public.availabilitysnapshots
+    WHERE lot_id = %s
+      AND "timestamp" >= %s
+      AND "timestamp" <  %s;
+"""
+
+LOT_STALL_COUNT_SQL = """
+    SELECT COALESCE(MAX(CAST(stall_number AS INTEGER)), -1) + 1
+    FROM public.stalls
+    WHERE lot_id = %s;
+"""
+
+# Snapshot times and bitsets in one row, for Availability_Bitset.decode_many().
+AVAILABILITY_BITSETS_SQL = """
+    SELECT
+        COALESCE(array_agg(EXTRACT(EPOCH FROM "timestamp" AT TIME ZONE 'UTC')::float8
+                           ORDER BY "timestamp"), '{}'),
+        COALESCE(array_agg(available_bitset ORDER BY "timestamp"), '{}')
+    FROM public.availabilitysnapshots
+    WHERE lot_id = %s
+      AND "timestamp" >= %s
+      AND "timestamp" <  %s;
+"""
+
+# Sessions of every stall in a lot overlapping [start, end), clipped to the range and
+# returned as three arrays. Sessions of one stall never overlap, so apart from those
+# starting inside the range only each stall's latest earlier session can reach into it.
+# Both halves read each stall's slice of (stall_id, entry_timestamp). OFFSET 0 keeps the
+# first one a per-stall scan: pulled up into a plain join, the planner trades it for a
+# hash join over the whole time range whenever the ANALYZE sample tips the estimates,
+# which is slower (29 vs 17 ms over 28 days) and leaves the plan to chance.
+# Params: lot_id, start, end, start, start, end, end.
+LOT_SESSIONS_IN_RANGE_SQL = """
+WITH lot_stalls AS (
+    SELECT stall_id, CAST(stall_number AS INTEGER) AS num
+    FROM public.stalls
+    WHERE lot_id = %s
+),
+sess AS (
+    SELECT ls.num, ps.entry_timestamp, ps.exit_timestamp
+    FROM lot_stalls ls
+    CROSS JOIN LATERAL (
+        SELECT entry_timestamp, exit_timestamp
+        FROM public.parkingsessions
+        WHERE stall_id = ls.stall_id
+          AND entry_timestamp >= %s
+          AND entry_timestamp <  %s
+        OFFSET 0
+    ) ps
+    UNION ALL
+    SELECT ls.num, prev.entry_timestamp, prev.exit_timestamp
+    FROM lot_stalls ls
+    CROSS JOIN LATERAL (
+        SELECT entry_timestamp, exit_timestamp
+        FROM public.parkingsessions
+        WHERE stall_id = ls.stall_id
+          AND entry_timestamp < %s
+        ORDER BY entry_timestamp DESC
+        LIMIT 1
+    ) prev
+    WHERE prev.exit_timestamp IS NULL OR prev.exit_timestamp > %s
+)
+SELECT
+    COALESCE(array_agg(num), '{}'),
+    COALESCE(array_agg(EXTRACT(EPOCH FROM entry_timestamp)::float8), '{}'),
+    COALESCE(array_agg(EXTRACT(EPOCH FROM LEAST(COALESCE(exit_timestamp, %s), %s))::float8), '{}')
+FROM sess;
+"""
+
+# Raw sessions of a lot whose entry falls in [start, end), for COPY ... TO STDOUT.
+# Timestamps are written in the connection's TimeZone. Params: lot_id, start, end.
+SESSIONS_EXPORT_COPY_SQL = """
+    COPY (
+        SELECT ps.session_id, s.stall_number, ps.entry_timestamp, ps.exit_timestamp,
+               ps.vehicle_identifier
+        FROM public.parkingsessions ps
+        JOIN public.stalls s ON s.stall_id = ps.stall_id
+        WHERE s.lot_id = %s
+          AND ps.entry_timestamp >= %s
+          AND ps.entry_timestamp <  %s
+    ) TO STDOUT WITH (FORMAT csv, HEADER)
+"""
+
+# One page of sessions, newest first, for /api/sessions. Keyset pagination: a page
+# continues strictly below the (entry_timestamp, session_id) of the previous page's
+# last row (the first page passes (end, 0)), so every page is one index range scan
+# however deep it is. state is 'open', 'closed' or 'all'; limit is page size + 1.
+SESSIONS_PAGE_LOT_SQL = """
+    SELECT ps.session_id, ps.stall_id, s.stall_number, ps.entry_timestamp, ps.exit_timestamp,
+           ps.vehicle_identifier
+    FROM public.parkingsessions ps
+    JOIN public.stalls s ON s.stall_id = ps.stall_id
+    WHERE s.lot_id = %(lot_id)s
+      AND ps.entry_timestamp >= %(start)s
+      AND (ps.entry_timestamp, ps.session_id) < (%(before_ts)s, %(before_id)s)
+      AND (%(state)s = 'all' OR (ps.exit_timestamp IS NULL) = (%(state)s = 'open'))
+    ORDER BY ps.entry_timestamp DESC, ps.session_id DESC
+    LIMIT %(limit)s;
+"""
+
+# Same for a single stall (lot_id NULL: any lot).
+SESSIONS_PAGE_STALL_SQL = """
+    SELECT ps.session_id, ps.stall_id, s.stall_number, ps.entry_timestamp, ps.exit_timestamp,
+           ps.vehicle_identifier
+    FROM public.parkingsessions ps
+    JOIN public.stalls s ON s.stall_id = ps.stall_id
+    WHERE ps.stall_id = %(stall_id)s
+      AND (%(lot_id)s::int IS NULL OR s.lot_id = %(lot_id)s::int)
+      AND ps.entry_timestamp >= %(start)s
+      AND (ps.entry_timestamp, ps.session_id) < (%(before_ts)s, %(before_id)s)
+      AND (%(state)s = 'all' OR (ps.exit_timestamp IS NULL) = (%(state)s = 'open'))
+    ORDER BY ps.entry_timestamp DESC, ps.session_id DESC
+    LIMIT %(limit)s;
+"""
+
+# Cheap fingerprint of a lot's sessions overlapping [start, end): changes when a session
+# is added or closes, including one that entered before start and is still running into
+# the range. The halves are those of LOT_SESSIONS_IN_RANGE_SQL. Also gives the row count
+# for export progress, and how many of the sessions are still open.
+# Params: lot_id, start, end.
+LOT_SESSIONS_VERSION_SQL = """
+WITH lot_stalls AS (
+    SELECT stall_id FROM public.stalls WHERE lot_id = %(lot_id)s
+),
+sess AS (
+    SELECT ps.session_id, ps.exit_timestamp
+    FROM lot_stalls ls
+    CROSS JOIN LATERAL (
+        SELECT session_id, exit_timestamp
+        FROM public.parkingsessions
+        WHERE stall_id = ls.stall_id
+          AND entry_timestamp >= %(start)s
+          AND entry_timestamp <  %(end)s
+        OFFSET 0
+    ) ps
+    UNION ALL
+    SELECT prev.session_id, prev.exit_timestamp
+    FROM lot_stalls ls
+    CROSS JOIN LATERAL (
+        SELECT session_id, exit_timestamp
+        FROM public.parkingsessions
+        WHERE stall_id = ls.stall_id
+          AND entry_timestamp < %(start)s
+        ORDER BY entry_timestamp DESC
+        LIMIT 1
+    ) prev
+    WHERE prev.exit_timestamp IS NULL OR prev.exit_timestamp > %(start)s
+)
+SELECT COUNT(*), COUNT(exit_timestamp), COALESCE(MAX(session_id), 0),
+       COALESCE(SUM(EXTRACT(EPOCH FROM exit_timestamp)), 0)
+FROM sess;
+"""
+
+LOT_FIRST_SESSION_SQL = """
+    SELECT MIN(ps.entry_timestamp)
+    FROM public.parkingsessions ps
+    JOIN public.stalls s ON s.stall_id = ps.stall_id
+    WHERE s.lot_id = %s;
+"""
+
+# Today's KPIs for many lots in one statement: one grouped pass over each table. A lot's
+# "today" is its current local day from public.local_days, in the lot's own zone (local
+# dates are within a day of the UTC date, which keeps that lookup on the primary key).
+# A NULL lot_ids array means every lot with stalls. Sessions follow STALL_DURATIONS_SQL
+# (entered today, open ones counted up to now). Every lot's day started after `since`
+# (now - 26 hours; `since_naive` / `now_naive` for the naive UTC snapshot column),
+# which keeps the plan off older partitions.
+# Params: lot_ids, now, since, now_naive, since_naive.
+LOT_PORTFOLIO_TODAY_SQL = """
+WITH lots AS (
+    SELECT st.lot_id, ls.timezone, d.local_date, d.start_utc, d.end_utc,
+           COUNT(*) AS stalls,
+           COUNT(*) FILTER (WHERE st.current_status = 'Occupied') AS occupied
+    FROM public.stalls st
+    JOIN public.lot_settings ls ON ls.lot_id = st.lot_id
+    JOIN public.local_days d
+      ON d.timezone = ls.timezone
+     AND d.local_date BETWEEN (%(now)s::timestamptz AT TIME ZONE 'UTC')::date - 1
+                          AND (%(now)s::timestamptz AT TIME ZONE 'UTC')::date + 1
+     AND d.start_utc <= %(now)s::timestamptz
+     AND d.end_utc   >  %(now)s::timestamptz
+    WHERE %(lot_ids)s::int[] IS NULL OR st.lot_id = ANY(%(lot_ids)s::int[])
+    GROUP BY st.lot_id, ls.timezone, d.local_date, d.start_utc, d.end_utc
+),
+sess AS (
+    SELECT l.lot_id,
+           SUM(EXTRACT(EPOCH FROM COALESCE(LEAST(ps.exit_timestamp, %(now)s), %(now)s)
+                                  - ps.entry_timestamp)) / 3600.0 AS occupied_hours,
+           COUNT(*) AS arrivals,
+           COUNT(*) FILTER (WHERE ps.exit_timestamp <= %(now)s) AS departures
+    FROM lots l
+    JOIN public.stalls s ON s.lot_id = l.lot_id
+    JOIN public.parkingsessions ps ON ps.stall_id = s.stall_id
+    WHERE ps.entry_timestamp >= %(since)s
+      AND ps.entry_timestamp >= l.start_utc
+      AND ps.entry_timestamp <  l.end_utc
+    GROUP BY l.lot_id
+),
+snap AS (
+    SELECT l.lot_id, a.*
+    FROM lots l
+    CROSS JOIN LATERAL (
+        SELECT MAX(available_count) AS peak,
+               MIN(available_count) AS trough,
+               (array_agg("timestamp" ORDER BY available_count DESC, "timestamp"))[1] AS peak_at,
+               (array_agg("timestamp" ORDER BY available_count, "timestamp"))[1]      AS trough_at
+        FROM public.availabilitysnapshots
+        WHERE lot_id = l.lot_id
+          AND "timestamp" >= %(since_naive)s
+          AND "timestamp" >= l.start_utc AT TIME ZONE 'UTC'
+          AND "timestamp" <  %(now_naive)s
+    ) a
+)
+SELECT l.lot_id, l.timezone, l.local_date, l.stalls, l.occupied,
+       COALESCE(ss.occupied_hours, 0), COALESCE(ss.arrivals, 0), COALESCE(ss.departures, 0),
+       sn.peak, sn.peak_at, sn.trough, sn.trough_at
+FROM lots l
+LEFT JOIN sess ss USING (lot_id)
+LEFT JOIN snap sn USING (lot_id)
+ORDER BY l.lot_id;
+"""
@@ -0,0 +1,732 @@
+import os
+import sys
+import json
+import argparse
+import functools
+import zoneinfo
+from typing import NamedTuple
+from datetime import datetime, timedelta, timezone
+from psycopg import ClientCursor, errors
+from User_Authentication import load_env
+from ParkingLot_Database_Utils import get_connection_pool, close_connection_pool
+from Partition_Manager import verify_partitions
+from Lot_Calendar import DEFAULT_TIMEZONE
+from ParkingLot_Queries import (STALL_NUMBERS_SQL, AVAILABILITY_TODAY_SQL, STALL_DURATIONS_SQL,
+                                STALL_FIRST_SESSION_DATE_SQL, STALL_SESSION_AT_SQL, STALL_HISTORY_SQL,
+                                END_SESSION_SQL, LOT_SESSIONS_IN_RANGE_SQL, LOT_PORTFOLIO_TODAY_SQL,
+                                SESSIONS_PAGE_LOT_SQL, SESSIONS_PAGE_STALL_SQL)
+
+# Versioned schema migrations plus checks that the hot queries keep using their indexes.
+#
+#   python ParkingLot_Schema_Migrations.py migrate
+#   python ParkingLot_Schema_Migrations.py verify          (indexes and monthly partitions)
+#   python ParkingLot_Schema_Migrations.py check-plans [--update-baseline]
+#
+# check-plans is meant to run against a database seeded by ParkingLot_Synthetic_Data.py,
+# which ends with ANALYZE. The baseline is recorded on a fresh database after migrate and
+# `ParkingLot_Synthetic_Data.py --lots 1 2 --days 90`, the flow in readme.txt.
+
+MIGRATION_LOCK_ID = 7406001      # pg_advisory_lock key, so two app processes never migrate at once
+PLAN_BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "query_plan_baseline.json")
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    statements: list                 # SQL, or step(conn) for work that commits in batches
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+    transactional: bool = True
+
+
+class PartitionRebuild(NamedTuple):
+    """A table rebuilt as <table>_new, partitioned by month, while the old one stays live."""
+    table: str
+    id_column: str                   # the old primary key; rows are copied in ranges of it
+    key_column: str                  # partition key, part of the new primary key
+    columns: tuple
+    sequence: str                    # serial sequence of id_column, handed to the new table
+    bounds_sql: str                  # (first, last) month with rows in the old table, as dates
+    create_sql: list                 # the new parent and its indexes; names end in _new until the swap
+    after_swap: list = []
+
+
+PARTITION_COPY_BATCH = 50_000        # rows per copy transaction
+PARTITION_SWAP_LOCK_TIMEOUT = "5s"   # the swap waits this long for running writers, then retries
+PARTITION_SWAP_ATTEMPTS = 20
+
+
+def rebuild_partitioned(conn, spec):
+    """Migration step: replace spec.table with a monthly-partitioned copy without a long
+    write outage. Runs in autocommit mode and can be re-run after an interruption.
+
+    1. <table>_new is created with its partitions and indexes, and an AFTER trigger on
+       the old table mirrors every insert, update and delete into it from then on.
+    2. Existing rows are copied in PARTITION_COPY_BATCH ranges of the id, each its own
+       transaction; rows the trigger wrote already win over the copied ones.
+    3. A short transaction takes the old table's lock (bounded by lock_timeout, retried),
+       drops it and renames the new table, its indexes and constraints into place.
+    Rows deleted from the old table while step 2 runs may come back; nothing deletes
+    from an unpartitioned table in the app.
+    """
+    table, new = spec.table, f"{spec.table}_new"
+    if conn.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)",
+                    (f"public.{table}",)).fetchone()[0] == "p":
+        return
+    cols = ", ".join(f'"{c}"' for c in spec.columns)
+    key = f'"{spec.id_column}", "{spec.key_column}"'
+    values = ", ".join(f'NEW."{c}"' for c in spec.columns)
+    updates = ", ".join(f'"{c}" = EXCLUDED."{c}"' for c in spec.columns
+                        if c not in (spec.id_column, spec.key_column))
+
+    with conn.transaction():
+        for stmt in spec.create_sql:
+            conn.execute(stmt)
+        first, last = conn.execute(spec.bounds_sql).fetchone()
+        today = datetime.now(timezone.utc).date()
+        conn.execute("SELECT public.create_month_partitions(%s, %s, %s, %s)",
+                     (new, first or today, max(last or today, today + timedelta(days=92)), table))
+        conn.execute(f"""
+            CREATE OR REPLACE FUNCTION public.{table}_mirror()
+            RETURNS trigger LANGUAGE plpgsql AS $$
+            BEGIN
+                IF TG_OP <> 'INSERT' THEN
+                    DELETE FROM public.{new} WHERE ({key}) = (OLD."{spec.id_column}", OLD."{spec.key_column}");
+                END IF;
+                IF TG_OP <> 'DELETE' THEN
+                    INSERT INTO public.{new} ({cols}) VALUES ({values})
+                    ON CONFLICT ({key}) DO UPDATE SET {updates};
+                END IF;
+                RETURN NULL;
+            END $$
+        """)
+        conn.execute(f"""
+            CREATE OR REPLACE TRIGGER {table}_mirror
+                AFTER INSERT OR UPDATE OR DELETE ON public.{table}
+                FOR EACH ROW EXECUTE FUNCTION public.{table}_mirror()
+        """)
+
+    # rows above hi were written after the trigger, which copied them already
+    lo, hi = conn.execute(f'SELECT MIN("{spec.id_column}"), MAX("{spec.id_column}") FROM public.{table}').fetchone()
+    copied = 0
+    for start in range(lo or 0, (hi or -1) + 1, PARTITION_COPY_BATCH):
+        copied += conn.execute(f"""
+            INSERT INTO public.{new} ({cols})
+            SELECT {cols} FROM public.{table}
+            WHERE "{spec.id_column}" >= %s AND "{spec.id_column}" < %s
+            ON CONFLICT ({key}) DO NOTHING
+        """, (start, start + PARTITION_COPY_BATCH)).rowcount
+
+    for attempt in range(1, PARTITION_SWAP_ATTEMPTS + 1):
+        try:
+            with conn.transaction():
+                conn.execute(f"SET LOCAL lock_timeout = '{PARTITION_SWAP_LOCK_TIMEOUT}'")
+                conn.execute(f"LOCK TABLE public.{table} IN ACCESS EXCLUSIVE MODE")
+                conn.execute(f"ALTER SEQUENCE public.{spec.sequence} OWNED BY NONE")
+                conn.execute(f"DROP TABLE public.{table}")          # and the mirror trigger with it
+                conn.execute(f"DROP FUNCTION public.{table}_mirror()")
+                conn.execute(f"ALTER TABLE public.{new} RENAME TO {table}")
+                # constraints first: renaming the primary key renames its index too
+                for (name,) in conn.execute("SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(%s)",
+                                            (f"public.{table}",)).fetchall():
+                    if name.endswith("_new"):
+                        conn.execute(f'ALTER TABLE public.{table} RENAME CONSTRAINT "{name}" TO "{name[:-4]}"')
+                for (name,) in conn.execute("""
+                    SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+                    WHERE i.indrelid = to_regclass(%s)
+                """, (f"public.{table}",)).fetchall():
+                    if name.endswith("_new"):
+                        conn.execute(f'ALTER INDEX public."{name}" RENAME TO "{name[:-4]}"')
+                conn.execute(f'ALTER SEQUENCE public.{spec.sequence} OWNED BY public.{table}."{spec.id_column}"')
+                for stmt in spec.after_swap:
+                    conn.execute(stmt)
+            break
+        except errors.LockNotAvailable:
+            print(f"  {table}: writers still running, swap attempt {attempt} timed out")
+    else:
+        raise RuntimeError(f"{table}: could not lock the table for the swap; re-run migrate")
+    # autovacuum analyzes the partitions but never a partitioned parent
+    conn.execute(f"ANALYZE public.{table}")
+    print(f"  {table}: {copied} rows copied in batches of {PARTITION_COPY_BATCH}, swapped in")
+
+
+MIGRATIONS = [
+    Migration(1, "base tables", [
+        """
+        CREATE TABLE IF NOT EXISTS public.stalls (
+            stall_id        serial PRIMARY KEY,
+            lot_id          integer NOT NULL,
+            stall_number    varchar(16) NOT NULL,
+            stall_type      varchar(32) NOT NULL DEFAULT 'Regular',
+            current_status  varchar(16) NOT NULL DEFAULT 'Vacant',
+            is_operational  boolean NOT NULL DEFAULT true
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS public.parkingsessions (
+            session_id          bigserial PRIMARY KEY,
+            stall_id            integer NOT NULL REFERENCES public.stalls (stall_id),
+            entry_timestamp     timestamptz NOT NULL,
+            exit_timestamp      timestamptz,
+            vehicle_identifier  varchar(64)
+        )
+        """,
+        # "timestamp" holds naive UTC; the queries convert with AT TIME ZONE 'UTC'
+        """
+        CREATE TABLE IF NOT EXISTS public.availabilitysnapshots (
+            snapshot_id       bigserial PRIMARY KEY,
+            lot_id            integer NOT NULL,
+            "timestamp"       timestamp NOT NULL,
+            available_stalls  integer[] NOT NULL DEFAULT '{}'
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS public.users (
+            user_id        serial PRIMARY KEY,
+            username       varchar(150) NOT NULL UNIQUE,
+            email          varchar(255),
+            password_hash  text NOT NULL
+        )
+        """,
+    ]),
+    Migration(2, "hot-path indexes", [
+        # end_session: "latest open session for this stall"
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS parkingsessions_open_by_stall_idx
+            ON public.parkingsessions (stall_id, entry_timestamp DESC)
+            WHERE exit_timestamp IS NULL
+        """,
+        # stall_durations / stall-history: per-stall entry range, exit read from the index
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS parkingsessions_stall_entry_idx
+            ON public.parkingsessions (stall_id, entry_timestamp) INCLUDE (exit_timestamp)
+        """,
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS availabilitysnapshots_lot_ts_idx
+            ON public.availabilitysnapshots (lot_id, "timestamp")
+        """,
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS stalls_lot_idx
+            ON public.stalls (lot_id)
+        """,
+    ], transactional=False),
+    # available_count replaces array_length() in the count queries; available_bitset is the
+    # Availability_Bitset.py layout (stall number i -> bit i, most significant bit first).
+    Migration(3, "availability bitsets", [
+        """
+        ALTER TABLE public.availabilitysnapshots
+            ADD COLUMN IF NOT EXISTS available_count  smallint,
+            ADD COLUMN IF NOT EXISTS available_bitset bytea
+        """,
+        """
+        CREATE OR REPLACE FUNCTION public.availability_bitset(stalls integer[], width_bytes integer)
+        RETURNS bytea LANGUAGE plpgsql IMMUTABLE AS $$
+        DECLARE
+            b bytea := decode(repeat('00', GREATEST(width_bytes, 0)), 'hex');
+            s integer;
+        BEGIN
+            FOREACH s IN ARRAY COALESCE(stalls, '{}') LOOP
+                IF s >= 0 AND s < width_bytes * 8 THEN
+                    -- set_bit counts from the least significant bit of each byte
+                    b := set_bit(b, (s / 8) * 8 + 7 - (s % 8), 1);
+                END IF;
+            END LOOP;
+            RETURN b;
+        END $$
+        """,
+        """
+        CREATE OR REPLACE FUNCTION public.availability_bitset_width(p_lot_id integer)
+        RETURNS integer LANGUAGE sql STABLE AS $$
+            SELECT (COALESCE(MAX(CAST(stall_number AS integer)), -1) + 8) / 8
+            FROM public.stalls WHERE lot_id = p_lot_id
+        $$
+        """,
+        """
+        UPDATE public.availabilitysnapshots a
+        SET available_count  = cardinality(a.available_stalls),
+            available_bitset = public.availability_bitset(a.available_stalls, w.width_bytes)
+        FROM (
+            SELECT lot_id, (MAX(CAST(stall_number AS integer)) + 8) / 8 AS width_bytes
+            FROM public.stalls GROUP BY lot_id
+        ) w
+        WHERE w.lot_id = a.lot_id AND a.available_bitset IS NULL
+        """,
+        """
+        CREATE OR REPLACE FUNCTION public.availabilitysnapshots_encode()
+        RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            NEW.available_count := cardinality(NEW.available_stalls);
+            NEW.available_bitset := public.availability_bitset(
+                NEW.available_stalls, public.availability_bitset_width(NEW.lot_id));
+            RETURN NEW;
+        END $$
+        """,
+        """
+        DROP TRIGGER IF EXISTS availabilitysnapshots_encode ON public.availabilitysnapshots
+        """,
+        """
+        CREATE TRIGGER availabilitysnapshots_encode
+            BEFORE INSERT OR UPDATE OF available_stalls, lot_id ON public.availabilitysnapshots
+            FOR EACH ROW EXECUTE FUNCTION public.availabilitysnapshots_encode()
+        """,
+    ]),
+    # /api/sessions: lot-wide pages walk this backwards from the cursor. Single-stall
+    # pages use parkingsessions_stall_entry_idx; only equal entry times need sorting.
+    Migration(4, "session keyset index", [
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS parkingsessions_entry_keyset_idx
+            ON public.parkingsessions (entry_timestamp, session_id)
+        """,
+    ], transactional=False),
+    # Sessions and snapshots become range-partitioned by month (UTC) on their timestamp;
+    # Partition_Manager.py creates partitions ahead and archives expired ones. Postgres
+    # cannot partition a table in place, so each table is rebuilt next to the live one
+    # and swapped in by renaming (rebuild_partitioned): writes carry on during the copy
+    # and are only held for the swap itself. The new tables keep the old table,
+    # sequence, index and trigger names. Unique keys must include the partition key,
+    # hence the wider primary keys.
+    Migration(5, "monthly partitions", [
+        # one partition per month in [first_month, last_month]; existing ones are skipped.
+        # The bounds are UTC instants; a "timestamp" key ignores the +00 and reads naive UTC.
+        # Partitions are named after part_prefix (default: the parent), so that a parent
+        # built under a temporary name already has the final partition names.
+        """
+        CREATE OR REPLACE FUNCTION public.create_month_partitions(parent text, first_month date,
+                                                                  last_month date,
+                                                                  part_prefix text DEFAULT NULL)
+        RETURNS integer LANGUAGE plpgsql AS $$
+        DECLARE
+            m date := date_trunc('month', first_month::timestamp)::date;
+            part text;
+            created integer := 0;
+        BEGIN
+            WHILE m <= last_month LOOP
+                part := format('%s_p%s', COALESCE(part_prefix, parent), to_char(m, 'YYYY_MM'));
+                IF to_regclass(format('public.%I', part)) IS NULL THEN
+                    EXECUTE format('CREATE TABLE public.%I PARTITION OF public.%I FOR VALUES FROM (%L) TO (%L)',
+                                   part, parent, m::text || ' 00:00:00+00',
+                                   (m + interval '1 month')::date::text || ' 00:00:00+00');
+                    created := created + 1;
+                END IF;
+                m := m + interval '1 month';
+            END LOOP;
+            RETURN created;
+        END $$
+        """,
+        functools.partial(rebuild_partitioned, spec=PartitionRebuild(
+            table="parkingsessions", id_column="session_id", key_column="entry_timestamp",
+            columns=("session_id", "stall_id", "entry_timestamp", "exit_timestamp", "vehicle_identifier"),
+            sequence="parkingsessions_session_id_seq",
+            bounds_sql="""
+                SELECT MIN(entry_timestamp AT TIME ZONE 'UTC')::date, MAX(entry_timestamp AT TIME ZONE 'UTC')::date
+                FROM public.parkingsessions
+            """,
+            create_sql=[
+                """
+                CREATE TABLE IF NOT EXISTS public.parkingsessions_new (
+                    session_id          bigint NOT NULL DEFAULT nextval('public.parkingsessions_session_id_seq'),
+                    stall_id            integer NOT NULL
+                                        CONSTRAINT parkingsessions_stall_id_fkey_new REFERENCES public.stalls (stall_id),
+                    entry_timestamp     timestamptz NOT NULL,
+                    exit_timestamp      timestamptz,
+                    vehicle_identifier  varchar(64),
+                    CONSTRAINT parkingsessions_pkey_new PRIMARY KEY (session_id, entry_timestamp)
+                ) PARTITION BY RANGE (entry_timestamp)
+                """,
+                """
+                CREATE INDEX IF NOT EXISTS parkingsessions_open_by_stall_idx_new
+                    ON public.parkingsessions_new (stall_id, entry_timestamp DESC)
+                    WHERE exit_timestamp IS NULL
+                """,
+                """
+                CREATE INDEX IF NOT EXISTS parkingsessions_stall_entry_idx_new
+                    ON public.parkingsessions_new (stall_id, entry_timestamp) INCLUDE (exit_timestamp)
+                """,
+                """
+                CREATE INDEX IF NOT EXISTS parkingsessions_entry_keyset_idx_new
+                    ON public.parkingsessions_new (entry_timestamp, session_id)
+                """,
+            ])),
+        functools.partial(rebuild_partitioned, spec=PartitionRebuild(
+            table="availabilitysnapshots", id_column="snapshot_id", key_column="timestamp",
+            columns=("snapshot_id", "lot_id", "timestamp", "available_stalls", "available_count",
+                     "available_bitset"),
+            sequence="availabilitysnapshots_snapshot_id_seq",
+            bounds_sql="""
+                SELECT MIN("timestamp")::date, MAX("timestamp")::date FROM public.availabilitysnapshots
+            """,
+            create_sql=[
+                """
+                CREATE TABLE IF NOT EXISTS public.availabilitysnapshots_new (
+                    snapshot_id       bigint NOT NULL DEFAULT nextval('public.availabilitysnapshots_snapshot_id_seq'),
+                    lot_id            integer NOT NULL,
+                    "timestamp"       timestamp NOT NULL,
+                    available_stalls  integer[] NOT NULL DEFAULT '{}',
+                    available_count   smallint,
+                    available_bitset  bytea,
+                    CONSTRAINT availabilitysnapshots_pkey_new PRIMARY KEY (snapshot_id, "timestamp")
+                ) PARTITION BY RANGE ("timestamp")
+                """,
+                """
+                CREATE INDEX IF NOT EXISTS availabilitysnapshots_lot_ts_idx_new
+                    ON public.availabilitysnapshots_new (lot_id, "timestamp")
+                """,
+            ],
+            # rows arrive encoded by the old table's trigger, so the new one only starts here
+            after_swap=[
+                """
+                CREATE TRIGGER availabilitysnapshots_encode
+                    BEFORE INSERT OR UPDATE OF available_stalls, lot_id ON public.availabilitysnapshots
+                    FOR EACH ROW EXECUTE FUNCTION public.availabilitysnapshots_encode()
+                """,
+            ])),
+    ], transactional=False),
+    # Each lot's IANA time zone, and every local day of each zone in use with its UTC
+    # bounds (23 or 25 hours long on DST changes), so the day-based queries join days
+    # instead of converting each row; see Lot_Calendar.py. A lot gets its settings row
+    # (with the column default) when its first stall is inserted; changing the zone
+    # fills that zone's days, and an unknown zone name fails the statement.
+    Migration(6, "lot time zones and local days", [
+        """
+        CREATE TABLE public.local_days (
+            timezone    text NOT NULL,
+            local_date  date NOT NULL,
+            start_utc   timestamptz NOT NULL,
+            end_utc     timestamptz NOT NULL,
+            PRIMARY KEY (timezone, local_date)
+        )
+        """,
+        # same span as Lot_Calendar.CALENDAR_FIRST_DAY / CALENDAR_LAST_DAY
+        """
+        CREATE OR REPLACE FUNCTION public.fill_local_days(tz text)
+        RETURNS integer LANGUAGE plpgsql AS $$
+        DECLARE
+            filled integer;
+        BEGIN
+            IF EXISTS (SELECT 1 FROM public.local_days WHERE timezone = tz) THEN
+                RETURN 0;
+            END IF;
+            INSERT INTO public.local_days (timezone, local_date, start_utc, end_utc)
+            SELECT tz, d::date, d AT TIME ZONE tz, (d + interval '1 day') AT TIME ZONE tz
+            FROM generate_series(timestamp '2000-01-01', timestamp '2050-12-31', interval '1 day') d;
+            GET DIAGNOSTICS filled = ROW_COUNT;
+            RETURN filled;
+        END $$
+        """,
+        """
+        CREATE TABLE public.lot_settings (
+            lot_id    integer PRIMARY KEY,
+            timezone  text NOT NULL DEFAULT 'America/Edmonton'
+        )
+        """,
+        """
+        CREATE OR REPLACE FUNCTION public.lot_settings_fill_days()
+        RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            PERFORM public.fill_local_days(NEW.timezone);
+            RETURN NEW;
+        END $$
+        """,
+        """
+        CREATE TRIGGER lot_settings_fill_days
+            BEFORE INSERT OR UPDATE OF timezone ON public.lot_settings
+            FOR EACH ROW EXECUTE FUNCTION public.lot_settings_fill_days()
+        """,
+        """
+        CREATE OR REPLACE FUNCTION public.stalls_add_lot_settings()
+        RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            INSERT INTO public.lot_settings (lot_id) VALUES (NEW.lot_id) ON CONFLICT DO NOTHING;
+            RETURN NEW;
+        END $$
+        """,
+        """
+        CREATE TRIGGER stalls_add_lot_settings
+            AFTER INSERT OR UPDATE OF lot_id ON public.stalls
+            FOR EACH ROW EXECUTE FUNCTION public.stalls_add_lot_settings()
+        """,
+        # every lot so far was reported in Edmonton time
+        """
+        INSERT INTO public.lot_settings (lot_id)
+        SELECT DISTINCT lot_id FROM public.stalls
+        ON CONFLICT DO NOTHING
+        """,
+        # stall_history: the days a session overlaps
+        """
+        CREATE INDEX local_days_start_idx
+            ON public.local_days (timezone, start_utc) INCLUDE (end_utc, local_date)
+        """,
+        "ANALYZE public.local_days",
+    ]),
+]
+
+# index name -> table, checked by verify_indexes()
+EXPECTED_INDEXES = {
+    "parkingsessions_open_by_stall_idx": "parkingsessions",
+    "parkingsessions_stall_entry_idx":   "parkingsessions",
+    "availabilitysnapshots_lot_ts_idx":  "availabilitysnapshots",
+    "stalls_lot_idx":                    "stalls",
+    "local_days_start_idx":              "local_days",
+    "parkingsessions_entry_keyset_idx":  "parkingsessions",
+}
+
+
+def _ensure_migrations_table(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS public.schema_migrations (
+            version     integer PRIMARY KEY,
+            name        text NOT NULL,
+            applied_at  timestamptz NOT NULL DEFAULT now()
+        )
+    """)
+
+
+def get_schema_version(conn):
+    """Highest applied migration version, 0 for an empty database."""
+    row = conn.execute("""
+        SELECT COALESCE(MAX(version), 0) FROM public.schema_migrations
+    """).fetchone()
+    return row[0]
+
+
+def apply_migrations(conn, target=None):
+    """Apply every pending migration up to `target` (default: latest). Returns the applied versions."""
+    applied = []
+    previous_autocommit = conn.autocommit
+    conn.autocommit = True
+    try:
+        conn.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+        try:
+            _ensure_migrations_table(conn)
+            current = get_schema_version(conn)
+            for m in MIGRATIONS:
+                if m.version <= current or (target is not None and m.version > target):
+                    continue
+                if m.transactional:
+                    with conn.transaction():
+                        for stmt in m.statements:
+                            conn.execute(stmt)
+                        conn.execute("INSERT INTO public.schema_migrations (version, name) VALUES (%s, %s)",
+                                     (m.version, m.name))
+                else:
+                    for stmt in m.statements:
+                        if callable(stmt):
+                            stmt(conn)
+                        else:
+                            conn.execute(stmt)
+                    conn.execute("INSERT INTO public.schema_migrations (version, name) VALUES (%s, %s)",
+                                 (m.version, m.name))
+                print(f"Applied migration {m.version}: {m.name}")
+                applied.append(m.version)
+        finally:
+            conn.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+    finally:
+        conn.autocommit = previous_autocommit
+    return applied
+
+
+def verify_indexes(conn):
+    """Return a list of problems with the expected indexes (missing, wrong table or invalid)."""
+    rows = conn.execute("""
+        SELECT c.relname, t.relname, i.indisvalid
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        JOIN pg_class t ON t.oid = i.indrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = 'public' AND c.relname = ANY(%s)
+    """, (list(EXPECTED_INDEXES),)).fetchall()
+    found = {name: (table, valid) for name, table, valid in rows}
+
+    problems = []
+    for name, table in EXPECTED_INDEXES.items():
+        if name not in found:
+            problems.append(f"{name}: missing")
+        elif found[name][0] != table:
+            problems.append(f"{name}: on {found[name][0]}, expected {table}")
+        elif not found[name][1]:
+            # a failed CREATE INDEX CONCURRENTLY leaves an invalid index behind
+            problems.append(f"{name}: invalid (drop it and re-run migrate)")
+    return problems
+
+
+# ----- Query plan checks ------------------------------------------------
+def _plan_check_params(conn):
+    """Realistic bind parameters for each endpoint query, taken from the seeded data."""
+    row = conn.execute("""
+        SELECT lot_id, stall_id FROM public.stalls ORDER BY lot_id, stall_id LIMIT 1
+    """).fetchone()
+    if row is None:
+        raise RuntimeError("no stalls found - seed the database with ParkingLot_Synthetic_Data.py first")
+    lot_id, stall_id = row
+    tz_row = conn.execute("SELECT timezone FROM public.lot_settings WHERE lot_id = %s", (lot_id,)).fetchone()
+    tz_name = tz_row[0] if tz_row else DEFAULT_TIMEZONE
+
+    local_tz = zoneinfo.ZoneInfo(tz_name)
+    now_utc = datetime.now(timezone.utc)
+    today = now_utc.astimezone(local_tz).date()
+    start_of_day_utc = (datetime(today.year, today.month, today.day, tzinfo=local_tz)
+                        .astimezone(timezone.utc))
+    week_start_utc = start_of_day_utc - timedelta(days=6)
+    heatmap_start_utc = start_of_day_utc - timedelta(days=28)
+
+    return {
+        "stall_numbers":           (STALL_NUMBERS_SQL, (lot_id,)),
+        "availability_today":      (AVAILABILITY_TODAY_SQL, {"start": start_of_day_utc, "now": now_utc,
+                                                             "lot_id": lot_id}),
+        "stall_durations":         (STALL_DURATIONS_SQL, (now_utc, now_utc, start_of_day_utc,
+                                                          start_of_day_utc + timedelta(days=1), lot_id)),
+        "stall_first_session":     (STALL_FIRST_SESSION_DATE_SQL, (tz_name, stall_id)),
+        "stall_session_at":        (STALL_SESSION_AT_SQL, {"stall_id": stall_id, "at": week_start_utc}),
+        "stall_history_7d":        (STALL_HISTORY_SQL, {"tz": tz_name, "start": week_start_utc, "end": now_utc,
+                                                        "stall_id": stall_id, "since": week_start_utc}),
+        "end_session":             (END_SESSION_SQL, (now_utc, stall_id)),
+        "lot_sessions_28d":        (LOT_SESSIONS_IN_RANGE_SQL, (lot_id, heatmap_start_utc, now_utc,
+                                                                heatmap_start_utc, heatmap_start_utc,
+                                                                now_utc, now_utc)),
+        "portfolio_today":         (LOT_PORTFOLIO_TODAY_SQL, {
+            "lot_ids": None, "now": now_utc, "since": now_utc - timedelta(hours=26),
+            "now_naive": now_utc.replace(tzinfo=None),
+            "since_naive": (now_utc - timedelta(hours=26)).replace(tzinfo=None)}),
+        # a page deep into the history, as a cursor would ask for it
+        "sessions_page_lot":       (SESSIONS_PAGE_LOT_SQL, {
+            "lot_id": lot_id, "start": datetime(1970, 1, 1, tzinfo=timezone.utc),
+            "before_ts": heatmap_start_utc, "before_id": 0, "state": "all", "limit": 51}),
+        "sessions_page_stall":     (SESSIONS_PAGE_STALL_SQL, {
+            "stall_id": stall_id, "lot_id": lot_id, "start": datetime(1970, 1, 1, tzinfo=timezone.utc),
+            "before_ts": heatmap_start_utc, "before_id": 0, "state": "closed", "limit": 51}),
+    }
+
+
+def explain(conn, sql, params):
+    """EXPLAIN (FORMAT JSON) for one statement, with sequential scans priced out.
+
+    With enable_seqscan off the planner only picks a Seq Scan when no usable index
+    exists, so the check does not depend on how much synthetic data was loaded.
+    """
+    with conn.transaction(force_rollback=True):
+        conn.execute("SET LOCAL enable_seqscan = off")
+        # EXPLAIN does not take server-side parameters, so bind on the client
+        with ClientCursor(conn) as cur:
+            cur.execute("EXPLAIN (FORMAT JSON) " + sql.strip().rstrip(";"), params)
+            return cur.fetchone()[0][0]["Plan"]
+
+
+def partition_info(conn):
+    """(partition or partition index name -> parent name, names of empty partitions)."""
+    rows = conn.execute("""
+        SELECT c.relname, p.relname, c.relkind = 'r' AND c.reltuples <= 0
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+    """).fetchall()
+    return {name: parent for name, parent, _ in rows}, {name for name, _, empty in rows if empty}
+
+
+def _scans(plan):
+    """(node type, relation, index names) for every scan node under `plan`; a Bitmap
+    Heap Scan carries the indexes of the Bitmap Index Scans beneath it."""
+    if plan["Node Type"] == "Bitmap Index Scan":
+        return
+    if "Relation Name" in plan and "Scan" in plan["Node Type"]:      # not ModifyTable
+        indexes = [plan["Index Name"]] if "Index Name" in plan else []
+        if plan["Node Type"] == "Bitmap Heap Scan":
+            stack = list(plan.get("Plans", []))
+            while stack:
+                node = stack.pop()
+                if "Index Name" in node:
+                    indexes.append(node["Index Name"])
+                stack.extend(node.get("Plans", []))
+        yield plan["Node Type"], plan["Relation Name"], indexes
+    for child in plan.get("Plans", []):
+        yield from _scans(child)
+
+
+def plan_signature(plan, parents=None, empty=()):
+    """The sorted 'relation: Node Type using index' lines of a plan's scans.
+
+    Only how each relation is read is compared, not the join strategy or the
+    order of the joins above it: those follow row estimates, which move with every
+    ANALYZE sample, while a changed scan or index is what a lost index or a rewritten
+    predicate shows up as. Partitions and their indexes go by their parent's name, so
+    the signature does not depend on how many monthly partitions a range spans;
+    empty partitions (the months created ahead), for which any index is as good as
+    another, are left out unless nothing else of their parent is read.
+    """
+    parents = parents or {}
+    lines, empty_lines = set(), set()
+    for node_type, relation, indexes in _scans(plan):
+        parent = parents.get(relation, relation)
+        line = f"{parent}: {node_type}"
+        if indexes:
+            line += " using " + ", ".join(sorted({parents.get(i, i) for i in indexes}))
+        (empty_lines if relation in empty else lines).add(line)
+    read = {line.split(":")[0] for line in lines}
+    lines |= {line for line in empty_lines if line.split(":")[0] not in read}
+    return sorted(lines)
+
+
+def check_query_plans(conn, baseline_path=PLAN_BASELINE_PATH, update_baseline=False):
+    """EXPLAIN each endpoint query and return a list of problems.
+
+    Flags any sequential scan, and any plan whose shape differs from the stored baseline.
+    With update_baseline=True the current plans become the new baseline instead.
+    """
+    signatures = {}
+    problems = []
+    parents, empty = partition_info(conn)
+    for name, (sql, params) in _plan_check_params(conn).items():
+        signature = plan_signature(explain(conn, sql, params), parents=parents, empty=empty)
+        signatures[name] = signature
+        for line in signature:
+            if ": Seq Scan" in line:
+                problems.append(f"{name}: {line}")
+
+    if update_baseline:
+        with open(baseline_path, "w") as f:
+            json.dump(signatures, f, indent=2)
+            f.write("\n")
+        return problems
+
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        for name, signature in signatures.items():
+            if name not in baseline:
+                problems.append(f"{name}: no baseline plan (run with --update-baseline)")
+            elif baseline[name] != signature:
+                problems.append(f"{name}: plan changed\n  expected:\n    " + "\n    ".join(baseline[name])
+                                + "\n  got:\n    " + "\n    ".join(signature))
+    return problems
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Schema migrations and query-plan checks.")
+    parser.add_argument("command", choices=["migrate", "verify", "check-plans"])
+    parser.add_argument("--target", type=int, default=None, help="migrate up to this version only")
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args()
+
+    load_env("./.env")
+    pool = get_connection_pool()
+    if pool is None:
+        print("Error: Database connection pool not initialized.")
+        sys.exit(1)
+
+    problems = []
+    with pool.connection() as conn:
+        # index builds, backfills and bulk loads outlast the pool's statement_timeout
+        conn.execute("SET statement_timeout = 0")
+        conn.commit()
+        if args.command == "migrate":
+            apply_migrations(conn, args.target)
+            print(f"Schema version: {get_schema_version(conn)}")
+        elif args.command == "verify":
+            problems = verify_indexes(conn) + verify_partitions(conn)
+        else:
+            problems = check_query_plans(conn, update_baseline=args.update_baseline)
+    close_connection_pool()
+
+    for p in problems:
+        print("FAIL", p)
+    if not problems:
+        print("OK")
+    sys.exit(1 if problems else 0)
@@ -0,0 +1,145 @@
+import os
+import argparse
+import numpy as np
+from datetime import datetime, timezone, timedelta
+from User_Authentication import load_env
+from ParkingLot_Database_Utils import get_connection_pool, close_connection_pool
+from Partition_Manager import ensure_partitions
+from Lot_Calendar import set_lot_timezone
+
+# Synthetic stalls, sessions and availability snapshots for local databases.
+# Used by the query-plan checks and benchmarks; never run this against production.
+
+SECONDS_PER_HOUR = 3600.0
+
+
+def _stall_sessions(rng, start_ts, end_ts, mean_gap_h=2.0, mean_stay_h=2.5):
+    """Alternating vacant gaps / parked stays for one stall, as epoch-second arrays.
+
+    The last stay is returned with exit = NaN when it is still open at end_ts.
+    """
+    span_h = (end_ts - start_ts) / SECONDS_PER_HOUR
+    n = int(span_h / (mean_gap_h + mean_stay_h) * 1.5) + 8
+    gaps = rng.exponential(mean_gap_h, n) * SECONDS_PER_HOUR
+    stays = rng.lognormal(np.log(mean_stay_h) - 0.5, 1.0, n) * SECONDS_PER_HOUR
+    stays = np.maximum(stays, 120.0)
+
+    entries = start_ts + np.cumsum(gaps) + np.concatenate(([0.0], np.cumsum(stays)[:-1]))
+    exits = entries + stays
+    keep = entries < end_ts
+    entries, exits = entries[keep], exits[keep]
+    if len(exits) and exits[-1] >= end_ts:
+        exits[-1] = np.nan
+    return entries, exits
+
+
+def _occupied_at(entries, exits, times):
+    """Boolean mask of which `times` fall inside one of the (sorted, disjoint) sessions."""
+    if not len(entries):
+        return np.zeros(len(times), dtype=bool)
+    idx = np.searchsorted(entries, times, side="right") - 1
+    ends = np.nan_to_num(exits, nan=np.inf)[np.clip(idx, 0, None)]
+    return (idx >= 0) & (times < ends)
+
+
+def seed_synthetic_data(conn, lot_ids=(1,), stalls_per_lot=74, days=90, snapshot_minutes=5,
+                        end=None, seed=0, tz_name=None):
+    """Insert stalls, parking sessions and availability snapshots covering `days` up to `end`,
+    in time zone `tz_name` (default: the lot_settings default), then ANALYZE the tables.
+
+    Returns a dict with the number of rows written per table.
+    """
+    rng = np.random.default_rng(seed)
+    end = end or datetime.now(timezone.utc)
+    start = end - timedelta(days=days)
+    start_ts, end_ts = start.timestamp(), end.timestamp()
+    snap_times = np.arange(start_ts, end_ts, snapshot_minutes * 60.0)
+
+    counts = {"stalls": 0, "parkingsessions": 0, "availabilitysnapshots": 0}
+    ensure_partitions(conn, start, end)              # history may reach back past the oldest partition
+    with conn.cursor() as cur:
+        for lot_id in lot_ids:
+            occupied = np.zeros((stalls_per_lot, len(snap_times)), dtype=bool)
+            open_now = np.zeros(stalls_per_lot, dtype=bool)
+            sessions = []
+            for number in range(stalls_per_lot):
+                entries, exits = _stall_sessions(rng, start_ts, end_ts)
+                occupied[number] = _occupied_at(entries, exits, snap_times)
+                open_now[number] = len(exits) > 0 and np.isnan(exits[-1])
+                sessions.append((entries, exits))
+
+            stall_ids = []
+            for number in range(stalls_per_lot):
+                cur.execute("""
+                    INSERT INTO public.stalls (lot_id, stall_number, stall_type, current_status, is_operational)
+                    VALUES (%s, %s, %s, %s, %s) RETURNING stall_id;
+                """, (lot_id, str(number), "Regular", "Occupied" if open_now[number] else "Vacant", True))
+                stall_ids.append(cur.fetchone()[0])
+            counts["stalls"] += stalls_per_lot
+
+            with cur.copy("COPY public.parkingsessions (stall_id, entry_timestamp, exit_timestamp, vehicle_identifier) "
+                          "FROM STDIN") as copy:
+                for stall_id, (entries, exits) in zip(stall_ids, sessions):
+                    for entry, exit_ in zip(entries.tolist(), exits.tolist()):
+                        copy.write_row((
+                            stall_id,
+                            datetime.fromtimestamp(entry, timezone.utc),
+                            None if exit_ != exit_ else datetime.fromtimestamp(exit_, timezone.utc),
+                            "synthetic",
+                        ))
+                        counts["parkingsessions"] += 1
+
+            # availabilitysnapshots.timestamp is a naive UTC timestamp
+            with cur.copy('COPY public.availabilitysnapshots (lot_id, "timestamp", available_stalls) '
+                          "FROM STDIN") as copy:
+                for col, ts in enumerate(snap_times.tolist()):
+                    vacant = np.flatnonzero(~occupied[:, col]).tolist()
+                    copy.write_row((lot_id, datetime.utcfromtimestamp(ts), vacant))
+            counts["availabilitysnapshots"] += len(snap_times)
+
+    conn.commit()
+    if tz_name:
+        for lot_id in lot_ids:
+            set_lot_timezone(conn, lot_id, tz_name)
+    # fresh statistics, so check-plans right after seeding does not depend on whether
+    # autovacuum got there first (the database-wide form also covers the tables of any
+    # schema version)
+    conn.execute("ANALYZE")
+    conn.commit()
+    return counts
+
+
+def clear_synthetic_data(conn, lot_ids):
+    """Remove everything seeded for the given lots."""
+    with conn.cursor() as cur:
+        cur.execute("DELETE FROM public.availabilitysnapshots WHERE lot_id = ANY(%s)", (list(lot_ids),))
+        cur.execute("""
+            DELETE FROM public.parkingsessions
+            WHERE stall_id IN (SELECT stall_id FROM public.stalls WHERE lot_id = ANY(%s))
+        """, (list(lot_ids),))
+        cur.execute("DELETE FROM public.stalls WHERE lot_id = ANY(%s)", (list(lot_ids),))
+    conn.commit()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Seed a local database with synthetic parking data.")
+    parser.add_argument("--lots", type=int, nargs="+", default=[1])
+    parser.add_argument("--stalls", type=int, default=74)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--snapshot-minutes", type=int, default=5)
+    parser.add_argument("--replace", action="store_true", help="delete existing rows for these lots first")
+    parser.add_argument("--timezone", help="IANA time zone of these lots (default: lot_settings default)")
+    args = parser.parse_args()
+
+    load_env("./.env")
+    print(f"Seeding {os.getenv('PG_DBNAME')} on {os.getenv('PG_HOST')}")
+    pool = get_connection_pool()
+    with pool.connection() as conn:
+        # index builds, backfills and bulk loads outlast the pool's statement_timeout
+        conn.execute("SET statement_timeout = 0")
+        conn.commit()
+        if args.replace:
+            clear_synthetic_data(conn, args.lots)
+        print(seed_synthetic_data(conn, args.lots, args.stalls, args.days, args.snapshot_minutes,
+                                  tz_name=args.timezone))
+    close_connection_pool()
@@ -0,0 +1,266 @@
+import os
+import re
+import sys
+import gzip
+import json
+import time
+import asyncio
+import argparse
+from typing import NamedTuple, Optional
+from datetime import date, datetime, timezone
+from User_Authentication import load_env
+from ParkingLot_Database_Utils import get_connection_pool, close_connection_pool
+
+# Monthly partitions of parkingsessions and availabilitysnapshots (migration 5).
+#
+# Partitions cover one UTC calendar month of the table's timestamp and are named
+# <table>_pYYYY_MM. Maintenance keeps PARTITION_MONTHS_AHEAD months beyond the
+# current one in place, so inserts never find a month missing, and retires months
+# older than the table's retention window: the partition is detached (the only
+# step that locks the parent, bounded by lock_timeout), copied to a gzipped CSV
+# under FILES_VOLUME/archive/<table>/ and dropped. A partition left detached by an
+# interrupted run is picked up again by the next one. Session partitions that still
+# hold an open session are kept until it closes.
+#
+#   python Partition_Manager.py run
+#   python Partition_Manager.py status
+#
+# The app runs maintenance in the background (maintain(); PARTITION_MAINTENANCE_SEC=0
+# turns that off); an advisory lock makes sure only one process works on the
+# partitions at a time.
+
+FILES_VOLUME = os.getenv("FILES_VOLUME", "/data/shared")
+ARCHIVE_DIR = os.path.join(FILES_VOLUME, "archive")
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+PARTITION_MAINTENANCE_SEC = float(os.getenv("PARTITION_MAINTENANCE_SEC", "21600"))
+PARTITION_LOCK_ID = 7406002          # pg_advisory_lock key; MIGRATION_LOCK_ID is 7406001
+PARTITION_LOCK_TIMEOUT = "5s"        # DDL on a parent queues behind long queries and blocks new ones
+
+
+class PartitionedTable(NamedTuple):
+    name: str
+    retention_months: int            # months kept before the current one; 0 keeps everything
+    open_rows: Optional[str] = None  # rows that may still change; a partition holding any is kept
+
+
+PARTITIONED_TABLES = [
+    PartitionedTable("parkingsessions", int(os.getenv("SESSIONS_RETENTION_MONTHS", "24")),
+                     "exit_timestamp IS NULL"),
+    PartitionedTable("availabilitysnapshots", int(os.getenv("SNAPSHOTS_RETENTION_MONTHS", "13"))),
+]
+
+_MONTH_SUFFIX = re.compile(r"_p(\d{4})_(\d{2})$")
+
+
+def month_start(d):
+    return date(d.year, d.month, 1)
+
+
+def add_months(month, n):
+    index = month.year * 12 + month.month - 1 + n
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_month(name):
+    """First day of the month a partition covers, from its name."""
+    m = _MONTH_SUFFIX.search(name)
+    return date(int(m.group(1)), int(m.group(2)), 1)
+
+
+def is_partitioned(conn, table):
+    return conn.execute("""
+        SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s))
+    """, (f"public.{table}",)).fetchone()[0]
+
+
+def list_partitions(conn, table):
+    """(name, month, attached, estimated rows, bytes) of the table's monthly partitions,
+    including ones left detached by an interrupted archive run. Oldest first."""
+    rows = conn.execute("""
+        SELECT c.relname, i.inhparent IS NOT NULL, GREATEST(c.reltuples, 0)::bigint,
+               pg_total_relation_size(c.oid)
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        LEFT JOIN pg_inherits i ON i.inhrelid = c.oid
+        WHERE n.nspname = 'public' AND c.relkind = 'r'
+          AND c.relname ~ ('^' || %s || '_p[0-9]{4}_[0-9]{2}$')
+        ORDER BY c.relname
+    """, (table,)).fetchall()
+    return [(name, partition_month(name), attached, est_rows, size) for name, attached, est_rows, size in rows]
+
+
+def ensure_partitions(conn, first, last):
+    """Create the missing monthly partitions of every partitioned table for the months
+    from `first` to `last` (dates or datetimes, UTC). Returns the number created."""
+    created = 0
+    with conn.transaction():
+        conn.execute(f"SET LOCAL lock_timeout = '{PARTITION_LOCK_TIMEOUT}'")
+        for table in PARTITIONED_TABLES:
+            if is_partitioned(conn, table.name):
+                created += conn.execute("SELECT public.create_month_partitions(%s, %s, %s)",
+                                        (table.name, month_start(first), month_start(last))).fetchone()[0]
+    return created
+
+
+def archive_path(table, partition):
+    return os.path.join(ARCHIVE_DIR, table, f"{partition}.csv.gz")
+
+
+def archive_partition(conn, table, partition, attached=True):
+    """Detach one partition, write it to its archive file and drop it. Returns the row count."""
+    if attached:
+        with conn.transaction():
+            conn.execute(f"SET LOCAL lock_timeout = '{PARTITION_LOCK_TIMEOUT}'")
+            conn.execute(f"ALTER TABLE public.{table} DETACH PARTITION public.{partition}")
+
+    path = archive_path(table, partition)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".part"
+    with conn.transaction():
+        conn.execute("SET LOCAL statement_timeout = 0")
+        with conn.cursor() as cur:
+            with gzip.open(tmp_path, "wb") as f:
+                with cur.copy(f"COPY public.{partition} TO STDOUT WITH (FORMAT csv, HEADER)") as copy:
+                    for chunk in copy:
+                        f.write(chunk)
+            rows = cur.rowcount
+        with open(tmp_path, "rb") as f:
+            os.fsync(f.fileno())
+        # the file is complete on disk before the table goes away
+        os.replace(tmp_path, path)
+        conn.execute(f"DROP TABLE public.{partition}")
+    return rows
+
+
+def run_maintenance(conn, today=None):
+    """Create upcoming partitions and archive expired ones. Returns a report dict."""
+    today = today or datetime.now(timezone.utc).date()
+    current = month_start(today)
+    report = {"at": datetime.now(timezone.utc).isoformat(), "created": 0, "archived": [], "kept": [],
+              "errors": []}
+    previous_autocommit = conn.autocommit
+    conn.autocommit = True           # each step commits on its own; a detach is never held open
+    try:
+        if not conn.execute("SELECT pg_try_advisory_lock(%s)", (PARTITION_LOCK_ID,)).fetchone()[0]:
+            report["skipped"] = "maintenance is running in another process"
+            return report
+        try:
+            _maintain_tables(conn, current, report)
+        finally:
+            conn.execute("SELECT pg_advisory_unlock(%s)", (PARTITION_LOCK_ID,))
+    finally:
+        conn.autocommit = previous_autocommit
+    return report
+
+
+def _maintain_tables(conn, current, report):
+    try:
+        report["created"] = ensure_partitions(conn, current, add_months(current, PARTITION_MONTHS_AHEAD))
+    except Exception as e:
+        report["errors"].append(f"create partitions: {e}")
+
+    for table in PARTITIONED_TABLES:
+        if not table.retention_months or not is_partitioned(conn, table.name):
+            continue
+        cutoff = add_months(current, -table.retention_months)
+        for name, month, attached, _, _ in list_partitions(conn, table.name):
+            if attached and month >= cutoff:
+                continue
+            if attached and table.open_rows:
+                still_open = conn.execute(
+                    f"SELECT count(*) FROM public.{name} WHERE {table.open_rows}").fetchone()[0]
+                if still_open:
+                    report["kept"].append(f"{name}: {still_open} open rows")
+                    continue
+            try:
+                rows = archive_partition(conn, table.name, name, attached)
+                report["archived"].append({"partition": name, "rows": rows,
+                                           "file": archive_path(table.name, name)})
+                print(f"Archived {name}: {rows} rows")
+            except Exception as e:
+                report["errors"].append(f"archive {name}: {e}")
+
+
+def partition_status(conn):
+    """Per table: retention and each partition with its estimated rows and size."""
+    out = {}
+    for table in PARTITIONED_TABLES:
+        if not is_partitioned(conn, table.name):
+            out[table.name] = {"partitioned": False}
+            continue
+        out[table.name] = {
+            "partitioned": True,
+            "retention_months": table.retention_months,
+            "partitions": [{"name": name, "month": month.isoformat()[:7], "attached": attached,
+                            "rows_estimate": est_rows, "bytes": size}
+                           for name, month, attached, est_rows, size in list_partitions(conn, table.name)],
+        }
+    conn.commit()
+    return out
+
+
+def verify_partitions(conn, today=None):
+    """Problems with the partition layout: a table not partitioned, or a month from the
+    current one up to next month without its partition."""
+    current = month_start(today or datetime.now(timezone.utc).date())
+    problems = []
+    for table in PARTITIONED_TABLES:
+        if not is_partitioned(conn, table.name):
+            problems.append(f"{table.name}: not partitioned (run migrate)")
+            continue
+        attached = {month for _, month, is_attached, _, _ in list_partitions(conn, table.name) if is_attached}
+        for month in (current, add_months(current, 1)):
+            if month not in attached:
+                problems.append(f"{table.name}: no partition for {month:%Y-%m} (run Partition_Manager.py run)")
+    return problems
+
+
+class PartitionManager:
+    def __init__(self):
+        self.last_report = None
+
+    def run(self):
+        """One maintenance pass on a pool connection. Blocking."""
+        with get_connection_pool().connection() as conn:
+            self.last_report = run_maintenance(conn)
+        for error in self.last_report["errors"]:
+            print(f"Partition maintenance error: {error}")
+        return self.last_report
+
+    def status(self):
+        with get_connection_pool().connection() as conn:
+            return {"tables": partition_status(conn), "last_maintenance": self.last_report}
+
+    async def maintain(self, interval=PARTITION_MAINTENANCE_SEC):
+        """Background task: a maintenance pass on start and every `interval` seconds.
+        An interval of 0 leaves maintenance to the CLI (e.g. a cron job)."""
+        if interval <= 0:
+            return
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await loop.run_in_executor(None, self.run)
+            except Exception as e:
+                print(f"Partition maintenance error: {e}")
+            await asyncio.sleep(interval)
+
+
+partition_manager = PartitionManager()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Monthly partition maintenance.")
+    parser.add_argument("command", choices=["run", "status"])
+    args = parser.parse_args()
+
+    load_env("./.env")
+    if get_connection_pool() is None:
+        print("Error: Database connection pool not initialized.")
+        sys.exit(1)
+    t0 = time.perf_counter()
+    result = partition_manager.run() if args.command == "run" else partition_manager.status()
+    print(json.dumps(result, indent=2, default=str))
+    if args.command == "run":
+        print(f"done in {time.perf_counter() - t0:.1f} s")
+    close_connection_pool()
+    sys.exit(1 if args.command == "run" and result["errors"] else 0)
@@ -0,0 +1,112 @@
+import time
+import threading
+import ParkingLot_Queries as Q
+from Instrumented_Pool import TimingSeries, current_profile
+
+# Named statements for the request path, with per-query timing.
+#
+# Endpoints run queries by name through `run_query`, which executes them with
+# prepare=True: psycopg prepares each statement on the server the first time a
+# connection runs it and reuses the prepared plan on that connection afterwards
+# (pool connections are long lived and RESET ALL keeps prepared statements).
+# Every execution is recorded under its name: count, errors, latency percentiles
+# and rows returned / affected.
+#
+# COPY statements cannot be prepared and stay outside the registry.
+
+QUERIES = {
+    "stall_numbers":            Q.STALL_NUMBERS_SQL,
+    "stall_number_by_id":       Q.STALL_NUMBER_BY_ID_SQL,
+    "stall_id_by_number":       Q.STALL_ID_BY_NUMBER_SQL,
+    "stall_lots":               Q.STALL_LOTS_SQL,
+    "lot_timezones":            Q.LOT_TIMEZONES_SQL,
+    "stall_statuses":           Q.STALL_STATUSES_SQL,
+    "vacant_stall_numbers":     Q.VACANT_STALL_NUMBERS_SQL,
+    "live_stall_state":         Q.LIVE_STALL_STATE_SQL,
+    "lot_stall_count":          Q.LOT_STALL_COUNT_SQL,
+    "availability_today":       Q.AVAILABILITY_TODAY_SQL,
+    "availability_series":      Q.AVAILABILITY_SERIES_SQL,
+    "availability_bitsets":     Q.AVAILABILITY_BITSETS_SQL,
+    "stall_durations":          Q.STALL_DURATIONS_SQL,
+    "stall_first_session_date": Q.STALL_FIRST_SESSION_DATE_SQL,
+    "stall_session_at":         Q.STALL_SESSION_AT_SQL,
+    "stall_history":            Q.STALL_HISTORY_SQL,
+    "lot_sessions_in_range":    Q.LOT_SESSIONS_IN_RANGE_SQL,
+    "lot_sessions_version":     Q.LOT_SESSIONS_VERSION_SQL,
+    "lot_first_session":        Q.LOT_FIRST_SESSION_SQL,
+    "lot_portfolio_today":      Q.LOT_PORTFOLIO_TODAY_SQL,
+    "sessions_page_lot":        Q.SESSIONS_PAGE_LOT_SQL,
+    "sessions_page_stall":      Q.SESSIONS_PAGE_STALL_SQL,
+    "start_session":            Q.START_SESSION_SQL,
+    "end_session":              Q.END_SESSION_SQL,
+    "update_stall_status":      Q.UPDATE_STALL_STATUS_SQL,
+    "set_stall_status":         Q.SET_STALL_STATUS_SQL,
+    "notify_stall_event":       Q.NOTIFY_STALL_EVENT_SQL,
+}
+
+
+class _QueryStats:
+    __slots__ = ("latency", "errors", "rows", "max_rows")
+
+    def __init__(self):
+        self.latency = TimingSeries()
+        self.errors = 0
+        self.rows = 0
+        self.max_rows = 0
+
+
+class QueryRegistry:
+    def __init__(self, queries):
+        self.queries = dict(queries)
+        self._lock = threading.Lock()
+        self._stats = {name: _QueryStats() for name in self.queries}
+
+    def sql(self, name):
+        return self.queries[name]
+
+    def execute(self, target, name, params=(), binary=False):
+        """Run query `name` on `target` (a connection or a cursor) as a prepared
+        statement and return the cursor, ready to fetch from."""
+        sql = self.queries[name]                # unknown names fail before touching the database
+        t0 = time.perf_counter()
+        try:
+            if binary:
+                cur = target.execute(sql, params, prepare=True, binary=True)
+            else:
+                cur = target.execute(sql, params, prepare=True)
+        except Exception:
+            with self._lock:
+                self._stats[name].errors += 1
+            raise
+        elapsed = time.perf_counter() - t0
+        rows = max(cur.rowcount, 0)             # SELECT: rows returned, DML: rows affected
+        profile = current_profile.get()
+        if profile is not None:
+            profile.add_query(elapsed)
+        with self._lock:
+            stats = self._stats[name]
+            stats.latency.add(elapsed)
+            stats.rows += rows
+            stats.max_rows = max(stats.max_rows, rows)
+        return cur
+
+    def stats(self):
+        """Per-query summary, busiest (by total time) first; unused queries are left out."""
+        with self._lock:
+            out = {}
+            for name, s in self._stats.items():
+                if not s.latency.count and not s.errors:
+                    continue
+                out[name] = {
+                    **s.latency.summary(),
+                    "total_ms": round(1000 * s.latency.total, 1),
+                    "errors": s.errors,
+                    "rows": s.rows,
+                    "avg_rows": round(s.rows / s.latency.count, 1) if s.latency.count else 0,
+                    "max_rows": s.max_rows,
+                }
+        return dict(sorted(out.items(), key=lambda kv: kv[1]["total_ms"], reverse=True))
+
+
+query_registry = QueryRegistry(QUERIES)
+run_query = query_registry.execute
@@ -0,0 +1,346 @@
+import os
+import sys
+import time
+import random
+import asyncio
+import fnmatch
+import threading
+from collections import deque
+from Instrumented_Pool import TimingSeries, ContextThreadPoolExecutor, current_profile
+
+# Per-request profiling, switched on at runtime.
+#
+# While enabled, a sample of requests (sample_rate, optionally only paths matching
+# one of `routes`) gets a RequestProfile, which splits its wall time into
+#   db         statement execution (run_query) plus pool checkout waits
+#   cpu        CPU of executor work done for it (exact, thread_time) plus the time
+#              covered by event-loop samples taken while its task was running
+#   loop_lag   event-loop delay measured while it was in flight: something blocked
+#              the loop, possibly this request itself (then it overlaps db or cpu)
+#   other      the rest: awaiting I/O, locks, other tasks
+# A sampler thread takes the stacks of the threads working for profiled requests
+# every interval_ms; with stacks on they are kept as collapsed stacks
+# ("frame;frame;frame weight"), the input format of flamegraph.pl and speedscope.
+# A busy thread holds the GIL for up to sys.getswitchinterval(), so samples are
+# often further apart than interval_ms: each one is weighted by the time since the
+# previous one (in microseconds in the stacks file).
+#
+# Work is attributed to a request on the event loop through asyncio's current task
+# (asyncio.current_task(loop), asked from the sampler thread; if that lookup fails the
+# loop thread is simply not sampled, and requests keep their db and executor cpu) and in ProfilingThreadPoolExecutor workers through the submitting request's
+# context. Threads outside that executor (sync endpoints, streaming generators)
+# still count their queries under db, but are not sampled.
+
+PROFILE_HISTORY = 500             # recent profiled requests kept
+LOOP_TICK_SEC = 0.01              # loop-lag probe period
+LOOP_LAG_MIN_SEC = 0.002          # overshoot below this is scheduling noise
+LOOP_LAG_HISTORY_SEC = 300
+MAX_STACKS = 20000                # distinct collapsed stacks kept
+STACK_DEPTH = 64
+
+
+class RequestProfile:
+    __slots__ = ("method", "path", "route", "started", "ended", "status", "task",
+                 "db", "queries", "pool_wait", "cpu_executor", "cpu_loop", "db_loop", "_lock")
+
+    def __init__(self, method, path):
+        self.method = method
+        self.path = path
+        self.route = None
+        self.started = time.perf_counter()
+        self.ended = None
+        self.status = None
+        self.task = None
+        self.db = 0.0
+        self.queries = 0
+        self.pool_wait = 0.0
+        self.cpu_executor = 0.0
+        self.cpu_loop = 0.0            # sampled event-loop time in this request's own code
+        self.db_loop = 0.0             # ... of which blocked in the database driver
+        self._lock = threading.Lock()
+
+    def add_query(self, seconds):
+        with self._lock:
+            self.db += seconds
+            self.queries += 1
+
+    def add_pool_wait(self, seconds):
+        with self._lock:
+            self.pool_wait += seconds
+
+    def add_executor_cpu(self, seconds):
+        with self._lock:
+            self.cpu_executor += seconds
+
+    @property
+    def label(self):
+        return f"{self.method} {self.route or self.path}"
+
+
+def _frame_name(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _collapse(frame):
+    """Root-first frame names of a stack, and whether it is inside the database driver."""
+    names, in_db = [], False
+    while frame is not None and len(names) < STACK_DEPTH:
+        code = frame.f_code
+        names.append(_frame_name(code))
+        in_db = in_db or "psycopg" in code.co_filename
+        frame = frame.f_back
+    names.reverse()
+    return names, in_db
+
+
+class RequestProfiler:
+    def __init__(self):
+        self.enabled = False
+        self.sample_rate = 1.0
+        self.routes = []              # fnmatch patterns on the request path; empty: every path
+        self.stacks = False
+        self.interval = 0.005
+        self._lock = threading.Lock()
+        self._active = {}             # asyncio task -> RequestProfile, requests in flight
+        self._threads = {}            # thread ident -> RequestProfile, executor work in flight
+        self._records = deque(maxlen=PROFILE_HISTORY)
+        self._routes_stats = {}       # label -> {"wall", "db", "cpu", "loop_lag"} TimingSeries
+        self._stacks = {}             # collapsed stack -> sampled microseconds
+        self._lags = deque()          # (perf_counter at end of a late tick, lag seconds)
+        self._loop = None
+        self._loop_thread = None
+        self._lag_task = None
+        self._sampler = None
+        self._loop_lookup_failed = False
+
+    # ----- control -----------------------------------------------------
+    def configure(self, enabled=None, sample_rate=None, routes=None, stacks=None, interval_ms=None):
+        if sample_rate is not None:
+            self.sample_rate = min(max(float(sample_rate), 0.0), 1.0)
+        if routes is not None:
+            self.routes = [r for r in routes if r]
+        if stacks is not None:
+            self.stacks = bool(stacks)
+        if interval_ms is not None:
+            self.interval = min(max(float(interval_ms), 1.0), 100.0) / 1000
+        if enabled is not None:
+            self.enabled = bool(enabled)
+        return self.settings()
+
+    def settings(self):
+        return {"enabled": self.enabled, "sample_rate": self.sample_rate, "routes": self.routes,
+                "stacks": self.stacks, "interval_ms": round(self.interval * 1000, 1)}
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+            self._routes_stats.clear()
+            self._stacks.clear()
+
+    def wants(self, path):
+        if not self.enabled:
+            return False
+        if self.routes and not any(fnmatch.fnmatchcase(path, pattern) for pattern in self.routes):
+            return False
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
+
+    # ----- request lifecycle (called by RequestProfilerMiddleware) --------
+    def begin(self, method, path):
+        self._ensure_running()
+        profile = RequestProfile(method, path)
+        profile.task = asyncio.current_task()
+        with self._lock:
+            self._active[profile.task] = profile
+        return profile
+
+    def end(self, profile):
+        profile.ended = time.perf_counter()
+        with self._lock:
+            self._active.pop(profile.task, None)
+            record = self._record(profile)
+            self._records.append(record)
+            stats = self._routes_stats.setdefault(profile.label, {k: TimingSeries() for k in
+                                                                  ("wall", "db", "cpu", "loop_lag")})
+            for key in stats:
+                stats[key].add(record[f"{key}_ms"] / 1000)
+        return record
+
+    def split(self, profile, until=None):
+        """(wall, db, cpu, loop_lag) seconds of a profile so far."""
+        until = until or profile.ended or time.perf_counter()
+        with profile._lock:
+            db = profile.db + profile.pool_wait
+            cpu = profile.cpu_executor + profile.cpu_loop - profile.db_loop
+        # a late tick ending at t means the loop was stuck during [t - lag, t]
+        lag = sum(max(0.0, min(t, until) - max(t - l, profile.started)) for t, l in list(self._lags))
+        return until - profile.started, db, cpu, lag
+
+    def _record(self, profile):
+        wall, db, cpu, lag = self.split(profile)
+        return {
+            "at": time.time() - (time.perf_counter() - profile.started),
+            "route": profile.label,
+            "path": profile.path,
+            "status": profile.status,
+            "wall_ms": round(1000 * wall, 2),
+            "db_ms": round(1000 * db, 2),
+            "queries": profile.queries,
+            "pool_wait_ms": round(1000 * profile.pool_wait, 2),
+            "cpu_ms": round(1000 * cpu, 2),
+            "loop_lag_ms": round(1000 * lag, 2),
+            "other_ms": round(1000 * max(wall - db - cpu - lag, 0.0), 2),
+        }
+
+    # ----- executor attribution ----------------------------------------
+    def run_attributed(self, fn, *args, **kwargs):
+        """Run fn in this thread on behalf of the current request, if it is profiled."""
+        profile = current_profile.get()
+        if profile is None:
+            return fn(*args, **kwargs)
+        ident = threading.get_ident()
+        self._threads[ident] = profile
+        t0 = time.thread_time()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            profile.add_executor_cpu(time.thread_time() - t0)
+            self._threads.pop(ident, None)
+
+    # ----- background probes -------------------------------------------
+    def _ensure_running(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop, self._loop_thread = loop, threading.get_ident()
+            self._lag_task = loop.create_task(self._watch_loop())
+        if self._sampler is None or not self._sampler.is_alive():
+            self._sampler = threading.Thread(target=self._sample, name="request-profiler", daemon=True)
+            self._sampler.start()
+
+    async def _watch_loop(self):
+        """Sleeps LOOP_TICK_SEC at a time and records how late it wakes up."""
+        while True:
+            if not self.enabled and not self._active:
+                self._loop = None          # begin() restarts the probes
+                return
+            t0 = time.perf_counter()
+            await asyncio.sleep(LOOP_TICK_SEC)
+            now = time.perf_counter()
+            lag = now - t0 - LOOP_TICK_SEC
+            if lag >= LOOP_LAG_MIN_SEC:
+                self._lags.append((now, lag))
+            while self._lags and self._lags[0][0] < now - LOOP_LAG_HISTORY_SEC:
+                self._lags.popleft()
+
+    def _sample(self):
+        """Sampler thread: stacks of the loop thread (when a profiled task runs) and of
+        executor threads working for profiled requests."""
+        last = time.perf_counter()
+        while self.enabled or self._active:
+            time.sleep(self.interval)
+            now = time.perf_counter()
+            weight, last = min(now - last, 0.1), now
+            loop, loop_thread = self._loop, self._loop_thread
+            working = dict(self._threads)
+            task = self._loop_task(loop) if loop is not None else None
+            loop_profile = self._active.get(task) if task is not None else None
+            if loop_profile is not None:
+                working[loop_thread] = loop_profile
+            if not working:
+                continue
+            frames = sys._current_frames()
+            for ident, profile in working.items():
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                names, in_db = _collapse(frame)
+                if ident == loop_thread:
+                    with profile._lock:
+                        profile.cpu_loop += weight
+                        if in_db:
+                            profile.db_loop += weight
+                if self.stacks:
+                    where = "[event loop]" if ident == loop_thread else "[executor]"
+                    key = ";".join([profile.label, where] + names)
+                    with self._lock:
+                        if key in self._stacks or len(self._stacks) < MAX_STACKS:
+                            self._stacks[key] = self._stacks.get(key, 0) + int(weight * 1e6)
+
+    def _loop_task(self, loop):
+        """The task running on the loop right now, or None if that cannot be told."""
+        if self._loop_lookup_failed:
+            return None
+        try:
+            return asyncio.current_task(loop)
+        except Exception as e:
+            print(f"Request profiler: cannot see the running task, loop not sampled: {e}")
+            self._loop_lookup_failed = True
+            return None
+
+    # ----- reporting ----------------------------------------------------
+    def report(self, limit=50):
+        with self._lock:
+            routes = {label: {k: s.summary() for k, s in stats.items()}
+                      for label, stats in self._routes_stats.items()}
+            recent = list(self._records)[-limit:]
+            stacks = len(self._stacks)
+        return {"settings": self.settings(), "routes": routes, "recent": recent[::-1],
+                "distinct_stacks": stacks}
+
+    def collapsed_stacks(self, route=None):
+        """Collapsed-stack text, optionally only for labels containing `route`."""
+        with self._lock:
+            items = sorted(self._stacks.items())
+        return "".join(f"{stack} {count}\n" for stack, count in items
+                       if route is None or route in stack.split(";", 1)[0])
+
+
+class ProfilingThreadPoolExecutor(ContextThreadPoolExecutor):
+    """ContextThreadPoolExecutor whose tasks are attributed to the profiled request that submitted them."""
+
+    def __init__(self, profiler, *args, **kwargs):
+        self.profiler = profiler
+        super().__init__(*args, **kwargs)
+
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(self.profiler.run_attributed, fn, *args, **kwargs)
+
+
+class RequestProfilerMiddleware:
+    """Pure ASGI middleware, so the endpoint runs in the same task as the profile.
+
+    Profiled responses carry a Server-Timing header with the split up to the
+    moment the response started.
+    """
+
+    def __init__(self, app, profiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.profiler.wants(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+        profiler = self.profiler
+        profile = profiler.begin(scope["method"], scope["path"])
+        token = current_profile.set(profile)
+
+        async def send_timed(message):
+            if message["type"] == "http.response.start":
+                profile.status = message["status"]
+                route = scope.get("route")
+                profile.route = getattr(route, "path", None)
+                wall, db, cpu, lag = profiler.split(profile)
+                timing = (f"db;dur={1000 * db:.1f}, cpu;dur={1000 * cpu:.1f}, "
+                          f"lag;dur={1000 * lag:.1f}, total;dur={1000 * wall:.1f}")
+                message = {**message, "headers": [*message.get("headers", []),
+                                                  (b"server-timing", timing.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_timed)
+        finally:
+            current_profile.reset(token)
+            profiler.end(profile)
+
+
+request_profiler = RequestProfiler()
@@ -0,0 +1,37 @@
+import threading
+from collections import OrderedDict
+
+# Small in-process LRU for computed responses. Every entry carries the data version
+# it was built from; a lookup with a different version is a miss, so callers
+# invalidate by passing the current version rather than by deleting keys.
+
+
+class VersionedCache:
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()          # key -> (version, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, version=None):
+        """Cached value for key if it was stored under `version`, else None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, version, value):
+        with self._lock:
+            self._entries[key] = (version, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
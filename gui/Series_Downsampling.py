@@ -0,0 +1,72 @@
+import numpy as np
+
+# Shape-preserving downsampling of (x, y) series for charts.
+# Both functions keep the first and last points and return x in ascending order.
+
+
+def lttb(x, y, n_out):
+    """Largest-Triangle-Three-Buckets: indices of the `n_out` points that best keep the shape.
+
+    The middle points are split into n_out - 2 equal buckets. From each bucket the point
+    forming the largest triangle with the previously chosen point and the next bucket's
+    average is kept. Work inside a bucket is vectorised; only the bucket walk is a loop.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)   # n_out - 2 buckets over [1, n-1)
+    # per-bucket averages, used as the third triangle corner for the previous bucket
+    sizes = np.diff(edges)
+    avg_x = np.add.reduceat(x[1:n - 1], edges[:-1] - 1) / sizes
+    avg_y = np.add.reduceat(y[1:n - 1], edges[:-1] - 1) / sizes
+    avg_x = np.append(avg_x, x[-1])
+    avg_y = np.append(avg_y, y[-1])
+
+    out = np.empty(n_out, dtype=np.int64)
+    out[0], out[-1] = 0, n - 1
+    a = 0
+    for b in range(n_out - 2):
+        lo, hi = edges[b], edges[b + 1]
+        cx, cy = avg_x[b + 1], avg_y[b + 1]
+        area = np.abs((x[a] - cx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (cy - y[a]))
+        a = lo + int(np.argmax(area))
+        out[b + 1] = a
+    return out
+
+
+def _first_match_per_bucket(y, starts, sizes, values):
+    """Index of the first element in each bucket equal to that bucket's value."""
+    hits = np.flatnonzero(y == np.repeat(values, sizes))
+    _, first = np.unique(np.searchsorted(starts, hits, side="right") - 1, return_index=True)
+    return hits[first]
+
+
+def minmax_buckets(x, y, n_out):
+    """Indices of the minimum and maximum of each of (n_out - 2) // 2 equal-width x buckets.
+
+    Every peak and trough survives, at the cost of up to two points per bucket.
+    `x` must be ascending, as it is for a time series.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    if n <= n_out:
+        return np.arange(n)
+    n_buckets = max(1, (n_out - 2) // 2)
+
+    bounds = x[0] + (x[-1] - x[0]) * np.arange(n_buckets) / n_buckets
+    starts = np.unique(np.searchsorted(x, bounds, side="left"))
+    starts = starts[starts < n]
+    sizes = np.diff(np.append(starts, n))
+    lows = _first_match_per_bucket(y, starts, sizes, np.minimum.reduceat(y, starts))
+    highs = _first_match_per_bucket(y, starts, sizes, np.maximum.reduceat(y, starts))
+    return np.unique(np.concatenate((lows, highs, [0, n - 1])))
+
+
+DOWNSAMPLERS = {
+    "lttb": lttb,
+    "minmax": minmax_buckets,
+}
@@ -0,0 +1,115 @@
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import psycopg
+from ParkingLot_Database_Utils import get_conninfo
+
+# Streaming COPY ... TO STDOUT exports.
+#
+# libpq hands COPY data over one row at a time, which is cheap in a plain loop but
+# costs an event-loop round trip per row on an AsyncConnection. So each export
+# runs a synchronous COPY on its own thread and connection, coalesces rows into
+# large chunks and passes them to the response through a short queue. Memory stays
+# at a few chunks whatever the row count.
+
+EXPORT_MAX_CONCURRENT = 4
+EXPORT_CHUNK_BYTES = 256 * 1024
+EXPORT_QUEUE_CHUNKS = 4               # chunks buffered ahead of a slow client
+_PUT_POLL_SEC = 1.0
+
+export_executor = ThreadPoolExecutor(max_workers=EXPORT_MAX_CONCURRENT, thread_name_prefix="export")
+export_slots = asyncio.Semaphore(EXPORT_MAX_CONCURRENT)
+
+
+class ExportError(Exception):
+    """The COPY failed part way; raised from copy_csv_chunks so the response is aborted
+    rather than ending as if the file were complete."""
+
+
+class _ExportCancelled(Exception):
+    pass
+
+
+def _copy_worker(sql, params, tz_name, loop, chunks, cancelled, active):
+    """Runs on export_executor: COPY into `chunks`, then None when done or an
+    ExportError when not. Something always ends the queue unless the reader left."""
+    def put(item):
+        fut = asyncio.run_coroutine_threadsafe(chunks.put(item), loop)
+        while True:
+            try:
+                return fut.result(timeout=_PUT_POLL_SEC)
+            except TimeoutError:
+                if cancelled.is_set():
+                    fut.cancel()
+                    raise _ExportCancelled
+
+    end = ExportError("export stopped")
+    try:
+        with psycopg.connect(autocommit=True, **get_conninfo()) as conn:
+            active["conn"] = conn
+            if cancelled.is_set():
+                return
+            conn.execute("SELECT set_config('TimeZone', %s, false)", (tz_name,))
+            buf = bytearray()
+            with conn.cursor().copy(sql, params) as copy:
+                for data in copy:
+                    buf += data
+                    if len(buf) >= EXPORT_CHUNK_BYTES:
+                        # raising inside the block makes psycopg cancel the COPY on the server
+                        put(bytes(buf))
+                        buf.clear()
+            if buf:
+                put(bytes(buf))
+        end = None
+    except _ExportCancelled:
+        return
+    except Exception as e:
+        if not cancelled.is_set():
+            print(f"Export error: {e}")
+        end = ExportError(str(e))
+    finally:
+        active.pop("conn", None)
+        if not cancelled.is_set():
+            try:
+                put(end)
+            except _ExportCancelled:
+                pass
+
+
+async def copy_csv_chunks(sql, params, tz_name="UTC"):
+    """Async generator of CSV bytes for a `COPY (...) TO STDOUT` statement.
+
+    Closing the generator (the client disconnected) cancels the running query.
+    Raises ExportError if the COPY fails part way, which aborts the response.
+    Timestamps are rendered in `tz_name`.
+    """
+    async with export_slots:
+        loop = asyncio.get_running_loop()
+        chunks = asyncio.Queue(maxsize=EXPORT_QUEUE_CHUNKS)
+        cancelled = threading.Event()
+        active = {}
+        worker = loop.run_in_executor(export_executor, _copy_worker, sql, params, tz_name,
+                                      loop, chunks, cancelled, active)
+        finished = False
+        try:
+            while (chunk := await chunks.get()) is not None:
+                if isinstance(chunk, ExportError):
+                    raise chunk
+                yield chunk
+            finished = True
+        finally:
+            if not finished:
+                cancelled.set()
+                conn = active.get("conn")
+                if conn is not None:
+                    try:
+                        # cancel_safe waits on the server; keep it off the event loop
+                        await loop.run_in_executor(None, functools.partial(conn.cancel_safe, timeout=5))
+                    except Exception as e:
+                        print(f"Export cancel error: {e}")
+            await worker
+
+
+def exports_busy():
+    return export_slots.locked()
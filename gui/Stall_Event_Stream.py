@@ -0,0 +1,164 @@
+import json
+import time
+import asyncio
+from collections import deque
+import psycopg
+from ParkingLot_Database_Utils import get_conninfo, get_connection_pool
+from ParkingLot_Queries import STALL_EVENT_CHANNEL
+from Query_Registry import run_query
+
+# Server-sent events for stall status changes.
+#
+# update_stall_status / start_session / end_session send a NOTIFY in the same
+# transaction as their write. One LISTEN connection per process receives them and
+# fans each event out to every SSE client subscribed to that lot.
+
+HEARTBEAT_SEC = 15
+HISTORY_SIZE = 2000           # events kept for Last-Event-ID resume
+CLIENT_QUEUE_SIZE = 256       # a client further behind than this gets a fresh snapshot
+RECONNECT_DELAY_SEC = 2
+
+
+def _format_sse(event, data, event_id=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, separators=(',', ':'))}")
+    return ("\n".join(lines) + "\n\n").encode()
+
+
+def _load_stall_statuses(lot_id):
+    with get_connection_pool().connection() as conn:
+        rows = run_query(conn, "stall_statuses", (lot_id,)).fetchall()
+    return [{"stall_id": sid, "stall_number": num, "status": status} for sid, num, status in rows]
+
+
+class _Subscriber:
+    def __init__(self, lot_id):
+        self.lot_id = lot_id
+        self.queue = asyncio.Queue(maxsize=CLIENT_QUEUE_SIZE)
+        self.overflowed = False
+
+
+class StallEventBroker:
+    """Single LISTEN connection fanned out to per-client queues.
+
+    Event ids are "<epoch>-<seq>": the epoch changes on every process start and
+    after a lost LISTEN connection, so a stale Last-Event-ID is recognised and the
+    client is sent a full snapshot instead of a partial replay.
+    """
+
+    def __init__(self):
+        self._epoch = int(time.time())
+        self._seq = 0
+        self._history = deque(maxlen=HISTORY_SIZE)   # (seq, lot_id, event dict)
+        self._subscribers = {}                       # lot_id -> set of _Subscriber
+        self._session_changes = {}                   # lot_id -> session events seen
+
+    # ----- publishing --------------------------------------------------
+    def publish(self, event):
+        self._seq += 1
+        lot_id = event.get("lot_id")
+        if event.get("event") in ("start_session", "end_session"):
+            self._session_changes[lot_id] = self._session_changes.get(lot_id, 0) + 1
+        self._history.append((self._seq, lot_id, event))
+        for sub in self._subscribers.get(lot_id, ()):
+            try:
+                sub.queue.put_nowait((self._seq, event))
+            except asyncio.QueueFull:
+                sub.overflowed = True
+
+    def _new_epoch(self):
+        """Events may have been missed: invalidate every resume point and resync clients."""
+        self._epoch = max(self._epoch + 1, int(time.time()))
+        self._seq = 0
+        self._history.clear()
+        for subs in self._subscribers.values():
+            for sub in subs:
+                sub.overflowed = True
+
+    async def listen(self):
+        """Background task: keep a LISTEN connection open and publish every notification."""
+        first = True
+        while True:
+            try:
+                async with await psycopg.AsyncConnection.connect(autocommit=True, **get_conninfo()) as conn:
+                    await conn.execute(f"LISTEN {STALL_EVENT_CHANNEL}")
+                    if not first:
+                        self._new_epoch()
+                    first = False
+                    async for notify in conn.notifies():
+                        try:
+                            self.publish(json.loads(notify.payload))
+                        except ValueError as e:
+                            print(f"Bad stall event payload: {e}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Stall event listener error: {e}")
+            await asyncio.sleep(RECONNECT_DELAY_SEC)
+
+    # ----- subscribing -------------------------------------------------
+    def _replay_after(self, lot_id, last_event_id):
+        """Events for lot_id after last_event_id, or None if that id cannot be resumed from."""
+        try:
+            epoch, seq = (int(x) for x in last_event_id.split("-", 1))
+        except (AttributeError, ValueError):
+            return None
+        if epoch != self._epoch:
+            return None
+        if seq > self._seq:
+            return None
+        if seq < self._seq and (not self._history or self._history[0][0] > seq + 1):
+            return None                              # fell out of the history window
+        return [(s, e) for s, lid, e in self._history if s > seq and lid == lot_id]
+
+    async def stream(self, lot_id, last_event_id=None):
+        """Async generator of SSE bytes for one client."""
+        sub = _Subscriber(lot_id)
+        self._subscribers.setdefault(lot_id, set()).add(sub)
+        try:
+            backlog = self._replay_after(lot_id, last_event_id) if last_event_id else None
+            if backlog is None:
+                backlog = []
+                sub.overflowed = True                # start with a snapshot
+            yield b"retry: 3000\n\n"
+            for seq, event in backlog:
+                yield _format_sse(event["event"], event, f"{self._epoch}-{seq}")
+
+            loop = asyncio.get_running_loop()
+            while True:
+                if sub.overflowed:
+                    sub.overflowed = False
+                    while not sub.queue.empty():
+                        sub.queue.get_nowait()
+                    seq_at_snapshot = self._seq
+                    stalls = await loop.run_in_executor(None, _load_stall_statuses, lot_id)
+                    yield _format_sse("snapshot", {"lot_id": lot_id, "stalls": stalls},
+                                      f"{self._epoch}-{seq_at_snapshot}")
+                try:
+                    seq, event = await asyncio.wait_for(sub.queue.get(), HEARTBEAT_SEC)
+                except asyncio.TimeoutError:
+                    yield b": heartbeat\n\n"
+                    continue
+                yield _format_sse(event["event"], event, f"{self._epoch}-{seq}")
+        finally:
+            subs = self._subscribers.get(lot_id)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._subscribers[lot_id]
+
+    def data_version(self, lot_id):
+        """Changes whenever a session of lot_id starts or ends, or events may have been missed.
+
+        Cache session-derived results under this instead of a TTL.
+        """
+        return self._epoch, self._session_changes.get(lot_id, 0)
+
+    def subscriber_count(self):
+        return sum(len(s) for s in self._subscribers.values())
+
+
+stall_events = StallEventBroker()
@@ -0,0 +1,273 @@
+import json
+import threading
+import numpy as np
+from ParkingLot_Database_Utils import get_connection_pool, start_session, end_session
+from Query_Registry import run_query
+
+# Stall occupancy from detection polygons.
+#
+# Stall regions (camera-pixel polygons, each keyed by its stall number) are
+# rasterised once onto a coarse grid. Each frame the batch of detection polygons is
+# rasterised onto the same grid in one vectorised pass and every stall's covered
+# fraction comes out of a single bincount.
+#
+# Regions come from one of two sources, both keyed by the stall numbers of the
+# stalls table:
+# - a labelme file of polygons whose labels are stall numbers (from_labelme);
+# - the top-down map (static/Brentwood_parking_lot_top_down_map_74.json: one point
+#   per stall, labelled '0'..'73') plus a calibration of >= 4 landmarks picked in
+#   both the map and the camera image. A homography fitted to those pairs projects a
+#   square around each stall point into the camera (from_map_points).
+# static/gt_74.json is not a source: its 74 polygons are labelled 'car', vehicles
+# outlined on one camera frame, and their order says nothing about stall numbers.
+
+FRAME_W, FRAME_H = 2592, 1944
+GRID_SCALE = 0.25                 # grid cells per camera pixel, per axis
+OCCUPIED_ON = 0.35                # covered fraction that marks a vacant stall occupied
+OCCUPIED_OFF = 0.15               # ... and below which an occupied stall becomes vacant
+MAP_STALL_SIZE = 16.0             # side of the square projected around a map stall point, map pixels
+
+
+def _pack(polygons):
+    """Concatenated vertices plus per-polygon vertex counts, dropping degenerate polygons."""
+    polys = [np.asarray(p, dtype=np.float64).reshape(-1, 2) for p in polygons]
+    polys = [p for p in polys if len(p) >= 3]
+    if not polys:
+        return np.zeros((0, 2)), np.zeros(0, dtype=np.int64)
+    return np.concatenate(polys), np.array([len(p) for p in polys], dtype=np.int64)
+
+
+def _rasterize_packed(pts, lengths, width, height):
+    """rasterize_polygons() on _pack() output."""
+    if not len(lengths):
+        return np.zeros((height, width), dtype=bool)
+    starts = np.cumsum(lengths) - lengths
+    nxt_idx = np.arange(len(pts)) + 1
+    nxt_idx[starts + lengths - 1] = starts            # last vertex closes back to the first
+    nxt = pts[nxt_idx]
+    x0, y0, x1, y1 = pts[:, 0], pts[:, 1], nxt[:, 0], nxt[:, 1]
+
+    # walk every polygon with the same orientation: flip edge signs of negative-area ones
+    area2 = np.add.reduceat(x0 * y1 - x1 * y0, starts)
+    orientation = np.repeat(np.where(area2 < 0, -1.0, 1.0), lengths)
+
+    # rows whose centre (r + 0.5) lies in [min(y0,y1), max(y0,y1))
+    ylo, yhi = np.minimum(y0, y1), np.maximum(y0, y1)
+    r_first = np.clip(np.ceil(ylo - 0.5), 0, height).astype(np.int64)
+    r_stop = np.clip(np.ceil(yhi - 0.5), 0, height).astype(np.int64)
+    n_rows = r_stop - r_first
+    keep = n_rows > 0
+    if not keep.any():
+        return np.zeros((height, width), dtype=bool)
+    x0, y0, x1, y1, orientation = x0[keep], y0[keep], x1[keep], y1[keep], orientation[keep]
+    r_first, n_rows = r_first[keep], n_rows[keep]
+
+    edge = np.repeat(np.arange(len(n_rows)), n_rows)
+    rows = r_first[edge] + (np.arange(len(edge)) - np.repeat(np.cumsum(n_rows) - n_rows, n_rows))
+    yc = rows + 0.5
+    xc = x0[edge] + (yc - y0[edge]) * (x1[edge] - x0[edge]) / (y1[edge] - y0[edge])
+    cols = np.clip(np.ceil(xc - 0.5), 0, width).astype(np.int64)
+    direction = np.where(y1[edge] > y0[edge], 1.0, -1.0) * orientation[edge]
+
+    # only the bounding window of the marks can be non-zero
+    r0, c0 = rows.min(), cols.min()
+    h, w = rows.max() - r0 + 1, cols.max() - c0 + 1
+    winding = np.bincount((rows - r0) * w + (cols - c0), weights=direction, minlength=h * w)
+    winding = np.cumsum(winding.reshape(h, w), axis=1)
+    mask = np.zeros((height, width + 1), dtype=bool)
+    mask[r0:r0 + h, c0:c0 + w] = np.rint(winding) != 0
+    return mask[:, :width]
+
+
+def rasterize_polygons(polygons, width, height):
+    """Union of `polygons` (grid coordinates) as a (height, width) bool mask.
+
+    A cell is inside when its centre is. All polygons are walked with one
+    orientation, so the summed winding number is non-zero exactly on their union:
+    every edge adds +-1 at the first cell right of where it crosses each row
+    centre, and a cumulative sum along the rows turns those marks into winding
+    numbers.
+    """
+    return _rasterize_packed(*_pack(polygons), width, height)
+
+
+def _normalizer(pts):
+    """Similarity moving pts to the origin with mean distance sqrt(2), for a well-conditioned fit."""
+    centre = pts.mean(axis=0)
+    spread = np.mean(np.linalg.norm(pts - centre, axis=1))
+    k = np.sqrt(2) / spread if spread > 0 else 1.0
+    return np.array([[k, 0, -k * centre[0]], [0, k, -k * centre[1]], [0, 0, 1]])
+
+
+def project_points(homography, pts):
+    """Apply a 3x3 homography to (n, 2) points."""
+    pts = np.asarray(pts, dtype=np.float64).reshape(-1, 2)
+    out = np.column_stack([pts, np.ones(len(pts))]) @ np.asarray(homography, dtype=np.float64).T
+    return out[:, :2] / out[:, 2:3]
+
+
+def fit_homography(src, dst):
+    """Homography taking src points to dst points, least squares over >= 4 pairs (normalised DLT)."""
+    src = np.asarray(src, dtype=np.float64).reshape(-1, 2)
+    dst = np.asarray(dst, dtype=np.float64).reshape(-1, 2)
+    if len(src) < 4 or len(src) != len(dst):
+        raise ValueError("need at least 4 matching point pairs")
+    t_src, t_dst = _normalizer(src), _normalizer(dst)
+    a, b = project_points(t_src, src), project_points(t_dst, dst)
+    rows = np.zeros((2 * len(a), 9))
+    for i, ((x, y), (u, v)) in enumerate(zip(a, b)):
+        rows[2 * i] = (-x, -y, -1, 0, 0, 0, u * x, u * y, u)
+        rows[2 * i + 1] = (0, 0, 0, -x, -y, -1, v * x, v * y, v)
+    _, sv, vt = np.linalg.svd(rows)
+    if sv[-2] < 1e-9 * sv[0]:
+        raise ValueError("point pairs are degenerate (collinear or repeated)")
+    h = np.linalg.inv(t_dst) @ vt[-1].reshape(3, 3) @ t_src
+    return h / h[2, 2]
+
+
+class StallOccupancyEngine:
+    """Stall regions rasterised once; per-frame overlap ratios for a batch of detections."""
+
+    def __init__(self, stall_polygons, stall_numbers=None, frame_size=(FRAME_W, FRAME_H), scale=GRID_SCALE):
+        self.scale = scale
+        self.width = int(np.ceil(frame_size[0] * scale))
+        self.height = int(np.ceil(frame_size[1] * scale))
+        self.n_stalls = len(stall_polygons)
+        self.polygons = [np.asarray(p, dtype=np.float64).reshape(-1, 2) for p in stall_polygons]   # camera pixels
+        # per-stall arrays below are in polygon order; stall_numbers[i] is stall i's number
+        self.stall_numbers = np.asarray(range(self.n_stalls) if stall_numbers is None else stall_numbers,
+                                        dtype=np.int64)
+        if len(self.stall_numbers) != self.n_stalls:
+            raise ValueError("one stall number per polygon")
+
+        # spatial index: one bounding box per stall, in grid coordinates
+        self.stall_bbox = np.zeros((self.n_stalls, 4))
+        pixel_index, pixel_stall = [], []
+        self.stall_area = np.zeros(self.n_stalls)
+        for i, poly in enumerate(self.polygons):
+            pts = poly * scale
+            self.stall_bbox[i] = (*pts.min(axis=0), *pts.max(axis=0))
+            cells = np.flatnonzero(rasterize_polygons([pts], self.width, self.height))
+            pixel_index.append(cells)
+            pixel_stall.append(np.full(len(cells), i, dtype=np.int32))
+            self.stall_area[i] = len(cells)
+        # stalls may overlap in perspective, so each keeps its own cells
+        self.pixel_index = np.concatenate(pixel_index) if pixel_index else np.zeros(0, dtype=np.int64)
+        self.pixel_stall = np.concatenate(pixel_stall) if pixel_stall else np.zeros(0, dtype=np.int32)
+
+    @classmethod
+    def from_labelme(cls, path, **kwargs):
+        """Load a labelme file of camera-space polygons labelled with their stall number."""
+        with open(path) as f:
+            data = json.load(f)
+        shapes = [s for s in data["shapes"] if s.get("shape_type", "polygon") == "polygon"]
+        labels = sorted({str(s["label"]) for s in shapes if not str(s["label"]).isdigit()})
+        if not shapes or labels:
+            raise ValueError(f"{path}: stall regions must be polygons labelled with their stall number"
+                             + (f", not {labels}" if labels else ""))
+        frame = (data.get("imageWidth", FRAME_W), data.get("imageHeight", FRAME_H))
+        return cls([s["points"] for s in shapes], stall_numbers=[int(s["label"]) for s in shapes],
+                   frame_size=frame, **kwargs)
+
+    @classmethod
+    def from_map_points(cls, map_path, calibration_path, **kwargs):
+        """Stall regions projected from the top-down map's labelled stall points.
+
+        The calibration file is {"map_points": [[x, y], ...], "camera_points": [[x, y], ...],
+        "stall_size": <map pixels, optional>}: the same >= 4 ground landmarks (line ends,
+        kerb corners) in map and camera pixels, in the same order.
+        """
+        with open(map_path) as f:
+            shapes = [s for s in json.load(f)["shapes"] if str(s["label"]).isdigit()]
+        with open(calibration_path) as f:
+            calibration = json.load(f)
+        homography = fit_homography(calibration["map_points"], calibration["camera_points"])
+        half = float(calibration.get("stall_size", MAP_STALL_SIZE)) / 2
+        square = np.array([[-half, -half], [half, -half], [half, half], [-half, half]])
+        polygons = [project_points(homography, np.asarray(s["points"][0], dtype=np.float64) + square)
+                    for s in shapes]
+        return cls(polygons, stall_numbers=[int(s["label"]) for s in shapes], **kwargs)
+
+    def overlap_ratios(self, detections):
+        """Fraction of each stall's area covered by the union of `detections` (camera pixels)."""
+        ratios = np.zeros(self.n_stalls)
+        if not len(detections) or not self.n_stalls:
+            return ratios
+        pts, lengths = _pack(detections)
+        if not len(lengths):
+            return ratios
+        pts = pts * self.scale
+        starts = np.cumsum(lengths) - lengths
+
+        # drop detections whose box touches no stall box (cars in the driving lane, etc.)
+        lo = np.minimum.reduceat(pts, starts)
+        hi = np.maximum.reduceat(pts, starts)
+        hits = ((lo[:, None, 0] <= self.stall_bbox[None, :, 2]) &
+                (hi[:, None, 0] >= self.stall_bbox[None, :, 0]) &
+                (lo[:, None, 1] <= self.stall_bbox[None, :, 3]) &
+                (hi[:, None, 1] >= self.stall_bbox[None, :, 1])).any(axis=1)
+        if not hits.any():
+            return ratios
+        if not hits.all():
+            pts = pts[np.repeat(hits, lengths)]
+            lengths = lengths[hits]
+
+        covered = _rasterize_packed(pts, lengths, self.width, self.height).ravel()[self.pixel_index]
+        counts = np.bincount(self.pixel_stall, weights=covered, minlength=self.n_stalls)
+        np.divide(counts, self.stall_area, out=ratios, where=self.stall_area > 0)
+        return ratios
+
+    def occupancy(self, detections, previous=None, on=OCCUPIED_ON, off=OCCUPIED_OFF):
+        """Occupied flags per stall, with hysteresis against `previous` when given."""
+        ratios = self.overlap_ratios(detections)
+        if previous is None:
+            return ratios >= on, ratios
+        previous = np.asarray(previous, dtype=bool)
+        return np.where(previous, ratios >= off, ratios >= on), ratios
+
+
+class StallOccupancyTracker:
+    """Turns per-frame detections into stall status / session writes for one lot.
+
+    Only stalls whose state changed are written, through start_session / end_session,
+    which also set the stall's status and send its one notification.
+    """
+
+    def __init__(self, lot_id, engine):
+        self.lot_id = lot_id
+        self.engine = engine
+        self.stall_ids = {}                 # stall number -> stall_id
+        self.occupied = None                # per engine stall, in polygon order
+        self._lock = threading.Lock()
+
+    def _load_state(self):
+        with get_connection_pool().connection() as conn:
+            rows = run_query(conn, "stall_statuses", (self.lot_id,)).fetchall()
+        self.stall_ids = {int(num): sid for sid, num, _ in rows}
+        status = {int(num): st for _, num, st in rows}
+        self.occupied = np.array([status.get(num) == "Occupied" for num in self.engine.stall_numbers.tolist()],
+                                 dtype=bool)
+
+    def process(self, detections, timestamp):
+        """Update stall state from one frame's detections.
+
+        Returns (occupied, ratios) in the engine's polygon order, and the stall numbers that changed.
+        """
+        with self._lock:
+            return self._process(detections, timestamp)
+
+    def _process(self, detections, timestamp):
+        if self.occupied is None:
+            self._load_state()
+        occupied, ratios = self.engine.occupancy(detections, previous=self.occupied)
+        changed = np.flatnonzero(occupied != self.occupied)
+        for i in changed.tolist():
+            stall_id = self.stall_ids.get(int(self.engine.stall_numbers[i]))
+            if stall_id is None:
+                continue
+            if occupied[i]:
+                start_session(stall_id, timestamp)
+            else:
+                end_session(stall_id, timestamp)
+        self.occupied = occupied
+        return occupied, ratios, self.engine.stall_numbers[changed].tolist()
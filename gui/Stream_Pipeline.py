@@ -0,0 +1,273 @@
+import os, asyncio, base64, struct, hashlib, hmac, math, secrets
+from datetime import datetime, timezone
+from typing import NamedTuple
+import numpy as np
+import redis
+from fastapi import APIRouter, Request, HTTPException, Body
+from fastapi.responses import HTMLResponse, RedirectResponse, Response, JSONResponse
+from fastapi.templating import Jinja2Templates
+from Stall_Occupancy_Geometry import StallOccupancyEngine, StallOccupancyTracker
+
+# Camera stream: frame pairs from Redis, the stream page and detections.
+#
+# Only imported by apps that serve the stream (main.create_app). OpenCV is
+# imported on first use, when the first frame is decoded or encoded.
+#
+# The result image is a composite: the annotated camera frame with the top-down
+# map panel to its right. The map only changes when a stall changes colour, so
+# /frames splits it off and encodes it only when its pixels change; clients send
+# the map_version they hold and get the map image only when it is stale. Each
+# frame pair is JPEG-encoded once, by the first request that wants it, however
+# many viewers poll.
+#
+# Frame and map counters are per process, so the cursors handed to clients carry
+# the process's boot id ("<boot>.<n>"): a cursor from before a restart, or from
+# another worker, never matches and the current frame and map are served.
+
+# ----- Configuration ----------------------------
+PID         = 12345678                                  # demo PID for stream
+LIST_KEY    = f"raw_buffer_{PID}_Video1"
+ZSET_KEY    = f"res_buffer_{PID}_Video1"
+POLL_MS     = 200                                        # ms
+MAX_WAIT_SEC= 30
+STREAM_LOT_ID = int(os.getenv("STREAM_LOT_ID", "1"))         # lot shown on the stream page
+# stall regions of that lot, keyed by stall number (see Stall_Occupancy_Geometry.py): a labelme file
+# of camera-space polygons labelled with stall numbers, or the map's stall points plus a calibration
+STALL_REGIONS_FILE = os.getenv("STALL_REGIONS_FILE", "")
+STALL_MAP_FILE = os.getenv("STALL_MAP_FILE", "static/Brentwood_parking_lot_top_down_map_74.json")
+STALL_CALIBRATION_FILE = os.getenv("STALL_CALIBRATION_FILE", "")   # map/camera landmark pairs for STALL_MAP_FILE
+DETECTOR_TOKEN = os.getenv("DETECTOR_TOKEN", "")          # shared secret of the detector, sent as X-Detector-Token
+CAMERA_SRC_W, CAMERA_SRC_H = 2592, 1944                   # camera resolution; the composite's left pane has its aspect
+MIN_MAP_PANEL_W = 8                                      # narrower leftovers are rounding, not a map panel
+# -----------------------------------------------
+
+redis_url = os.getenv("REDIS_URL", "redis://redis-stack:6379/0")
+r_bin = redis.Redis.from_url(redis_url, decode_responses=False)
+
+latest_pair: tuple[np.ndarray, np.ndarray] | None = None
+latest_seq = 0                                           # bumped for every new pair
+BOOT_ID = secrets.token_hex(4)                           # prefixes the cursors of this process
+pending: dict[float, tuple[np.ndarray, float]] = {}
+
+
+class EncodedFrame(NamedTuple):
+    seq: int
+    raw: str | None                                      # data URLs
+    cam: str | None
+
+
+class MapPanel:
+    """The last map panel seen, encoded once per change."""
+
+    def __init__(self):
+        self.version = 0
+        self.digest = None
+        self.jpeg = None
+
+    def update(self, panel):
+        digest = hashlib.blake2b(np.ascontiguousarray(panel).data, digest_size=16).digest()
+        if digest != self.digest:
+            jpeg = img_to_b64(panel)
+            if jpeg:
+                self.digest, self.jpeg = digest, jpeg
+                self.version += 1
+
+
+encoded_frame: EncodedFrame | None = None
+map_panel = MapPanel()
+encode_lock = asyncio.Lock()
+
+templates = Jinja2Templates(directory="templates")
+
+router = APIRouter()
+
+
+@router.get('/stream', response_class=HTMLResponse)
+def stream(request: Request):
+    if not request.session.get("authenticated"):
+        return RedirectResponse(url="/login", status_code=303)
+    return templates.TemplateResponse(request, "stream.html", {"lot_id": STREAM_LOT_ID})
+
+@router.get("/", response_class=HTMLResponse)
+def home(request: Request):
+    if not request.session.get("authenticated"):
+        return RedirectResponse(url="/login", status_code=303)
+    return templates.TemplateResponse(request, "stream.html", {"lot_id": STREAM_LOT_ID})
+
+def cursor(n: int) -> str:
+    return f"{BOOT_ID}.{n}"
+
+def seen(after: str, n: int) -> bool:
+    """True when the client's cursor already covers counter value n of this process."""
+    boot, _, held = after.partition(".")
+    return boot == BOOT_ID and held.isdigit() and int(held) >= n
+
+@router.get('/frames')
+async def frames(request: Request, after: str = "", map_version: str = ""):
+    """
+    Latest frame pair: {"seq", "raw", "cam", "map_version"} plus "map" when the
+    client's map_version is out of date. 204 while there is no frame newer than
+    `after`; cursors from another boot or worker are always out of date.
+    """
+    if not request.session.get("authenticated"):
+        return RedirectResponse(url="/login", status_code=303)
+    if latest_pair is None or seen(after, latest_seq):
+        return Response(status_code=204)
+    frame = await encode_latest()
+    if frame is None or not frame.raw or not frame.cam:
+        return Response(status_code=204)
+    body = {'seq': cursor(frame.seq), 'raw': frame.raw, 'cam': frame.cam,
+            'map_version': cursor(map_panel.version)}
+    if map_panel.jpeg and map_version != cursor(map_panel.version):
+        body['map'] = map_panel.jpeg
+    return JSONResponse(body, headers={'Cache-Control':'no-store'})
+
+occupancy_trackers: dict[int, StallOccupancyTracker] = {}
+
+def get_occupancy_tracker(lot_id: int):
+    """Tracker for lots with configured stall regions; only the stream lot can have them so far."""
+    if lot_id != STREAM_LOT_ID:
+        return None
+    if lot_id not in occupancy_trackers:
+        if STALL_REGIONS_FILE:
+            engine = StallOccupancyEngine.from_labelme(STALL_REGIONS_FILE)
+        elif STALL_CALIBRATION_FILE:
+            engine = StallOccupancyEngine.from_map_points(STALL_MAP_FILE, STALL_CALIBRATION_FILE)
+        else:
+            return None
+        occupancy_trackers[lot_id] = StallOccupancyTracker(lot_id, engine)
+    return occupancy_trackers[lot_id]
+
+def detector_authorized(request: Request):
+    """A logged-in session, or the detector's shared secret (DETECTOR_TOKEN) in X-Detector-Token."""
+    if request.session.get("authenticated"):
+        return True
+    token = request.headers.get("x-detector-token", "")
+    return bool(DETECTOR_TOKEN) and hmac.compare_digest(token.encode(), DETECTOR_TOKEN.encode())
+
+def is_polygon(points):
+    """At least 3 [x, y] points with finite numeric coordinates."""
+    return (isinstance(points, list) and len(points) >= 3
+            and all(isinstance(p, (list, tuple)) and len(p) == 2
+                    and all(isinstance(c, (int, float)) and not isinstance(c, bool) and math.isfinite(c)
+                            for c in p)
+                    for p in points))
+
+@router.post("/api/detections")
+async def post_detections(request: Request, lot_id: int, payload: dict = Body(...)):
+    """
+    Vehicle detections for one frame: {"polygons": [[[x, y], ...], ...], "timestamp": "<ISO-8601>"}
+    in camera pixels. Stalls whose occupancy changed are written through
+    start_session / end_session. Needs a logged-in session
+    or the detector token. Answers with stall numbers: the occupied ones, the covered
+    fraction of each, and the ones that changed.
+    """
+    if not detector_authorized(request):
+        raise HTTPException(401, "Log in or send X-Detector-Token")
+    tracker = get_occupancy_tracker(lot_id)
+    if tracker is None:
+        raise HTTPException(404, f"No stall regions configured for lot {lot_id}")
+    try:
+        polygons = payload.get("polygons", [])
+        if not isinstance(polygons, list) or not all(is_polygon(p) for p in polygons):
+            raise ValueError("polygons")
+        ts = payload.get("timestamp")
+        timestamp = datetime.fromisoformat(ts) if ts else datetime.now(timezone.utc)
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.replace(tzinfo=timezone.utc)
+    except (AttributeError, TypeError, ValueError):
+        raise HTTPException(400, "Body must be {'polygons': [[[x, y], ...] with 3+ points, ...], "
+                                 "'timestamp': ISO-8601}")
+
+    loop = asyncio.get_running_loop()
+    occupied, ratios, changed = await loop.run_in_executor(None, tracker.process, polygons, timestamp)
+    numbers = tracker.engine.stall_numbers
+    return {
+        "occupied": numbers[occupied].tolist(),
+        "ratios": dict(zip(map(str, numbers.tolist()), np.round(ratios, 3).tolist())),
+        "changed": changed,
+    }
+
+
+# ----- Stream helper functions -----------------------------------
+def deserialize_frame(buf: bytes):
+    off = 0
+    slen = struct.unpack_from('<i', buf, off)[0]; off += 4
+    fid = float(buf[off:off+slen].decode()); off += slen
+    mtype = struct.unpack_from('<i', buf, off)[0]; off += 4
+    rows = struct.unpack_from('<i', buf, off)[0]; off += 4
+    cols = struct.unpack_from('<i', buf, off)[0]; off += 4
+    channels = ((mtype >> 3) & 0x3F) + 1
+    size = rows*cols*channels
+    img = np.frombuffer(buf[off:off+size], dtype=np.uint8).reshape((rows, cols, channels))
+    if img.ndim == 3 and img.shape[2] == 2:
+        import cv2
+        img = cv2.cvtColor(img, cv2.COLOR_YUV2BGR_YUY2)
+    return fid, img
+
+def split_result(res_img: np.ndarray):
+    """(camera pane, map panel or None) of a result composite; both are views."""
+    h, w = res_img.shape[:2]
+    cam_w = min(w, int(round(h * CAMERA_SRC_W / CAMERA_SRC_H)))
+    if w - cam_w < MIN_MAP_PANEL_W:
+        return res_img, None
+    return res_img[:, :cam_w], res_img[:, cam_w:]
+
+def encode_pair(seq: int, raw_img: np.ndarray, res_img: np.ndarray) -> EncodedFrame:
+    cam, panel = split_result(res_img)
+    if panel is not None:
+        map_panel.update(panel)
+    return EncodedFrame(seq, img_to_b64(raw_img), img_to_b64(cam))
+
+async def encode_latest():
+    """EncodedFrame of the latest pair, encoding it if no request has yet."""
+    global encoded_frame
+    if encoded_frame is not None and encoded_frame.seq == latest_seq:
+        return encoded_frame
+    async with encode_lock:
+        seq, pair = latest_seq, latest_pair
+        if pair is None:
+            return None
+        if encoded_frame is None or encoded_frame.seq != seq:
+            loop = asyncio.get_running_loop()
+            encoded_frame = await loop.run_in_executor(None, encode_pair, seq, *pair)
+        return encoded_frame
+
+def img_to_b64(img: np.ndarray):
+    import cv2
+    ok, enc = cv2.imencode('.jpg', np.ascontiguousarray(img))
+    if not ok:
+        return None
+    return 'data:image/jpeg;base64,' + base64.b64encode(enc.tobytes()).decode()
+
+
+# ----- Background tasks -----------------------------------------------
+async def list_consumer():
+    loop = asyncio.get_running_loop()
+    while True:
+        _, raw = await loop.run_in_executor(None, lambda: r_bin.blpop(LIST_KEY, 0))
+        fid, img = deserialize_frame(raw)
+        pending[fid] = (img, loop.time())
+
+async def zset_matcher():
+    global latest_pair, latest_seq
+    loop = asyncio.get_running_loop()
+    while True:
+        now = loop.time()
+        for fid in list(pending.keys()):
+            raw_img, ts = pending[fid]
+            zdata = await loop.run_in_executor(None,
+                     lambda fid=fid: r_bin.zrangebyscore(ZSET_KEY, fid, fid, 0, 1))
+            if zdata:
+                loop.run_in_executor(None, r_bin.zrem, ZSET_KEY, zdata[0])
+                _, res_img = deserialize_frame(zdata[0])
+                latest_pair = (raw_img, res_img)
+                latest_seq += 1
+                del pending[fid]
+            elif now - ts > MAX_WAIT_SEC:
+                del pending[fid]
+        await asyncio.sleep(POLL_MS/1000)
+
+def start_stream_tasks():
+    asyncio.create_task(list_consumer())
+    asyncio.create_task(zset_matcher())
@@ -0,0 +1,201 @@
+import os
+import time
+import asyncio
+import zoneinfo
+from typing import NamedTuple
+from datetime import datetime, date, timedelta, timezone
+from ParkingLot_Database_Utils import get_connection_pool
+from Query_Registry import run_query
+from Lot_Calendar import calendar_for, DEFAULT_TIMEZONE
+
+# "Today" aggregates for the lot dashboard, computed in the background.
+#
+# Every viewer of a lot dashboard needs the same two aggregates for the current
+# local day, in the lot's time zone. A scheduler task recomputes them for each lot requested recently
+# (active) every SNAPSHOT_INTERVAL_SEC, or sooner once the lot's sessions changed,
+# and swaps in a new immutable snapshot. Requests just read the current one.
+
+SNAPSHOT_INTERVAL_SEC = float(os.getenv("SNAPSHOT_INTERVAL_SEC", "30"))
+SNAPSHOT_MIN_INTERVAL_SEC = 5          # floor between recomputes triggered by session events
+ACTIVE_LOT_TTL_SEC = 900               # lots nobody asked about for this long are not refreshed
+SCHEDULER_TICK_SEC = 1
+
+
+def today_bounds(local_tz, now_utc=None):
+    """(start of the local day in UTC, now in UTC)."""
+    now_utc = now_utc or datetime.now(timezone.utc)
+    _, start_of_day_utc = calendar_for(local_tz).today(now_utc)
+    return start_of_day_utc, now_utc
+
+
+def compute_stall_durations(conn, lot_id, local_tz, now_utc=None):
+    """Hours each stall of the lot has been occupied today, open sessions included."""
+    now_utc = now_utc or datetime.now(timezone.utc)
+    cal = calendar_for(local_tz)
+    today, start_of_day_utc = cal.today(now_utc)
+    end_of_day_utc = cal.midnight(today + timedelta(days=1))       # 23 or 25 hours away on DST days
+    cap_utc = min(now_utc, end_of_day_utc)
+    rows = run_query(conn, "stall_durations", (cap_utc, cap_utc, start_of_day_utc, end_of_day_utc,
+                                               lot_id)).fetchall()
+    return [{"id": row[0], "number": row[1], "duration": round(float(row[2]), 2)} for row in rows]
+
+
+def compute_availability_today(conn, lot_id, local_tz, now_utc=None):
+    """Available spots in 30-minute bins from local midnight to now."""
+    start_of_day_utc, now_utc = today_bounds(local_tz, now_utc)
+    rows = run_query(conn, "availability_today", {"start": start_of_day_utc, "now": now_utc,
+                                                  "lot_id": lot_id}).fetchall()
+    return {
+        "labels": [ts.astimezone(local_tz).strftime("%I:%M %p") for ts, _ in rows],
+        # Replace None with 0 so empty bins show as 0 available spots
+        "data": [(avail if avail is not None else 0) for _, avail in rows],
+    }
+
+
+def compute_portfolio(conn, lot_ids, now_utc=None):
+    """Today's KPIs for each lot in lot_ids (None: every lot), from one query. Each lot's
+    today is its local day, in its own time zone."""
+    now_utc = now_utc or datetime.now(timezone.utc)
+    since_utc = now_utc - timedelta(hours=26)       # before the start of any zone's current day
+    rows = run_query(conn, "lot_portfolio_today", {
+        "lot_ids": list(lot_ids) if lot_ids is not None else None,
+        "now": now_utc,
+        "since": since_utc,
+        "now_naive": now_utc.replace(tzinfo=None),
+        "since_naive": since_utc.replace(tzinfo=None),
+    }).fetchall()
+
+    def local_time(naive_utc, local_tz):
+        return naive_utc.replace(tzinfo=timezone.utc).astimezone(local_tz).isoformat() if naive_utc else None
+
+    lots = []
+    for (lot_id, tz_name, day, stalls, occupied, hours, arrivals, departures,
+         peak, peak_at, trough, trough_at) in rows:
+        local_tz = zoneinfo.ZoneInfo(tz_name)
+        lots.append({
+            "lot_id": lot_id,
+            "timezone": tz_name,
+            "day": day.isoformat(),
+            "stalls": stalls,
+            "occupied": occupied,
+            "occupancy": round(occupied / stalls, 3) if stalls else 0.0,
+            "occupied_hours_today": round(float(hours), 2),
+            "arrivals_today": arrivals,
+            "departures_today": departures,
+            "turnover_today": round(arrivals / stalls, 2) if stalls else 0.0,   # sessions per stall
+            "peak_available": peak,
+            "peak_available_at": local_time(peak_at, local_tz),
+            "trough_available": trough,
+            "trough_available_at": local_time(trough_at, local_tz),
+        })
+    return {"as_of": now_utc.isoformat(), "lots": lots}
+
+
+class TodaySnapshot(NamedTuple):
+    lot_id: int
+    tz: zoneinfo.ZoneInfo         # the lot's time zone when computed
+    day: date                     # local date the aggregates belong to
+    computed_at: float            # epoch seconds
+    data_version: object          # data_version(lot_id) when the computation started
+    durations: list
+    availability: dict
+
+    def age(self):
+        return time.time() - self.computed_at
+
+
+class UnknownLotError(LookupError):
+    """Raised by TodaySnapshotStore.get for a lot_id that `lot_exists` rejects."""
+
+
+class TodaySnapshotStore:
+    """Latest TodaySnapshot per lot plus the scheduler that refreshes them.
+
+    `data_version` is a callable lot_id -> version (the event broker's), used to
+    refresh a lot early after its sessions change. `timezone_of` is a callable
+    lot_id -> ZoneInfo giving each lot's local day. `lot_exists` is a callable
+    lot_id -> bool; other ids are refused, so they never become active lots.
+    """
+
+    def __init__(self, interval=SNAPSHOT_INTERVAL_SEC, data_version=None, timezone_of=None, lot_exists=None):
+        self.interval = interval
+        self.timezone_of = timezone_of or (lambda lot_id: zoneinfo.ZoneInfo(DEFAULT_TIMEZONE))
+        self.data_version = data_version or (lambda lot_id: None)
+        self.lot_exists = lot_exists or (lambda lot_id: True)
+        self._snapshots = {}                 # lot_id -> TodaySnapshot, replaced whole
+        self._last_request = {}              # lot_id -> epoch of the last read
+        self._locks = {}                     # lot_id -> asyncio.Lock, one computation at a time
+
+    def compute(self, lot_id):
+        """Recompute and publish one lot's snapshot. Blocking; both queries share one `now`."""
+        version = self.data_version(lot_id)
+        local_tz = self.timezone_of(lot_id)
+        now_utc = datetime.now(timezone.utc)
+        with get_connection_pool().connection() as conn:
+            durations = compute_stall_durations(conn, lot_id, local_tz, now_utc)
+            availability = compute_availability_today(conn, lot_id, local_tz, now_utc)
+        snap = TodaySnapshot(lot_id, local_tz, now_utc.astimezone(local_tz).date(), now_utc.timestamp(),
+                             version, durations, availability)
+        self._snapshots[lot_id] = snap
+        return snap
+
+    def _usable(self, snap):
+        """Good enough to serve: today's, and not left behind by a stalled scheduler."""
+        return (snap is not None
+                and snap.day == datetime.now(snap.tz).date()
+                and snap.age() < 3 * self.interval)
+
+    def _due(self, snap, lot_id):
+        if snap is None or not self._usable(snap) or snap.age() >= self.interval:
+            return True
+        return snap.age() >= SNAPSHOT_MIN_INTERVAL_SEC and snap.data_version != self.data_version(lot_id)
+
+    async def get(self, lot_id):
+        """Current snapshot for lot_id; computed inline only on a lot's first request
+        (or when the scheduler fell behind). Marks the lot active."""
+        if not self.lot_exists(lot_id):
+            raise UnknownLotError(lot_id)
+        self._last_request[lot_id] = time.time()
+        snap = self._snapshots.get(lot_id)
+        if self._usable(snap):
+            return snap
+        lock = self._locks.setdefault(lot_id, asyncio.Lock())
+        async with lock:
+            snap = self._snapshots.get(lot_id)
+            if self._usable(snap):
+                return snap
+            return await asyncio.get_running_loop().run_in_executor(None, self.compute, lot_id)
+
+    def active_lots(self):
+        cutoff = time.time() - ACTIVE_LOT_TTL_SEC
+        return [lot_id for lot_id, seen in list(self._last_request.items()) if seen >= cutoff]
+
+    async def run(self):
+        """Background task: keep every active lot's snapshot fresh."""
+        loop = asyncio.get_running_loop()
+        while True:
+            for lot_id in self.active_lots():
+                if not self._due(self._snapshots.get(lot_id), lot_id):
+                    continue
+                lock = self._locks.setdefault(lot_id, asyncio.Lock())
+                try:
+                    async with lock:
+                        await loop.run_in_executor(None, self.compute, lot_id)
+                except Exception as e:
+                    print(f"Snapshot refresh error for lot {lot_id}: {e}")
+            self._forget_quiet_lots()
+            await asyncio.sleep(SCHEDULER_TICK_SEC)
+
+    def _forget_quiet_lots(self):
+        """Drop lots that went quiet, with their snapshots and locks (unless one is held)."""
+        cutoff = time.time() - ACTIVE_LOT_TTL_SEC
+        for lot_id in [l for l, seen in list(self._last_request.items()) if seen < cutoff]:
+            self._last_request.pop(lot_id, None)
+            self._snapshots.pop(lot_id, None)
+            lock = self._locks.get(lot_id)
+            if lock is not None and not lock.locked():
+                del self._locks[lot_id]
+
+    def status(self):
+        return {str(lot_id): {"age_sec": round(snap.age(), 1), "day": snap.day.isoformat()}
+                for lot_id, snap in list(self._snapshots.items())}
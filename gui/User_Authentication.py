@@ -1,67 +1,189 @@
-import psycopg
 import os
+import time
+import asyncio
+import threading
+import ipaddress
 import bcrypt
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# bcrypt is deliberately slow; give it its own small executor so a login burst
+# cannot occupy the threadpool that serves every other sync endpoint.
+BCRYPT_WORKERS = int(os.getenv("BCRYPT_WORKERS", "2"))
+LOGIN_MAX_PENDING = int(os.getenv("LOGIN_MAX_PENDING", "32"))
+LOGIN_RATE_LIMIT_MAX_KEYS = int(os.getenv("LOGIN_RATE_LIMIT_MAX_KEYS", "100000"))   # per limiter
+# reverse proxies whose X-Forwarded-For is believed, e.g. "10.0.0.0/8,127.0.0.1"; with none,
+# the peer address is the client and the header is ignored
+TRUSTED_PROXIES = [ipaddress.ip_network(n.strip(), strict=False)
+                   for n in os.getenv("TRUSTED_PROXIES", "").split(",") if n.strip()]
+# checked for usernames that do not exist, so they cost the same bcrypt time as real ones
+# (gensalt()'s default cost, like the stored hashes)
+DUMMY_PASSWORD_HASH = b"$2b$12$uCvYzrjkB5iLaxl6mpB0IeLlVOl627XH6NaC5zYFbUAfJwQ.YUd/m"
+
+bcrypt_executor = ThreadPoolExecutor(max_workers=BCRYPT_WORKERS, thread_name_prefix="bcrypt")
+_pending_logins = 0
+
+
+class LoginBusyError(Exception):
+    """Raised when more than LOGIN_MAX_PENDING logins are already waiting on bcrypt."""
+
+
+class SlidingWindowRateLimiter:
+    """Allow at most `max_hits` hits per key within the last `window_seconds`.
+
+    Keys that stop hitting are swept out once per window, and past `max_keys` the key
+    hit least recently is dropped, so spraying new usernames or addresses cannot grow
+    the table without bound.
+    """
+
+    def __init__(self, max_hits, window_seconds, max_keys=LOGIN_RATE_LIMIT_MAX_KEYS):
+        self.max_hits = max_hits
+        self.window_seconds = window_seconds
+        self.max_keys = max_keys
+        self._hits = OrderedDict()              # key -> deque of hit times, least recently hit first
+        self._last_sweep = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _prune(self, key, now):
+        hits = self._hits.get(key)
+        if hits is None:
+            return None
+        while hits and now - hits[0] >= self.window_seconds:
+            hits.popleft()
+        if not hits:
+            del self._hits[key]
+            return None
+        return hits
+
+    def _sweep(self, now):
+        if now - self._last_sweep < self.window_seconds:
+            return
+        self._last_sweep = now
+        for key in [k for k, hits in self._hits.items() if now - hits[-1] >= self.window_seconds]:
+            del self._hits[key]
+
+    def retry_after(self, key):
+        """Seconds until `key` may try again, 0 if it is not limited."""
+        now = time.monotonic()
+        with self._lock:
+            hits = self._prune(key, now)
+            if hits is None or len(hits) < self.max_hits:
+                return 0
+            return max(1, int(self.window_seconds - (now - hits[0])) + 1)
+
+    def hit(self, key):
+        now = time.monotonic()
+        with self._lock:
+            self._sweep(now)
+            hits = self._prune(key, now)
+            if hits is None:
+                hits = self._hits[key] = deque()
+                while len(self._hits) > self.max_keys:
+                    self._hits.popitem(last=False)
+            else:
+                self._hits.move_to_end(key)
+            hits.append(now)
+
+    def reset(self, key):
+        with self._lock:
+            self._hits.pop(key, None)
+
+
+# every attempt counts against the client IP; only failures count against the username,
+# wherever they come from, so guessing one account's password from many addresses is
+# limited too. The price: failures from elsewhere delay that user's logins for a window.
+ip_rate_limiter = SlidingWindowRateLimiter(
+    int(os.getenv("LOGIN_MAX_ATTEMPTS_PER_IP", "20")), int(os.getenv("LOGIN_IP_WINDOW_SEC", "60")))
+user_rate_limiter = SlidingWindowRateLimiter(
+    int(os.getenv("LOGIN_MAX_FAILURES_PER_USER", "5")), int(os.getenv("LOGIN_USER_WINDOW_SEC", "300")))
+
+
+def _trusted_proxy(address):
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in net for net in TRUSTED_PROXIES)
+
+
+def client_ip(peer, forwarded_for=None):
+    """Address the login limits apply to: the peer, or, when the peer is a trusted proxy,
+    the nearest X-Forwarded-For hop that is not one (each proxy appends the address it
+    saw, so the header is read right to left and entries a client wrote are never reached)."""
+    if not forwarded_for or not _trusted_proxy(peer):
+        return peer
+    hops = [h.strip() for h in forwarded_for.split(",") if h.strip()]
+    for hop in reversed(hops):
+        if not _trusted_proxy(hop):
+            return hop
+    return hops[0] if hops else peer
 
 
 def create_user(username, email, raw_password):
+    from ParkingLot_Database_Utils import get_connection_pool
+
     password_bytes = raw_password.encode()
     hashed = bcrypt.hashpw(password_bytes, bcrypt.gensalt()).decode()
 
-    conn = psycopg.connect(
-            dbname=os.getenv("PG_DBNAME", "your_db"),
-            user=os.getenv("PG_USER", "your_user"),
-            password=os.getenv("PG_PASSWORD", "your_password"),
-            host=os.getenv("PG_HOST", "localhost"),
-            port=os.getenv("PG_PORT", "5432")
-        )
-    cur = conn.cursor()
-    cur.execute("""
-        INSERT INTO public.users (username, email, password_hash)
-        VALUES (%s, %s, %s);
-    """, (username, email, hashed))
-    conn.commit()
-    cur.close()
-    conn.close()
+    pool = get_connection_pool()
+    with pool.connection() as conn:
+        conn.execute("""
+            INSERT INTO public.users (username, email, password_hash)
+            VALUES (%s, %s, %s);
+        """, (username, email, hashed))
     print("User created.")
 
 
+def get_password_hash(username):
+    """Stored bcrypt hash for `username`, or None if the user does not exist."""
+    from ParkingLot_Database_Utils import get_connection_pool
 
-def authenticate_user_sql(username, input_password):
-    # Placeholder for SQL authentication logic
-    # In a real application, you would query your database here
-    # return username == "user" and password == "password"
-    try:
-        conn = psycopg.connect(
-            dbname=os.getenv("PG_DBNAME", "your_db"),
-            user=os.getenv("PG_USER", "your_user"),
-            password=os.getenv("PG_PASSWORD", "your_password"),
-            host=os.getenv("PG_HOST", "localhost"),
-            port=os.getenv("PG_PORT", "5432")
-        )
-        cur = conn.cursor()
+    pool = get_connection_pool()
+    with pool.connection() as conn:
         # IMPORTANT: Use parameterized queries to prevent SQL injection
-        cur.execute("SELECT password_hash FROM users WHERE username = %s;", (username,))
-        result = cur.fetchone()
-        cur.close()
-        conn.close()
+        row = conn.execute("SELECT password_hash FROM users WHERE username = %s;", (username,)).fetchone()
+    return row[0] if row else None
 
-        if not result:
+
+def authenticate_user_sql(username, input_password):
+    try:
+        stored_hash = get_password_hash(username)
+        if not stored_hash:
             print("User not found.")
+            bcrypt.checkpw(input_password.encode(), DUMMY_PASSWORD_HASH)
             return False
-
-        
-        stored_hash = result[0].encode()
-        is_valid = bcrypt.checkpw(input_password.encode(), stored_hash)
-
-        return is_valid
+        return bcrypt.checkpw(input_password.encode(), stored_hash.encode())
+    except Exception as e:
+        print(f"Database connection or query error: {e}")
+        return False
 
 
+async def authenticate_user_async(username, input_password):
+    """Non-blocking authenticate_user_sql: the lookup uses the shared pool, bcrypt runs
+    on bcrypt_executor, for unknown usernames too. Raises LoginBusyError instead of
+    queueing without bound."""
+    global _pending_logins
+    if _pending_logins >= LOGIN_MAX_PENDING:
+        raise LoginBusyError()
+    _pending_logins += 1
+    try:
+        loop = asyncio.get_running_loop()
+        try:
+            stored_hash = await loop.run_in_executor(None, get_password_hash, username)
+        except Exception as e:
+            print(f"Database connection or query error: {e}")
+            return False
+        valid = await loop.run_in_executor(
+            bcrypt_executor, bcrypt.checkpw, input_password.encode(),
+            stored_hash.encode() if stored_hash else DUMMY_PASSWORD_HASH)
+        if not stored_hash:
+            print("User not found.")
+            return False
+        return valid
+    finally:
+        _pending_logins -= 1
 
 
-    except Exception as e:
-        print(f"Database connection or query error: {e}")
-        return False
-    
 def load_env(env_path):
     """Loads environment variables from a .env file if it exists.
     Environment variables are set using os.environ.setdefault,
@@ -0,0 +1,91 @@
+"""Array vs bitset availability snapshots: storage, count queries and stall timelines.
+
+Run from gui/ against a database seeded with ParkingLot_Synthetic_Data.py and
+migrated to schema version 3 or later:
+    python benchmarks/bench_availability_bitset.py --lot 1 --days 90
+"""
+import os
+import sys
+import time
+import argparse
+from datetime import datetime, timedelta
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from User_Authentication import load_env
+from ParkingLot_Database_Utils import get_connection_pool, close_connection_pool
+from Availability_Bitset import decode_many, delta_encode
+
+
+def best_of(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - t0)
+    return min(timings) * 1000, result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lot", type=int, default=1)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--stall", type=int, default=12)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    load_env("./.env")
+    end = datetime.utcnow()
+    start = end - timedelta(days=args.days)
+    bounds = (args.lot, start, end)
+    where = 'WHERE lot_id = %s AND "timestamp" >= %s AND "timestamp" < %s'
+
+    with get_connection_pool().connection() as conn:
+        n_stalls = conn.execute("SELECT MAX(CAST(stall_number AS INTEGER)) + 1 FROM public.stalls "
+                                "WHERE lot_id = %s", (args.lot,)).fetchone()[0]
+        rows, array_bytes, bitset_bytes = conn.execute(
+            f"SELECT count(*), avg(pg_column_size(available_stalls)), avg(pg_column_size(available_bitset)) "
+            f"FROM public.availabilitysnapshots {where}", bounds).fetchone()
+        print(f"snapshots={rows} stalls={n_stalls}")
+        print(f"storage     array={float(array_bytes):6.1f} B/row  bitset={float(bitset_bytes):6.1f} B/row "
+              f"(+2 B count)")
+
+        ms_a, total_a = best_of(lambda: conn.execute(
+            f"SELECT SUM(array_length(available_stalls, 1)) FROM public.availabilitysnapshots {where}",
+            bounds).fetchone()[0], args.repeat)
+        ms_b, total_b = best_of(lambda: conn.execute(
+            f"SELECT SUM(available_count) FROM public.availabilitysnapshots {where}",
+            bounds).fetchone()[0], args.repeat)
+        assert total_a == total_b
+        print(f"count query array={ms_a:7.1f} ms       stored count={ms_b:7.1f} ms")
+
+        def timeline_from_arrays():
+            arrays = conn.execute(f'SELECT available_stalls FROM public.availabilitysnapshots {where} '
+                                  f'ORDER BY "timestamp"', bounds).fetchall()
+            return np.array([args.stall in a for (a,) in arrays])
+
+        def timeline_from_bitsets():
+            with conn.cursor(binary=True) as cur:
+                cur.execute(f'SELECT COALESCE(array_agg(available_bitset ORDER BY "timestamp"), \'{{}}\') '
+                            f'FROM public.availabilitysnapshots {where}', bounds)
+                return decode_many(cur.fetchone()[0], n_stalls)[:, args.stall]
+
+        ms_a, col_a = best_of(timeline_from_arrays, args.repeat)
+        ms_b, col_b = best_of(timeline_from_bitsets, args.repeat)
+        assert np.array_equal(col_a, col_b)
+        print(f"timeline    array={ms_a:7.1f} ms       bitset={ms_b:7.1f} ms  (stall {args.stall})")
+
+        with conn.cursor(binary=True) as cur:
+            cur.execute(f'SELECT COALESCE(array_agg(available_bitset ORDER BY "timestamp"), \'{{}}\') '
+                        f'FROM public.availabilitysnapshots {where}', bounds)
+            blobs = cur.fetchone()[0]
+        t0 = time.perf_counter()
+        matrix = decode_many(blobs, n_stalls)
+        decode_ms = (time.perf_counter() - t0) * 1000
+        deltas = delta_encode(blobs)
+        unchanged = sum(not any(d) for d in deltas[1:])
+        print(f"decode_many {matrix.shape[0]}x{matrix.shape[1]} in {decode_ms:.1f} ms; "
+              f"delta: {unchanged} of {len(deltas) - 1} snapshots identical to the previous one")
+    close_connection_pool()
@@ -0,0 +1,89 @@
+"""Backtest and latency of the seasonal availability forecast.
+
+Fits a lot's profile on the history before the last --test-days, then walks
+through those days hour by hour: advance the profile with the snapshots that
+arrived since the previous origin (as the cache does), forecast, and compare
+with what was observed. The model is reported next to two baselines: the bare
+seasonal profile and persistence (the last observed value).
+
+Run from gui/ against a database seeded with ParkingLot_Synthetic_Data.py:
+    python benchmarks/bench_availability_forecast.py --lot 1 --test-days 7
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from User_Authentication import load_env
+from ParkingLot_Database_Utils import get_connection_pool, close_connection_pool
+from Availability_Forecast import (SeasonalProfile, fetch_snapshots, week_bins,
+                                   FORECAST_HISTORY_DAYS, BIN_SECONDS)
+from Lot_Calendar import lot_timezones
+
+LEADS_H = (0.5, 1, 2, 4, 6)
+MATCH_SEC = 600                     # an observation within 10 minutes of the target counts
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lot", type=int, default=1)
+    parser.add_argument("--test-days", type=int, default=7)
+    parser.add_argument("--step-hours", type=float, default=1)
+    args = parser.parse_args()
+
+    load_env("./.env")
+    lot_timezones.load()
+    tz = lot_timezones.get(args.lot)
+    with get_connection_pool().connection() as conn:
+        end = time.time()
+        epochs, counts = fetch_snapshots(conn, args.lot, end - (FORECAST_HISTORY_DAYS + args.test_days) * 86400, end)
+    close_connection_pool()
+    if not len(epochs):
+        sys.exit(f"No snapshots for lot {args.lot}")
+    end = epochs[-1]
+    test_start = end - args.test_days * 86400
+
+    profile = SeasonalProfile(tz)
+    t0 = time.perf_counter()
+    first = epochs < test_start
+    profile = profile.advanced(epochs[first], counts[first], test_start)
+    fit_ms = (time.perf_counter() - t0) * 1000
+
+    errors = {name: {lead: [] for lead in LEADS_H} for name in ("model", "profile", "persistence")}
+    update_ms, forecast_ms = [], []
+    max_lead = max(LEADS_H)
+    origin = test_start + args.step_hours * 3600
+    while origin + max_lead * 3600 <= end:
+        new = (epochs >= profile.fitted_until) & (epochs < origin)
+        t0 = time.perf_counter()
+        profile = profile.advanced(epochs[new], counts[new], origin)
+        update_ms.append((time.perf_counter() - t0) * 1000)
+
+        t0 = time.perf_counter()
+        targets, predicted, _, _ = profile.forecast(origin, max_lead)
+        forecast_ms.append((time.perf_counter() - t0) * 1000)
+        mean, _ = profile.mean_std()
+        bare = mean[week_bins(targets, tz)]
+
+        # the observation at or just before each target
+        idx = np.searchsorted(epochs, targets, side="right") - 1
+        for lead in LEADS_H:
+            k = int(round(lead * 3600 / BIN_SECONDS)) - 1
+            if k >= len(targets) or idx[k] < 0 or targets[k] - epochs[idx[k]] > MATCH_SEC:
+                continue
+            actual = counts[idx[k]]
+            errors["model"][lead].append(abs(predicted[k] - actual))
+            errors["profile"][lead].append(abs(bare[k] - actual))
+            errors["persistence"][lead].append(abs(profile.last_value - actual))
+        origin += args.step_hours * 3600
+
+    print(f"lot={args.lot} snapshots={len(epochs)} origins={len(update_ms)} "
+          f"initial fit={fit_ms:.1f} ms ({first.sum()} snapshots)")
+    print(f"incremental update p50={np.median(update_ms):.3f} ms  forecast p50={np.median(forecast_ms):.3f} ms "
+          f"p99={np.percentile(forecast_ms, 99):.3f} ms")
+    print("MAE (spots) by lead time:")
+    print(f"  {'lead':>6s} " + " ".join(f"{name:>12s}" for name in errors))
+    for lead in LEADS_H:
+        print(f"  {lead:5.1f}h " + " ".join(f"{np.mean(errors[name][lead]):12.2f}" for name in errors))
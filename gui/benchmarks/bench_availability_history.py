@@ -0,0 +1,39 @@
+"""Response size and latency of /api/availability/history across ranges.
+
+Run from gui/ against a database seeded with ParkingLot_Synthetic_Data.py:
+    python benchmarks/bench_availability_history.py --lot 1 --points 300
+"""
+import os
+import sys
+import time
+import argparse
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient
+import main
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lot", type=int, default=1)
+    parser.add_argument("--points", type=int, default=300)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    client = TestClient(main.app)
+    today = date.today()
+    for days in (1, 7, 30, 90, 365, 365 * 3):
+        start = (today - timedelta(days=days)).isoformat()
+        for method in ("lttb", "minmax"):
+            url = f"/api/availability/history?lot_id={args.lot}&start={start}&points={args.points}&method={method}"
+            timings = []
+            for _ in range(args.repeat):
+                t0 = time.perf_counter()
+                resp = client.get(url)
+                timings.append(time.perf_counter() - t0)
+            body = resp.json()
+            print(f"range={days:5d}d method={method:6s} source_points={body['source_points']:8d} "
+                  f"returned={len(body['data']):4d} bytes={len(resp.content):7d} "
+                  f"best={min(timings) * 1000:7.1f} ms")
@@ -0,0 +1,139 @@
+"""Local calendar: clock-hour grids and daily stall histories in a lot's time zone.
+
+1. Hour grids (heatmap, forecast bins, export daily totals) cut from the zone's
+   LocalCalendar vs converting every hour with zoneinfo.
+2. Daily occupied hours of every stall of a lot over --days, from stall_history
+   (each session joined to the local days it overlaps in public.local_days) and
+   from the previous form of the query, whose day grid stepped 24 hours at a time
+   from the first local midnight, joined every day to every session and converted
+   each day back to a local date. Both are checked against NumPy daily
+   totals over the same sessions (Occupancy_Heatmap.daily_occupied_hours); with a
+   DST change in the range the 24-hour grid puts an hour on the wrong day.
+
+Run from gui/ against a database seeded with ParkingLot_Synthetic_Data.py, with
+history across a DST change for part 2:
+    python benchmarks/bench_local_calendar.py --lot 1 --days 365
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+import zoneinfo
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from User_Authentication import load_env
+from ParkingLot_Database_Utils import get_connection_pool, close_connection_pool
+from Lot_Calendar import calendar_for, lot_timezones, _converted_hour_grid
+from Occupancy_Heatmap import daily_occupied_hours
+from Query_Registry import run_query
+
+ZONES = ("America/Edmonton", "Europe/Berlin", "Asia/Kolkata", "Australia/Sydney")
+TOLERANCE_H = 0.01
+
+# stall_history before migration 6: 24-hour steps in the session's time zone (UTC)
+UTC_DAY_GRID_HISTORY_SQL = """
+WITH day_grid AS (
+    SELECT generate_series(%(start)s::timestamptz, %(end)s::timestamptz, interval '1 day') AS day_start_utc
+),
+sess AS (
+    SELECT ps.entry_timestamp AS entry_utc, COALESCE(ps.exit_timestamp, %(end)s::timestamptz) AS exit_utc
+    FROM public.parkingsessions ps
+    WHERE ps.stall_id = %(stall_id)s
+      AND ps.entry_timestamp >= %(since)s::timestamptz
+      AND ps.entry_timestamp <  %(end)s::timestamptz
+      AND COALESCE(ps.exit_timestamp, %(end)s::timestamptz) > %(start)s::timestamptz
+)
+SELECT (g.day_start_utc AT TIME ZONE %(tz)s)::date,
+       COALESCE(SUM(EXTRACT(EPOCH FROM GREATEST(interval '0 second',
+                LEAST(s.exit_utc, g.day_start_utc + interval '1 day')
+                - GREATEST(s.entry_utc, g.day_start_utc)))), 0) / 3600.0
+FROM day_grid g
+LEFT JOIN sess s ON s.entry_utc < g.day_start_utc + interval '1 day' AND s.exit_utc > g.day_start_utc
+GROUP BY 1 ORDER BY 1;
+"""
+
+
+def time_ms(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(times)
+
+
+def bench_hour_grids(repeat):
+    now = time.time()
+    print("hour grid, median ms     calendar   per-hour zoneinfo")
+    for name in ZONES:
+        tz = zoneinfo.ZoneInfo(name)
+        t0 = time.perf_counter()
+        cal = calendar_for(tz)
+        build_ms = (time.perf_counter() - t0) * 1000
+        for days in (28, 365, 1095):
+            start = now - days * 86400
+            a = time_ms(lambda: cal.hour_grid(start, now), repeat)
+            b = time_ms(lambda: _converted_hour_grid(start, now, tz), repeat)
+            print(f"  {name:18s} {days:5d} d {a:9.2f} {b:14.2f}")
+        print(f"  {name:18s} calendar built in {build_ms:.0f} ms")
+
+
+def bench_stall_histories(lot_id, days, repeat):
+    tz = lot_timezones.get(lot_id)
+    cal = calendar_for(tz)
+    now_utc = datetime.now(timezone.utc)
+    last_day = now_utc.astimezone(tz).date()
+    first_day = last_day - timedelta(days=days - 1)
+    start_utc = cal.midnight(first_day)
+    dst_days = sum(1 for i in cal.dst_days.tolist()
+                   if first_day.toordinal() <= i + cal.first_ordinal <= last_day.toordinal())
+    print(f"\nlot {lot_id} ({tz}), {first_day} .. {last_day}: {dst_days} DST change days")
+
+    with get_connection_pool().connection() as conn:
+        stalls = run_query(conn, "stall_numbers", (lot_id,)).fetchall()
+        n_stalls = run_query(conn, "lot_stall_count", (lot_id,)).fetchone()[0]
+        numbers, entries, exits = run_query(conn, "lot_sessions_in_range",
+                                            (lot_id, start_utc, now_utc, start_utc,
+                                             start_utc, now_utc, now_utc), binary=True).fetchone()
+        dates, hours = daily_occupied_hours(numbers, entries, exits, n_stalls,
+                                            start_utc.timestamp(), now_utc.timestamp(), tz)
+        expected = {int(snum): dict(zip(dates, hours[int(snum)].tolist())) for _, snum in stalls}
+
+        wrong = {"stall_history": 0, "24-hour grid": 0}
+        elapsed = {"stall_history": [], "24-hour grid": []}
+        for stall_id, snum in stalls:
+            running = run_query(conn, "stall_session_at", {"stall_id": stall_id, "at": start_utc}).fetchone()
+            params = {"tz": str(tz), "start": start_utc, "end": now_utc, "stall_id": stall_id,
+                      "since": running[0] if running else start_utc}
+            for label, run in (("stall_history", lambda: run_query(conn, "stall_history", params)),
+                               ("24-hour grid", lambda: conn.execute(UTC_DAY_GRID_HISTORY_SQL, params,
+                                                                      prepare=True))):
+                for _ in range(repeat):
+                    t0 = time.perf_counter()
+                    rows = run().fetchall()
+                    elapsed[label].append((time.perf_counter() - t0) * 1000)
+                got = {d: float(h) for d, h in rows}
+                wrong[label] += sum(abs(got.get(d, 0.0) - h) > TOLERANCE_H
+                                    for d, h in expected[int(snum)].items())
+        conn.rollback()
+
+    print(f"  {len(stalls)} stalls x {len(dates)} days     median ms   days off by > {TOLERANCE_H} h")
+    for label in wrong:
+        print(f"  {label:22s} {statistics.median(elapsed[label]):10.2f} {wrong[label]:14d}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lot", type=int, default=1)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    load_env("./.env")
+    lot_timezones.load()
+    bench_hour_grids(args.repeat)
+    bench_stall_histories(args.lot, args.days, args.repeat)
+    close_connection_pool()
@@ -0,0 +1,80 @@
+"""Login latency under concurrent load.
+
+Run from gui/ against a local database:
+    python benchmarks/bench_login.py --concurrency 1 8 32 --logins 64
+
+Alongside the logins, a probe repeatedly runs a cheap query on the default
+threadpool, so the report also shows whether a login burst slows other endpoints.
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from User_Authentication import load_env, authenticate_user_async, create_user, get_password_hash
+from ParkingLot_Database_Utils import get_connection_pool, close_connection_pool
+
+BENCH_USER = "bench_login_user"
+BENCH_PASSWORD = "bench-password"
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def probe_query():
+    with get_connection_pool().connection() as conn:
+        conn.execute("SELECT 1").fetchone()
+
+
+async def run(concurrency, logins):
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, probe_latencies = [], []
+    done = asyncio.Event()
+
+    async def one_login():
+        async with semaphore:
+            t0 = time.perf_counter()
+            ok = await authenticate_user_async(BENCH_USER, BENCH_PASSWORD)
+            latencies.append(time.perf_counter() - t0)
+            assert ok
+
+    async def probe():
+        while not done.is_set():
+            t0 = time.perf_counter()
+            await loop.run_in_executor(None, probe_query)
+            probe_latencies.append(time.perf_counter() - t0)
+            await asyncio.sleep(0.01)
+
+    probe_task = asyncio.create_task(probe())
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one_login() for _ in range(logins)))
+    elapsed = time.perf_counter() - t0
+    done.set()
+    await probe_task
+
+    ms = lambda v: f"{v * 1000:8.1f}"
+    print(f"concurrency={concurrency:<4} logins/s={logins / elapsed:7.1f} "
+          f"p50={ms(percentile(latencies, 50))} p95={ms(percentile(latencies, 95))} "
+          f"p99={ms(percentile(latencies, 99))} ms | probe p50={ms(statistics.median(probe_latencies))} "
+          f"p99={ms(percentile(probe_latencies, 99))} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--logins", type=int, default=64)
+    args = parser.parse_args()
+
+    load_env("./.env")
+    if get_password_hash(BENCH_USER) is None:
+        create_user(BENCH_USER, "bench@example.com", BENCH_PASSWORD)
+    for c in args.concurrency:
+        asyncio.run(run(c, args.logins))
+    close_connection_pool()
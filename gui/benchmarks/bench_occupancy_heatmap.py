@@ -0,0 +1,65 @@
+"""Lot-wide hour-of-week heatmap: one session query plus NumPy vs the per-stall
+get_stall_history loop the single-stall dashboard uses.
+
+Run from gui/ against a database seeded with ParkingLot_Synthetic_Data.py:
+    python benchmarks/bench_occupancy_heatmap.py --days 90
+"""
+import os
+import sys
+import time
+import argparse
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from User_Authentication import load_env
+from ParkingLot_Database_Utils import get_connection_pool, close_connection_pool
+from ParkingLot_Queries import STALL_NUMBERS_SQL, STALL_SESSION_AT_SQL, STALL_HISTORY_SQL
+from Lot_Calendar import lot_timezones
+from main import compute_occupancy_heatmap
+
+
+def per_stall_history(conn, lot_id, start_dt, end_dt):
+    """What building the lot view from the stall dashboard's queries would cost."""
+    stall_ids = [sid for sid, _ in conn.execute(STALL_NUMBERS_SQL, (lot_id,)).fetchall()]
+    start_utc, end_utc = start_dt.astimezone(timezone.utc), end_dt.astimezone(timezone.utc)
+    for stall_id in stall_ids:
+        running = conn.execute(STALL_SESSION_AT_SQL, {"stall_id": stall_id, "at": start_utc}).fetchone()
+        conn.execute(STALL_HISTORY_SQL, {"tz": str(start_dt.tzinfo), "start": start_utc, "end": end_utc,
+                                         "stall_id": stall_id,
+                                         "since": running[0] if running else start_utc}).fetchall()
+    return len(stall_ids)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--days", type=int, default=90)
+    args = parser.parse_args()
+
+    load_env("./.env")
+    with get_connection_pool().connection() as conn:
+        lot_ids = [r[0] for r in conn.execute("SELECT DISTINCT lot_id FROM public.stalls ORDER BY 1")]
+    lot_timezones.load()
+
+    total = 0.0
+    for lot_id in lot_ids:
+        local_tz = lot_timezones.get(lot_id)
+        end_dt = datetime.now(local_tz).replace(minute=0, second=0, microsecond=0)
+        start_dt = end_dt - timedelta(days=args.days)
+        t0 = time.perf_counter()
+        result = compute_occupancy_heatmap(lot_id, start_dt, end_dt, local_tz)
+        ms = (time.perf_counter() - t0) * 1000
+        total += ms
+        print(f"lot {lot_id}: heatmap {len(result['matrix'])} stalls, "
+              f"{result['sessions']} sessions in {ms:7.1f} ms")
+    print(f"all {len(lot_ids)} lots: {total:.0f} ms")
+
+    local_tz = lot_timezones.get(lot_ids[0])
+    end_dt = datetime.now(local_tz).replace(minute=0, second=0, microsecond=0)
+    start_dt = end_dt - timedelta(days=args.days)
+    with get_connection_pool().connection() as conn:
+        t0 = time.perf_counter()
+        n = per_stall_history(conn, lot_ids[0], start_dt, end_dt)
+        print(f"lot {lot_ids[0]}: per-stall daily history for {n} stalls in "
+              f"{(time.perf_counter() - t0) * 1000:7.1f} ms (daily totals only)")
+    close_connection_pool()
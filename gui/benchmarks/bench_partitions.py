@@ -0,0 +1,141 @@
+"""Today and 7-day query latency at 3 months vs 3 years of history, before and
+after the tables are partitioned by month (migration 5).
+
+For each history length a scratch database is created next to PG_DBNAME,
+migrated to version 4 (plain tables) and seeded with one lot; the endpoint
+queries are timed, then migration 5 partitions the same rows and they are timed
+again. Queries run by name through the registry as prepared statements, as the
+endpoints run them, so generic plans and run-time partition pruning are what
+gets measured. The queries that join the local calendar (migration 6) only run on
+the partitioned layout. The scratch database is dropped afterwards unless --keep.
+
+Run from gui/ with a role that may create databases:
+    python benchmarks/bench_partitions.py --days 90 1095
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+from datetime import datetime, timedelta, timezone
+
+import psycopg
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from User_Authentication import load_env
+from ParkingLot_Database_Utils import get_connection_pool, close_connection_pool, get_conninfo
+from ParkingLot_Schema_Migrations import apply_migrations, get_schema_version
+from ParkingLot_Synthetic_Data import seed_synthetic_data
+from Query_Registry import run_query
+from Today_Snapshot import today_bounds
+from Lot_Calendar import DEFAULT_TIMEZONE
+
+LOT_ID = 1
+CALENDAR_QUERIES = {"today portfolio", "7d stall_history"}     # join public.local_days (migration 6)
+
+
+def query_params(conn, now_utc):
+    """name -> (registry query, params) for the today and 7-day endpoint queries."""
+    stall_id = conn.execute("SELECT MIN(stall_id) FROM public.stalls WHERE lot_id = %s", (LOT_ID,)).fetchone()[0]
+    start, now = today_bounds(DEFAULT_TIMEZONE, now_utc)     # the seeded lot keeps the default zone
+    end = start + timedelta(days=1)
+    week = start - timedelta(days=6)
+    naive = lambda t: t.replace(tzinfo=None)
+    since = now - timedelta(hours=26)
+    return {
+        "today stall_durations":   ("stall_durations", (now, now, start, end, LOT_ID)),
+        "today availability":      ("availability_today", {"start": start, "now": now, "lot_id": LOT_ID}),
+        "today portfolio":         ("lot_portfolio_today", {"lot_ids": [LOT_ID], "now": now, "since": since,
+                                                            "now_naive": naive(now),
+                                                            "since_naive": naive(since)}),
+        "7d stall_session_at":     ("stall_session_at", {"stall_id": stall_id, "at": week}),
+        "7d stall_history":        ("stall_history", {"tz": DEFAULT_TIMEZONE, "start": week, "end": now,
+                                                      "stall_id": stall_id, "since": week}),
+        "7d lot_sessions":         ("lot_sessions_in_range", (LOT_ID, week, now, week, week, now, now)),
+        "7d availability_series":  ("availability_series", (LOT_ID, naive(week), naive(now))),
+    }
+
+
+def time_queries(conn, now_utc, repeat):
+    """Median ms per query; the first executions (custom plans) are not counted."""
+    out = {}
+    has_calendar = get_schema_version(conn) >= 6
+    for label, (name, params) in query_params(conn, now_utc).items():
+        if label in CALENDAR_QUERIES and not has_calendar:
+            continue
+        times = []
+        for i in range(repeat + 6):
+            t0 = time.perf_counter()
+            run_query(conn, name, params).fetchall()
+            if i >= 6:                       # psycopg prepares on first use, Postgres goes generic after 5
+                times.append((time.perf_counter() - t0) * 1000)
+        out[label] = statistics.median(times)
+    conn.rollback()
+    return out
+
+
+def recreate_database(name, drop_only=False):
+    admin = {**get_conninfo(), "dbname": "postgres"}
+    with psycopg.connect(**admin, autocommit=True) as conn:
+        conn.execute(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)')
+        if not drop_only:
+            conn.execute(f'CREATE DATABASE "{name}"')
+
+
+def table_sizes(conn):
+    row = conn.execute("""
+        SELECT (SELECT count(*) FROM public.parkingsessions),
+               (SELECT count(*) FROM public.availabilitysnapshots),
+               (SELECT count(*) FROM pg_inherits WHERE inhparent = 'public.parkingsessions'::regclass)
+    """).fetchone()
+    conn.rollback()
+    return row
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--days", type=int, nargs="+", default=[90, 1095])
+    parser.add_argument("--stalls", type=int, default=74)
+    parser.add_argument("--repeat", type=int, default=30)
+    parser.add_argument("--keep", action="store_true", help="keep the last scratch database")
+    args = parser.parse_args()
+
+    load_env("./.env")
+    scratch = f"{os.getenv('PG_DBNAME', 'parking')}_partition_bench"
+    os.environ["PG_DBNAME"] = scratch
+    now_utc = datetime.now(timezone.utc)
+    results = {}
+    for days in args.days:
+        recreate_database(scratch)
+        with get_connection_pool().connection() as conn:
+            conn.execute("SET statement_timeout = 0")
+            conn.commit()
+            apply_migrations(conn, target=4)
+            t0 = time.perf_counter()
+            seed_synthetic_data(conn, [LOT_ID], args.stalls, days, end=now_utc)
+            sessions, snapshots, _ = table_sizes(conn)
+            print(f"{days} days: {sessions} sessions, {snapshots} snapshots "
+                  f"(seeded in {time.perf_counter() - t0:.0f} s)")
+            results[(days, "plain")] = time_queries(conn, now_utc, args.repeat)
+
+            t0 = time.perf_counter()
+            apply_migrations(conn)
+            conn.execute("ANALYZE")
+            conn.commit()
+            partitions = table_sizes(conn)[2]
+            print(f"  partitioned into {partitions} months in {time.perf_counter() - t0:.1f} s")
+        # fresh connections: prepared statements and cached plans still point at the old tables
+        close_connection_pool()
+        with get_connection_pool().connection() as conn:
+            results[(days, "partitioned")] = time_queries(conn, now_utc, args.repeat)
+        close_connection_pool()
+    if not args.keep:
+        recreate_database(scratch, drop_only=True)
+
+    columns = [(days, layout) for days in args.days for layout in ("plain", "partitioned")]
+    print(f"\nmedian ms over {args.repeat} runs")
+    print(f"  {'query':24s}" + "".join(f"{f'{d}d {layout}':>19s}" for d, layout in columns))
+    for label in results[columns[-1]]:
+        print(f"  {label:24s}" + "".join(f"{results[c][label]:19.2f}" if label in results[c] else f"{'-':>19s}"
+                                         for c in columns))
@@ -0,0 +1,75 @@
+"""Overhead of the request profiler on a small in-process app.
+
+Times the same CPU-bound JSON endpoint with profiling off, on (split only)
+and on with stacks, and checks that the split accounts for the wall time.
+No database needed; run from gui/:
+    python benchmarks/bench_request_profiler.py --requests 300
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+from fastapi import FastAPI
+from Request_Profiler import RequestProfiler, RequestProfilerMiddleware
+
+
+def build_app(profiler):
+    app = FastAPI()
+    app.add_middleware(RequestProfilerMiddleware, profiler=profiler)
+
+    @app.get("/work")
+    async def work(n: int = 20000):
+        # label formatting in the style of the dashboard endpoints
+        return {"labels": [f"{i:06d}" for i in range(n)][-10:], "total": sum(range(n))}
+
+    return app
+
+
+async def run(profiler, n_requests):
+    transport = httpx.ASGITransport(app=build_app(profiler))
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for _ in range(20):
+            await client.get("/work")
+        times = []
+        for _ in range(n_requests):
+            t0 = time.perf_counter()
+            await client.get("/work")
+            times.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(times)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--interval-ms", type=float, default=5)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    configs = (("off", {"enabled": False}),
+               ("on", {"enabled": True, "stacks": False}),
+               ("on+stacks", {"enabled": True, "stacks": True}))
+    medians = {name: [] for name, _ in configs}
+    reports = {}
+    for _ in range(args.rounds):                 # interleaved, so drift hits every config alike
+        for name, settings in configs:
+            profiler = RequestProfiler()
+            profiler.configure(interval_ms=args.interval_ms, **settings)
+            medians[name].append(asyncio.run(run(profiler, args.requests)))
+            reports[name] = profiler.report(limit=args.requests)
+            profiler.configure(enabled=False)
+
+    for name, _ in configs:
+        line = f"{name:10s} median {min(medians[name]):6.2f} ms/request"
+        recent = reports[name]["recent"]
+        if recent:
+            wall = statistics.mean(r["wall_ms"] for r in recent)
+            cpu = statistics.mean(r["cpu_ms"] for r in recent)
+            line += (f"   profiled wall {wall:6.2f} ms, cpu {cpu:6.2f} ms, "
+                     f"stacks {reports[name]['distinct_stacks']}")
+        print(line)
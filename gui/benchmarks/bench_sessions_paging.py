@@ -0,0 +1,71 @@
+"""Cost of one /api/sessions page by depth: keyset cursor vs LIMIT/OFFSET.
+
+The OFFSET query is what a naive listing would run; it has to produce and throw
+away every row before the page, so its cost grows with the page number while
+the keyset page stays flat.
+
+Run from gui/ against a database seeded with ParkingLot_Synthetic_Data.py
+(with migration 4 applied):
+    python benchmarks/bench_sessions_paging.py --lot 1 --limit 50
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from User_Authentication import load_env
+from ParkingLot_Database_Utils import get_connection_pool, close_connection_pool
+from ParkingLot_Queries import SESSIONS_PAGE_LOT_SQL
+
+OFFSET_SQL = """
+    SELECT ps.session_id, ps.stall_id, s.stall_number, ps.entry_timestamp, ps.exit_timestamp,
+           ps.vehicle_identifier
+    FROM public.parkingsessions ps
+    JOIN public.stalls s ON s.stall_id = ps.stall_id
+    WHERE s.lot_id = %s
+    ORDER BY ps.entry_timestamp DESC, ps.session_id DESC
+    LIMIT %s OFFSET %s;
+"""
+
+
+def timed(conn, sql, params, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        conn.execute(sql, params).fetchall()
+        times.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(times)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lot", type=int, default=1)
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=7)
+    args = parser.parse_args()
+
+    load_env("./.env")
+    with get_connection_pool().connection() as conn:
+        total = conn.execute("""
+            SELECT count(*) FROM public.parkingsessions ps
+            JOIN public.stalls s ON s.stall_id = ps.stall_id WHERE s.lot_id = %s
+        """, (args.lot,)).fetchone()[0]
+        print(f"lot={args.lot} sessions={total} page size={args.limit}")
+        print(f"  {'page':>6s} {'offset ms':>10s} {'keyset ms':>10s}")
+        for fraction in (0, 0.1, 0.25, 0.5, 0.9):
+            page = int(fraction * total) // args.limit
+            offset = page * args.limit
+            # the cursor a client would hold there: the last row of the previous page
+            previous = conn.execute(OFFSET_SQL, (args.lot, 1, offset - 1)).fetchone() if offset else None
+            before_ts, before_id = ((previous[3], previous[0]) if previous
+                                    else (datetime.now(timezone.utc) + timedelta(days=1), 0))
+            keyset = {"lot_id": args.lot, "start": datetime(1970, 1, 1, tzinfo=timezone.utc),
+                      "before_ts": before_ts, "before_id": before_id, "state": "all",
+                      "limit": args.limit + 1}
+            print(f"  {page + 1:6d} {timed(conn, OFFSET_SQL, (args.lot, args.limit, offset), args.repeat):10.2f} "
+                  f"{timed(conn, SESSIONS_PAGE_LOT_SQL, keyset, args.repeat):10.2f}")
+    close_connection_pool()
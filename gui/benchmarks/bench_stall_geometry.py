@@ -0,0 +1,107 @@
+"""Per-frame cost and agreement of StallOccupancyEngine.occupancy.
+
+    python benchmarks/bench_stall_geometry.py
+
+Stall regions are the 74 labelled stall points of the top-down map projected into the
+2592x1944 camera frame by from_map_points, through a made-up calibration that maps the
+map image onto a trapezoid (a camera looking down the lot); the same layout is tiled
+2x2 and 3x3 into the frame to see how the cost grows with hundreds of stalls.
+Detections are independent of the regions: the vehicle outlines of static/gt_74.json,
+each scaled to a bit more than a random ~60% of the stall regions and dropped on them with some
+jitter, plus a few cars in the lanes that touch no stall. Agreement is against those chosen stalls.
+The unchanged gt_74 outlines of the camera frame are timed too.
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Stall_Occupancy_Geometry import StallOccupancyEngine, FRAME_W, FRAME_H
+
+STATIC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "static")
+MAP_PATH = os.path.join(STATIC, "Brentwood_parking_lot_top_down_map_74.json")
+CARS_PATH = os.path.join(STATIC, "gt_74.json")
+
+# map image corners (468x584) -> camera pixels; for timing only, not the real camera
+BENCH_CALIBRATION = {
+    "map_points": [[0, 0], [468, 0], [468, 584], [0, 584]],
+    "camera_points": [[700, 250], [1900, 250], [2550, 1900], [50, 1900]],
+}
+CAR_OVER_REGION = 1.3   # car outline size relative to the projected stall square (16 of ~21 map px pitch)
+
+
+def tiled_layout(polygons, tiles):
+    """The layout repeated tiles x tiles times, shrunk to fit the same camera frame."""
+    out = []
+    for ty in range(tiles):
+        for tx in range(tiles):
+            out.extend([np.column_stack([(p[:, 0] + tx * FRAME_W) / tiles, (p[:, 1] + ty * FRAME_H) / tiles])
+                        for p in polygons])
+    return out
+
+
+def detections_for(stalls, cars, rng):
+    chosen = rng.random(len(stalls)) < 0.6
+    dets = []
+    for stall, c in zip(stalls, chosen):
+        if c:
+            car = cars[rng.integers(len(cars))]
+            size = np.ptp(stall, axis=0)
+            # the region is the stall's central square; the car fills the stall around it
+            placed = (car - car.mean(axis=0)) * (CAR_OVER_REGION * size / np.ptp(car, axis=0))
+            dets.append(placed + stall.mean(axis=0) + rng.normal(0, 0.1, 2) * size)   # ~10% of the stall size
+    lo = np.array([p.min(axis=0) for p in stalls])
+    hi = np.array([p.max(axis=0) for p in stalls])
+    for _ in range(5):
+        for _ in range(100):    # somewhere in a lane: the box touches no stall box
+            car = cars[rng.integers(len(cars))]
+            car = car - car.min(axis=0) + rng.random(2) * (FRAME_W - 300, FRAME_H - 300)
+            a, b = car.min(axis=0), car.max(axis=0)
+            if not np.any(np.all((a <= hi) & (b >= lo), axis=1)):
+                dets.append(car)
+                break
+    return dets, chosen
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    with open(CARS_PATH) as f:
+        cars = [np.asarray(s["points"], dtype=np.float64) for s in json.load(f)["shapes"]]
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+        json.dump(BENCH_CALIBRATION, f)
+    try:
+        base = StallOccupancyEngine.from_map_points(MAP_PATH, f.name)
+    finally:
+        os.unlink(f.name)
+    regions = base.polygons
+
+    for tiles in (1, 2, 3):
+        stalls = tiled_layout(regions, tiles)
+        t0 = time.perf_counter()
+        engine = StallOccupancyEngine(stalls)
+        build_ms = (time.perf_counter() - t0) * 1000
+
+        frames = [detections_for(stalls, cars, rng) for _ in range(50)]
+        timings, agree = [], []
+        for dets, chosen in frames:
+            t0 = time.perf_counter()
+            occupied, _ = engine.occupancy(dets)
+            timings.append(time.perf_counter() - t0)
+            agree.append(np.mean(occupied == chosen))
+
+        timings = np.array(timings) * 1000
+        print(f"stalls={len(stalls):4d} detections/frame~{np.mean([len(d) for d, _ in frames]):5.0f} "
+              f"build={build_ms:7.1f} ms  per-frame p50={np.percentile(timings, 50):6.2f} "
+              f"p95={np.percentile(timings, 95):6.2f} ms  agreement={np.mean(agree):.3f}")
+
+    timings = []
+    for _ in range(50):
+        t0 = time.perf_counter()
+        occupied, _ = base.occupancy(cars)
+        timings.append(time.perf_counter() - t0)
+    print(f"gt_74 camera frame ({len(cars)} vehicle outlines, {occupied.sum()} stalls over threshold): "
+          f"per-frame p50={np.percentile(np.array(timings) * 1000, 50):6.2f} ms")
@@ -0,0 +1,52 @@
+"""Import time and resident memory of the app in each APP_MODE.
+
+Every mode is measured in fresh interpreters, so nothing is shared between runs.
+Run from gui/ with the database settings of the app:
+    python benchmarks/bench_startup.py --repeat 5
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+GUI_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child: import main (which builds the app for APP_MODE) and report.
+PROBE = """
+import sys, time, json
+t0 = time.perf_counter()
+import main
+elapsed = time.perf_counter() - t0
+status = dict(line.split(":", 1) for line in open("/proc/self/status") if ":" in line)
+print(json.dumps({
+    "import_ms": 1000 * elapsed,
+    "rss_mb": int(status["VmRSS"].split()[0]) / 1024,
+    "routes": len(main.app.openapi()["paths"]),
+    "cv2": "cv2" in sys.modules,
+    "redis": "redis" in sys.modules,
+}))
+"""
+
+
+def measure(mode):
+    env = {**os.environ, "APP_MODE": mode}
+    out = subprocess.run([sys.executable, "-c", PROBE], cwd=GUI_DIR, env=env,
+                         capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--modes", nargs="+", default=["analytics", "stream", "full"])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for mode in args.modes:
+        runs = [measure(mode) for _ in range(args.repeat)]
+        imports = [r["import_ms"] for r in runs]
+        rss = [r["rss_mb"] for r in runs]
+        print(f"mode={mode:9s} import median={statistics.median(imports):6.0f} ms "
+              f"min={min(imports):6.0f} ms  rss={statistics.median(rss):5.0f} MB  "
+              f"routes={runs[0]['routes']:3d}  cv2={runs[0]['cv2']!s:5s} redis={runs[0]['redis']}")
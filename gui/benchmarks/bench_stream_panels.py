@@ -0,0 +1,60 @@
+"""/frames encode work and bytes per frame: whole composite vs split panels.
+
+Before, every poll JPEG-encoded the raw frame and the whole result composite
+(camera pane + top-down map) and shipped both. Now a frame pair is encoded once
+for all viewers, the map panel only when its pixels change, and a viewer gets
+the map only when its copy is stale.
+
+Run from gui/ (needs OpenCV):
+    python benchmarks/bench_stream_panels.py --frames 200 --viewers 10
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "loadtest"))
+
+import Stream_Pipeline as sp
+from frame_producer import SyntheticCamera
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--viewers", type=int, default=10)
+    parser.add_argument("--width", type=int, default=1296)
+    parser.add_argument("--height", type=int, default=972)
+    args = parser.parse_args()
+
+    camera = SyntheticCamera(args.width, args.height)
+    pairs = [camera.next() for _ in range(args.frames)]
+    sp.img_to_b64(pairs[0][0])                     # load OpenCV outside the timings
+
+    # before: each viewer's poll encodes raw + composite
+    t0 = time.perf_counter()
+    old_bytes = 0
+    for raw, res in pairs:
+        b1, b2 = sp.img_to_b64(raw), sp.img_to_b64(res)
+        old_bytes += len(b1) + len(b2)
+    old_ms = (time.perf_counter() - t0) * 1000 / args.frames
+
+    # after: one encode per pair, map re-encoded on change, sent when stale
+    t0 = time.perf_counter()
+    new_bytes = map_sends = 0
+    viewer_map = -1                                # every viewer polls every frame, so they agree
+    for seq, (raw, res) in enumerate(pairs):
+        frame = sp.encode_pair(seq, raw, res)
+        new_bytes += len(frame.raw) + len(frame.cam)
+        if sp.map_panel.version != viewer_map:
+            new_bytes += len(sp.map_panel.jpeg)
+            viewer_map = sp.map_panel.version
+            map_sends += 1
+    new_ms = (time.perf_counter() - t0) * 1000 / args.frames
+
+    h, w = pairs[0][1].shape[:2]
+    print(f"composite {w}x{h}, {args.frames} frames, map changed {sp.map_panel.version} times")
+    print(f"encode per frame:  before {old_ms * args.viewers:7.1f} ms ({args.viewers} viewers x {old_ms:.1f})  "
+          f"after {new_ms:7.1f} ms (shared)")
+    print(f"bytes per frame per viewer:  before {old_bytes / args.frames / 1024:7.1f} KiB  "
+          f"after {new_bytes / args.frames / 1024:7.1f} KiB  (map sent {map_sends} times)")
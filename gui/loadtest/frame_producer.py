@@ -0,0 +1,132 @@
+"""Synthetic camera frames for the stream pipeline.
+
+Pushes raw frames onto the Redis list Stream_Pipeline.list_consumer() pops and,
+after a simulated inference delay, the matching result frames into the sorted set
+Stream_Pipeline.zset_matcher() looks them up in, both in the layout
+deserialize_frame() reads. Result frames are composites like the detector's: the
+annotated camera frame with a top-down map panel to its right, whose stall dots
+change colour now and then. Stands in for the camera and detector containers
+during load tests.
+
+Run from gui/:
+    python loadtest/frame_producer.py --redis-url redis://localhost:6379/0 --fps 5
+"""
+import os
+import time
+import struct
+import argparse
+import numpy as np
+import redis
+
+CV_8UC3 = 16                      # OpenCV type code: 8-bit, 3 channels
+MAP_W, MAP_H = 468, 584           # top-down map panel at native size
+MAP_STALLS = 74
+
+
+def serialize_frame(fid, img):
+    """Inverse of main.deserialize_frame for 8-bit BGR images."""
+    sid = f"{fid:.6f}".encode()
+    rows, cols = img.shape[:2]
+    return (struct.pack("<i", len(sid)) + sid
+            + struct.pack("<iii", CV_8UC3, rows, cols)
+            + np.ascontiguousarray(img, dtype=np.uint8).tobytes())
+
+
+class SyntheticCamera:
+    """A static lot-like background with a few boxes drifting across it."""
+
+    def __init__(self, width, height, n_cars=12, seed=0, map_change_prob=0.05):
+        rng = self.rng = np.random.default_rng(seed)
+        self.width, self.height = width, height
+        y, x = np.mgrid[0:height, 0:width]
+        self.background = np.stack([(x * 80 // width + 60), (y * 60 // height + 70),
+                                    np.full_like(x, 90)], axis=-1).astype(np.uint8)
+        # noise makes the JPEG encode cost close to a real camera picture
+        self.background += rng.integers(0, 24, self.background.shape, dtype=np.uint8)
+        self.cars = rng.uniform([0, 0], [width, height], (n_cars, 2))
+        self.speed = rng.uniform(-4, 4, (n_cars, 2))
+        self.colors = rng.integers(0, 255, (n_cars, 3), dtype=np.uint8)
+        self.car_w, self.car_h = max(8, width // 24), max(8, height // 18)
+        # map panel scaled to the frame height, one dot per stall
+        self.map_w = int(round(height * MAP_W / MAP_H))
+        self.map_background = np.full((height, self.map_w, 3), 200, dtype=np.uint8)
+        cols = 8
+        self.dots = [(int((i % cols + 0.5) * self.map_w / cols),
+                      int((i // cols + 0.5) * height / (MAP_STALLS // cols + 1))) for i in range(MAP_STALLS)]
+        self.occupied = rng.random(MAP_STALLS) < 0.5
+        self.map_change_prob = map_change_prob
+        self.map = self._draw_map()
+
+    def _draw_map(self):
+        panel = self.map_background.copy()
+        r = max(3, self.height // 80)
+        for (x, y), occ in zip(self.dots, self.occupied):
+            panel[max(0, y - r):y + r, max(0, x - r):x + r] = (0, 0, 255) if occ else (0, 200, 0)
+        return panel
+
+    def next(self):
+        self.cars = (self.cars + self.speed) % [self.width, self.height]
+        raw = self.background.copy()
+        boxes = []
+        for (cx, cy), color in zip(self.cars.astype(int), self.colors):
+            x0, y0 = cx, cy
+            x1, y1 = min(cx + self.car_w, self.width), min(cy + self.car_h, self.height)
+            raw[y0:y1, x0:x1] = color
+            boxes.append((x0, y0, x1, y1))
+        res = raw.copy()
+        for x0, y0, x1, y1 in boxes:           # detector output: green outlines
+            res[y0:min(y0 + 2, y1), x0:x1] = (0, 255, 0)
+            res[max(y1 - 2, y0):y1, x0:x1] = (0, 255, 0)
+            res[y0:y1, x0:min(x0 + 2, x1)] = (0, 255, 0)
+            res[y0:y1, max(x1 - 2, x0):x1] = (0, 255, 0)
+        if self.rng.random() < self.map_change_prob:       # a stall changed colour
+            self.occupied[self.rng.integers(MAP_STALLS)] ^= True
+            self.map = self._draw_map()
+        return raw, np.concatenate([res, self.map], axis=1)
+
+
+def run(redis_url, list_key, zset_key, fps, width, height, inference_ms, max_backlog):
+    r = redis.Redis.from_url(redis_url)
+    camera = SyntheticCamera(width, height)
+    period = 1.0 / fps
+    delayed = []                                # (due, fid, result bytes)
+    sent = 0
+    started = next_tick = time.monotonic()
+    print(f"Producing {width}x{height} frames at {fps} fps into {list_key} / {zset_key}")
+    while True:
+        fid = time.time()
+        raw, res = camera.next()
+        pipe = r.pipeline(transaction=False)
+        pipe.rpush(list_key, serialize_frame(fid, raw))
+        pipe.ltrim(list_key, -max_backlog, -1)  # nobody consuming: do not grow without bound
+        pipe.zremrangebyscore(zset_key, "-inf", fid - 60)
+        pipe.execute()
+        delayed.append((time.monotonic() + inference_ms / 1000, fid, serialize_frame(fid, res)))
+
+        now = time.monotonic()
+        while delayed and delayed[0][0] <= now:
+            _, rid, payload = delayed.pop(0)
+            r.zadd(zset_key, {payload: rid})
+
+        sent += 1
+        if sent % (fps * 30) == 0:
+            print(f"{sent} frames, {sent / (now - started):.1f} fps")
+        next_tick += period
+        time.sleep(max(0.0, next_tick - time.monotonic()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Feed synthetic frames into the stream's Redis keys.")
+    parser.add_argument("--redis-url", default=os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+    parser.add_argument("--pid", default="12345678", help="matches PID in Stream_Pipeline.py")
+    parser.add_argument("--video", default="Video1")
+    parser.add_argument("--fps", type=int, default=5)
+    # the camera's 4:3 aspect, as Stream_Pipeline.split_result() expects
+    parser.add_argument("--width", type=int, default=1296)
+    parser.add_argument("--height", type=int, default=972)
+    parser.add_argument("--inference-ms", type=float, default=80, help="delay before a result frame appears")
+    parser.add_argument("--max-backlog", type=int, default=50, help="raw frames kept when nobody consumes")
+    args = parser.parse_args()
+
+    run(args.redis_url, f"raw_buffer_{args.pid}_{args.video}", f"res_buffer_{args.pid}_{args.video}",
+        args.fps, args.width, args.height, args.inference_ms, args.max_backlog)
@@ -0,0 +1,53 @@
+"""Get a local Postgres ready for a load test: migrate, seed and add the login users
+(<username> for the viewers, <username>_1 .. _N for the login bursts).
+
+Seeding is skipped for lots that already have stalls, so the compose stack can
+run this on every start. Run from gui/:
+    python loadtest/prepare_db.py --lots 1 2 --days 90
+"""
+import os
+import sys
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from User_Authentication import load_env, create_user, get_password_hash
+from ParkingLot_Database_Utils import get_connection_pool, close_connection_pool
+from ParkingLot_Schema_Migrations import apply_migrations, get_schema_version
+from ParkingLot_Synthetic_Data import seed_synthetic_data
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate and seed a load-test database.")
+    parser.add_argument("--lots", type=int, nargs="+", default=[1, 2])
+    parser.add_argument("--stalls", type=int, default=74)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--username", default=os.getenv("LOADTEST_USER", "loadtest"))
+    parser.add_argument("--password", default=os.getenv("LOADTEST_PASSWORD", "loadtest-password"))
+    parser.add_argument("--login-users", type=int, default=int(os.getenv("LOADTEST_LOGIN_USERS", "20")))
+    args = parser.parse_args()
+
+    load_env("./.env")
+    pool = get_connection_pool()
+    if pool is None:
+        print("Error: Database connection pool not initialized.")
+        sys.exit(1)
+
+    with pool.connection() as conn:
+        # index builds, backfills and bulk loads outlast the pool's statement_timeout
+        conn.execute("SET statement_timeout = 0")
+        conn.commit()
+        apply_migrations(conn)
+        print(f"Schema version: {get_schema_version(conn)}")
+        seeded = {lot_id for (lot_id,) in conn.execute(
+            "SELECT DISTINCT lot_id FROM public.stalls WHERE lot_id = ANY(%s)", (args.lots,))}
+        conn.commit()
+        missing = [lot_id for lot_id in args.lots if lot_id not in seeded]
+        if missing:
+            print(seed_synthetic_data(conn, missing, args.stalls, args.days))
+        else:
+            print(f"Lots {args.lots} already seeded")
+
+    for username in [args.username] + [f"{args.username}_{i}" for i in range(1, args.login_users + 1)]:
+        if get_password_hash(username) is None:
+            create_user(username, f"{username}@example.com", args.password)
+    close_connection_pool()
@@ -0,0 +1,368 @@
+"""Async HTTP load generator with the dashboard's traffic mix.
+
+Virtual users, each with its own cookie jar:
+  viewers     stream.html: the page, /frames every 200 ms and the stall SSE feed
+  dashboard   lot and stall dashboards plus the chart APIs, with think time
+  exporters   a CSV or ZIP export every --export-interval seconds
+  logins      a burst of --login-burst concurrent logins every --burst-interval,
+              spread over --login-users users (<username>_1 .. _N, see prepare_db.py)
+
+Reports throughput, latency percentiles and error rate per route, then the
+server's own /api/db/pool_stats and /api/db/query_stats for the same run.
+
+Run from gui/ against a running app (see loadtest/docker-compose.yml):
+    python loadtest/run_loadtest.py --base-url http://localhost:5000 \\
+        --viewers 20 --dashboard-users 30 --exporters 2 --login-burst 10 --duration 120
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+from collections import Counter
+from datetime import date, timedelta
+import numpy as np
+import httpx
+
+FRAME_POLL_SEC = 0.2              # stream.html POLL_MS
+STALL_HISTORY_DAYS = ("7", "30", "365", "all")
+EXPORT_POLL_SEC = 1.0
+
+
+class RouteStats:
+    def __init__(self):
+        self.latencies = []
+        self.outcomes = Counter()
+        self.errors = 0
+        self.bytes = 0
+
+
+class Recorder:
+    """Per-route results, keyed by route template rather than URL."""
+
+    def __init__(self):
+        self.routes = {}
+        self.started = time.monotonic()
+
+    def add(self, route, elapsed, outcome, nbytes=0, error=False):
+        stats = self.routes.setdefault(route, RouteStats())
+        stats.latencies.append(elapsed)
+        stats.outcomes[outcome] += 1
+        stats.bytes += nbytes
+        stats.errors += error
+
+    def report(self):
+        duration = time.monotonic() - self.started
+        out = {}
+        for route, s in sorted(self.routes.items()):
+            lat = np.asarray(s.latencies) * 1000
+            p50, p95, p99 = np.percentile(lat, [50, 95, 99]) if len(lat) else (0, 0, 0)
+            out[route] = {
+                "requests": len(lat),
+                "rps": round(len(lat) / duration, 2),
+                "p50_ms": round(float(p50), 1),
+                "p95_ms": round(float(p95), 1),
+                "p99_ms": round(float(p99), 1),
+                "max_ms": round(float(lat.max()), 1) if len(lat) else 0,
+                "error_rate": round(s.errors / len(lat), 4) if len(lat) else 0,
+                "mb": round(s.bytes / 1e6, 2),
+                "outcomes": dict(s.outcomes),
+            }
+        return duration, out
+
+
+async def call(client, rec, route, method, url, ok=(200,), **kwargs):
+    """One request, recorded under `route`. Returns the response, or None on a
+    transport error. The body is read in full so transfer time counts."""
+    t0 = time.perf_counter()
+    try:
+        resp = await client.request(method, url, **kwargs)
+    except httpx.HTTPError as e:
+        rec.add(route, time.perf_counter() - t0, type(e).__name__, error=True)
+        return None
+    rec.add(route, time.perf_counter() - t0, str(resp.status_code), len(resp.content),
+            error=resp.status_code not in ok)
+    return resp
+
+
+def new_client(args, cookies=None):
+    return httpx.AsyncClient(base_url=args.base_url, cookies=cookies, timeout=args.timeout,
+                             limits=httpx.Limits(max_connections=6), follow_redirects=False)
+
+
+def login_outcome(resp):
+    """POST /login always redirects: back to /login with an error, or on to the app's
+    home page (/stream, or a lot dashboard in analytics mode)."""
+    location = resp.headers.get("location", "")
+    if not location.startswith("/login"):
+        return "ok"
+    if "Too+many" in location:
+        return "rate_limited"
+    if "busy" in location:
+        return "busy"
+    return "rejected"
+
+
+async def login(client, rec, username, password):
+    t0 = time.perf_counter()
+    try:
+        resp = await client.post("/login", data={"username": username, "password": password})
+    except httpx.HTTPError as e:
+        rec.add("POST /login", time.perf_counter() - t0, type(e).__name__, error=True)
+        return False
+    outcome = login_outcome(resp) if resp.status_code == 303 else str(resp.status_code)
+    # a wrong password is the expected answer, not an error
+    rec.add("POST /login", time.perf_counter() - t0, outcome,
+            error=outcome not in ("ok", "rejected"))
+    return outcome == "ok"
+
+
+# ----- scenarios ------------------------------------------------------------
+async def stream_viewer(args, rec, cookies, stop):
+    async with new_client(args, cookies) as client:
+        await call(client, rec, "GET /stream", "GET", "/stream")
+        sse = asyncio.create_task(stall_event_feed(args, client, rec, stop))
+        while not stop.is_set():
+            t0 = time.monotonic()
+            # 204 = no matched frame pair yet, which the page treats as "try again"
+            await call(client, rec, "GET /frames", "GET", "/frames", ok=(200, 204),
+                       headers={"Cache-Control": "no-store"})
+            await asyncio.sleep(max(0.0, FRAME_POLL_SEC - (time.monotonic() - t0)))
+        sse.cancel()
+        await asyncio.gather(sse, return_exceptions=True)
+
+
+async def stall_event_feed(args, client, rec, stop):
+    """Holds the SSE connection open like EventSource; records time to the snapshot."""
+    route = "GET /api/stall_events"
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        try:
+            async with client.stream("GET", "/api/stall_events", params={"lot_id": args.stream_lot},
+                                     timeout=httpx.Timeout(args.timeout, read=None)) as resp:
+                first = True
+                async for _ in resp.aiter_lines():
+                    if first:
+                        rec.add(route, time.perf_counter() - t0, str(resp.status_code),
+                                error=resp.status_code != 200)
+                        first = False
+                    if stop.is_set():
+                        return
+        except httpx.HTTPError as e:
+            rec.add(route, time.perf_counter() - t0, type(e).__name__, error=True)
+        await asyncio.sleep(3)                  # EventSource's default retry
+
+
+async def dashboard_user(args, rec, stop, rng):
+    async with new_client(args) as client:
+        stalls = {}
+        while not stop.is_set():
+            lot_id = rng.choice(args.lots)
+            await call(client, rec, "GET /dashboard/lot/{lot_id}", "GET", f"/dashboard/lot/{lot_id}")
+            await call(client, rec, "GET /api/availability/today", "GET", "/api/availability/today",
+                       params={"lot_id": lot_id})
+            await think(args, rng, stop)
+            if stop.is_set():
+                break
+            await call(client, rec, "GET /api/stall_durations", "GET", "/api/stall_durations",
+                       params={"lot_id": lot_id})
+            await call(client, rec, "GET /api/occupancy_heatmap", "GET", "/api/occupancy_heatmap",
+                       params={"lot_id": lot_id})
+            start = (date.today() - timedelta(days=rng.choice((1, 7, 30, 90)))).isoformat()
+            await call(client, rec, "GET /api/availability/history", "GET", "/api/availability/history",
+                       params={"lot_id": lot_id, "start": start})
+            await think(args, rng, stop)
+            if stop.is_set():
+                break
+
+            if lot_id not in stalls:
+                resp = await call(client, rec, "GET /api/get-stall-numbers", "GET",
+                                  "/api/get-stall-numbers", params={"lot_id": lot_id})
+                if resp is not None and resp.status_code == 200:
+                    stalls[lot_id] = [s["id"] for s in resp.json()]
+            if stalls.get(lot_id):
+                stall_id = rng.choice(stalls[lot_id])
+                await call(client, rec, "GET /dashboard/stall/{stall_id}", "GET",
+                           f"/dashboard/stall/{stall_id}")
+                await call(client, rec, "GET /api/stall-history", "GET", "/api/stall-history",
+                           params={"stall_id": stall_id, "days": rng.choice(STALL_HISTORY_DAYS)})
+                await call(client, rec, "GET /api/stall_timeline", "GET", "/api/stall_timeline",
+                           params={"lot_id": lot_id, "stall_number": rng.randrange(len(stalls[lot_id]))})
+            await think(args, rng, stop)
+
+
+async def think(args, rng, stop):
+    await think_for(rng.uniform(args.think_min, args.think_max), stop)
+
+
+async def exporter(args, rec, stop, rng):
+    async with new_client(args) as client:
+        # spread the exporters out instead of firing together
+        await think_for(rng.uniform(0, args.export_interval), stop)
+        while not stop.is_set():
+            lot_id = rng.choice(args.lots)
+            kind = rng.choice(("durations_csv", "availability_csv", "sessions_csv", "zip_job"))
+            if kind == "durations_csv":
+                await call(client, rec, "GET /api/stall_durations_csv", "GET", "/api/stall_durations_csv",
+                           params={"lot_id": lot_id})
+            elif kind == "availability_csv":
+                await call(client, rec, "GET /api/availability_today_csv", "GET",
+                           "/api/availability_today_csv", params={"lot_id": lot_id})
+            elif kind == "sessions_csv":
+                start = (date.today() - timedelta(days=rng.choice((7, 30, 90)))).isoformat()
+                # 503 = every export slot busy, the server's intended answer under load
+                await call(client, rec, "GET /api/sessions_csv", "GET", "/api/sessions_csv",
+                           ok=(200, 503), params={"lot_id": lot_id, "start": start})
+            else:
+                await export_job(client, rec, lot_id, rng.choice(STALL_HISTORY_DAYS), stop)
+            await think_for(args.export_interval, stop)
+
+
+async def export_job(client, rec, lot_id, days, stop):
+    """The dashboard's bulk ZIP flow; the whole job is also timed end to end."""
+    t0 = time.perf_counter()
+    resp = await call(client, rec, "POST /api/exports", "POST", "/api/exports", ok=(200, 202, 503),
+                      params={"kind": "stall_histories", "lot_id": lot_id, "days": days})
+    if resp is None or resp.status_code not in (200, 202):
+        return
+    job = resp.json()
+    while job["status"] in ("queued", "running") and not stop.is_set():
+        await asyncio.sleep(EXPORT_POLL_SEC)
+        resp = await call(client, rec, "GET /api/exports/{job_id}", "GET", f"/api/exports/{job['id']}")
+        if resp is None or resp.status_code != 200:
+            return
+        job = resp.json()
+    if job["status"] == "done":
+        await call(client, rec, "GET /api/exports/{job_id}/download", "GET", job["download_url"])
+        rec.add("export job (end to end)", time.perf_counter() - t0, "cached" if job["cached"] else "built")
+    elif job["status"] in ("queued", "running"):
+        await client.delete(f"/api/exports/{job['id']}")
+    else:
+        rec.add("export job (end to end)", time.perf_counter() - t0, job["status"], error=True)
+
+
+async def login_bursts(args, rec, stop, rng):
+    while not stop.is_set():
+        await think_for(args.burst_interval, stop)
+        if stop.is_set():
+            break
+
+        async def one():
+            username = f"{args.username}_{rng.randint(1, args.login_users)}"
+            password = args.password if rng.random() >= args.bad_password_ratio else "wrong-password"
+            async with new_client(args) as client:
+                await login(client, rec, username, password)
+
+        await asyncio.gather(*(one() for _ in range(args.login_burst)))
+
+
+async def think_for(seconds, stop):
+    try:
+        await asyncio.wait_for(stop.wait(), seconds)
+    except asyncio.TimeoutError:
+        pass
+
+
+# ----- driver ---------------------------------------------------------------
+async def server_stats(args):
+    async with new_client(args) as client:
+        out = {}
+        for name in ("pool_stats", "query_stats"):
+            try:
+                resp = await client.get(f"/api/db/{name}")
+                out[name] = resp.json() if resp.status_code == 200 else None
+            except httpx.HTTPError:
+                out[name] = None
+        return out
+
+
+async def run(args):
+    rec = Recorder()
+    stop = asyncio.Event()
+    rng = random.Random(args.seed)
+    tasks = []
+
+    cookies = None
+    if args.viewers:
+        # viewers share one login, as tabs of the same browser would
+        async with new_client(args) as client:
+            if not await login(client, rec, args.username, args.password):
+                sys.exit(f"Could not log in as {args.username}; create the user first (see loadtest/prepare_db.py)")
+            cookies = client.cookies
+
+    users = ([lambda: stream_viewer(args, rec, cookies, stop)] * args.viewers
+             + [lambda: dashboard_user(args, rec, stop, random.Random(rng.random()))] * args.dashboard_users
+             + [lambda: exporter(args, rec, stop, random.Random(rng.random()))] * args.exporters)
+    rng.shuffle(users)
+    if args.login_burst:
+        tasks.append(asyncio.create_task(login_bursts(args, rec, stop, random.Random(rng.random()))))
+    # ramp up: users start evenly over --ramp-up seconds
+    step = args.ramp_up / max(1, len(users))
+    for user in users:
+        tasks.append(asyncio.create_task(user()))
+        await asyncio.sleep(step)
+
+    await asyncio.sleep(max(0.0, args.duration - args.ramp_up))
+    stop.set()
+    await asyncio.wait(tasks, timeout=args.timeout + 5)
+    for t in tasks:
+        t.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return rec, await server_stats(args)
+
+
+def print_report(duration, routes, server):
+    print(f"\n{'route':42s} {'reqs':>7s} {'rps':>7s} {'p50':>8s} {'p95':>8s} {'p99':>8s} "
+          f"{'max':>8s} {'err%':>6s}  outcomes")
+    for route, s in routes.items():
+        outcomes = " ".join(f"{k}:{v}" for k, v in sorted(s["outcomes"].items()))
+        print(f"{route:42s} {s['requests']:7d} {s['rps']:7.2f} {s['p50_ms']:8.1f} {s['p95_ms']:8.1f} "
+              f"{s['p99_ms']:8.1f} {s['max_ms']:8.1f} {100 * s['error_rate']:6.2f}  {outcomes}")
+    total = sum(s["requests"] for s in routes.values())
+    print(f"\n{total} requests in {duration:.0f}s ({total / duration:.1f} req/s), latencies in ms")
+
+    pool = (server.get("pool_stats") or {}).get("pool")
+    if pool:
+        print(f"pool: size={pool['size']}/{pool['max_size']} peak_in_use={pool['peak_in_use']} "
+              f"saturated_checkouts={pool['saturated_checkouts']} failed_checkouts={pool['failed_checkouts']}")
+    queries = server.get("query_stats") or {}
+    for name, q in list(queries.items())[:8]:
+        print(f"query {name:28s} n={q['count']:6d} p50={q.get('p50_ms', 0):7.2f} "
+              f"p99={q.get('p99_ms', 0):7.2f} total={q['total_ms'] / 1000:7.2f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Drive the app with the dashboard's traffic mix.")
+    parser.add_argument("--base-url", default=os.getenv("LOADTEST_BASE_URL", "http://localhost:5000"))
+    parser.add_argument("--duration", type=float, default=60)
+    parser.add_argument("--ramp-up", type=float, default=10)
+    parser.add_argument("--viewers", type=int, default=10)
+    parser.add_argument("--dashboard-users", type=int, default=20)
+    parser.add_argument("--exporters", type=int, default=1)
+    parser.add_argument("--export-interval", type=float, default=30)
+    parser.add_argument("--login-burst", type=int, default=10, help="0 disables login bursts")
+    parser.add_argument("--burst-interval", type=float, default=20)
+    parser.add_argument("--login-users", type=int, default=int(os.getenv("LOADTEST_LOGIN_USERS", "20")),
+                        help="burst logins pick among this many users (created by prepare_db.py)")
+    parser.add_argument("--bad-password-ratio", type=float, default=0.2)
+    parser.add_argument("--lots", type=int, nargs="+", default=[1])
+    parser.add_argument("--stream-lot", type=int, default=1, help="STREAM_LOT_ID of the app")
+    parser.add_argument("--think-min", type=float, default=1)
+    parser.add_argument("--think-max", type=float, default=5)
+    parser.add_argument("--username", default=os.getenv("LOADTEST_USER", "loadtest"))
+    parser.add_argument("--password", default=os.getenv("LOADTEST_PASSWORD", "loadtest-password"))
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the report here")
+    args = parser.parse_args()
+    args.ramp_up = min(args.ramp_up, args.duration)
+
+    rec, server = asyncio.run(run(args))
+    duration, routes = rec.report()
+    print_report(duration, routes, server)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "duration_sec": duration, "routes": routes, "server": server},
+                      f, indent=2)
@@ -1,41 +1,50 @@
-from fastapi import FastAPI, Form, Request, HTTPException
+from fastapi import FastAPI, APIRouter, Depends, Form, Query, Request, HTTPException
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, RedirectResponse, Response, JSONResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, Response, JSONResponse, FileResponse, PlainTextResponse
 from fastapi.templating import Jinja2Templates
-import os, redis, random, time, re, threading, cv2, numpy as np, struct, asyncio, base64
+import os, time, numpy as np, asyncio, hashlib, base64
 from starlette.middleware.sessions import SessionMiddleware
-from User_Authentication import load_env, authenticate_user_sql
+from User_Authentication import (load_env, authenticate_user_async, LoginBusyError,
+                                 ip_rate_limiter, user_rate_limiter, client_ip)
 from typing import Optional, Union
 from urllib.parse import quote_plus
-from ParkingLot_Database_Utils import pool, get_connection_pool
+from ParkingLot_Database_Utils import pool, get_connection_pool, get_vacant_stalls, rebuild_live_stall_state
+from ParkingLot_Queries import SESSIONS_EXPORT_COPY_SQL
+from Query_Registry import run_query, query_registry
 from datetime import datetime, date, timedelta, timezone
-import zoneinfo
-import httpx
 import csv, io
 from fastapi.responses import StreamingResponse
-from zipfile import ZipFile, ZIP_DEFLATED
-
-# ----- Configuration ----------------------------
-PID         = 12345678                                  # demo PID for stream
-LIST_KEY    = f"raw_buffer_{PID}_Video1"
-ZSET_KEY    = f"res_buffer_{PID}_Video1"
-POLL_MS     = 200                                        # ms
-MAX_WAIT_SEC= 30
-# -----------------------------------------------
+from Stall_Event_Stream import stall_events
+from Live_Stall_State import live_stalls
+from Series_Downsampling import DOWNSAMPLERS
+from Availability_Bitset import decode_many, free_intervals
+from Occupancy_Heatmap import hour_of_week_occupancy
+from Availability_Forecast import ForecastModels, FORECAST_MAX_HOURS
+from Session_Export import copy_csv_chunks, exports_busy
+from Export_Jobs import export_jobs, ExportBusyError, EXPORT_KINDS
+from Response_Cache import VersionedCache
+from Today_Snapshot import TodaySnapshotStore, SNAPSHOT_INTERVAL_SEC, compute_portfolio
+from Instrumented_Pool import current_endpoint
+from Request_Profiler import request_profiler, RequestProfilerMiddleware, ProfilingThreadPoolExecutor
+from Partition_Manager import partition_manager
+from Lot_Calendar import lot_timezones, calendar_for
 
 load_env("./.env")
 
-app = FastAPI()
-app.mount("/static", StaticFiles(directory="static"), name="static")
+APP_MODES = ("analytics", "stream", "full")           # see create_app()
+DEFAULT_LOT_ID = int(os.getenv("DEFAULT_LOT_ID", "1"))   # landing dashboard when the stream is not served
+
+# Routes every mode serves: login, the stall event feed and DB stats.
+common_router = APIRouter()
+# Dashboards, chart APIs and exports.
+analytics_router = APIRouter()
 
-app.add_middleware(SessionMiddleware, secret_key=os.getenv("SESSION_SECRET_KEY", "super-secret"))
 
-redis_url = os.getenv("REDIS_URL", "redis://redis-stack:6379/0")
-r_txt = redis.Redis.from_url(redis_url)
-r_bin = redis.Redis.from_url(redis_url, decode_responses=False)
+async def label_endpoint(request: Request):
+    """Tags the request's DB checkouts with its route, for pool.instrumentation()."""
+    route = request.scope.get("route")
+    current_endpoint.set(f"{request.method} {route.path}" if route is not None else "-")
 
-latest_pair: tuple[np.ndarray, np.ndarray] | None = None
-pending: dict[float, tuple[np.ndarray, float]] = {}
 
 templates = Jinja2Templates(directory = "templates")
 
@@ -59,7 +68,7 @@ def export_suffix(days: str) -> str:
         return days.replace("-", "_")
 
 
-@app.get("/login", response_class=HTMLResponse)
+@common_router.get("/login", response_class=HTMLResponse)
 def login_get(request: Request, error: Optional[str] = None):
     modified_html = LOGIN_HTML
     
@@ -71,59 +80,59 @@ def login_get(request: Request, error: Optional[str] = None):
         )
     return modified_html
 
-@app.post("/login")
-def login_post(request: Request, username: str = Form(...), password: str = Form(...)):
-    if authenticate_user_sql(username, password):
+@common_router.post("/login")
+async def login_post(request: Request, username: str = Form(...), password: str = Form(...)):
+    ip = client_ip(request.client.host if request.client else "unknown", request.headers.get("x-forwarded-for"))
+    retry_after = max(ip_rate_limiter.retry_after(ip), user_rate_limiter.retry_after(username))
+    if retry_after:
+        error_message = f"Too many login attempts. Try again in {retry_after} seconds."
+        return RedirectResponse(url=f"/login?error={quote_plus(error_message)}", status_code=303)
+    ip_rate_limiter.hit(ip)
+
+    try:
+        is_valid = await authenticate_user_async(username, password)
+    except LoginBusyError:
+        error_message = "The server is busy. Please try again."
+        return RedirectResponse(url=f"/login?error={quote_plus(error_message)}", status_code=303)
+
+    if is_valid:
+        user_rate_limiter.reset(username)
         request.session["authenticated"] = True
-        return RedirectResponse(url="/stream", status_code=303)
+        return RedirectResponse(url=request.app.state.home_url, status_code=303)
     else:
+        user_rate_limiter.hit(username)
         # Pass error message via query parameter
         error_message = "Invalid username or password."
         return RedirectResponse(url=f"/login?error={quote_plus(error_message)}", status_code=303)
 
-@app.get("/logout")
+@common_router.get("/logout")
 def logout(request: Request):
     request.session.pop("authenticated", None)
     return RedirectResponse(url="/login", status_code=303)
 
-# @app.get('/stream', response_class=HTMLResponse)
-# def stream(request: Request):
-#     if not request.session.get("authenticated"):
-#         return RedirectResponse(url="/login", status_code=303)
-#     return HTMLResponse(STREAM_HTML)
+@common_router.get("/api/stall_events")
+async def get_stall_events(request: Request, lot_id: int):
+    """Server-sent events: a snapshot of every stall's status, then one event per change.
 
-@app.get('/stream', response_class=HTMLResponse)
-def stream(request: Request):
-    if not request.session.get("authenticated"):
-        return RedirectResponse(url="/login", status_code=303)
-    # old: return HTMLResponse(STREAM_HTML)
-    return templates.TemplateResponse("stream.html", {"request": request})
-
-@app.get("/", response_class=HTMLResponse)
-def home(request: Request):
-    if not request.session.get("authenticated"):
-        return RedirectResponse(url="/login", status_code=303)
-    # old: return STREAM_HTML
-    return templates.TemplateResponse("stream.html", {"request": request})
-
-@app.get('/frames')
-async def frames(request: Request):
-    if not request.session.get("authenticated"):
-        return RedirectResponse(url="/login", status_code=303)
-    try:
-        if latest_pair is None:
-            return Response(status_code=204)
-        raw_img, res_img = latest_pair
-    except asyncio.TimeoutError:
-        return Response(status_code=204)
-    b1, b2 = img_to_b64(raw_img), img_to_b64(res_img)
-    if not b1 or not b2:
-        return Response(status_code=204)
-    return JSONResponse({'raw': b1, 'res': b2}, headers={'Cache-Control':'no-store'})
+    Reconnecting clients send Last-Event-ID and receive only the events they missed.
+    """
+    headers = {"Cache-Control": "no-store", "X-Accel-Buffering": "no"}
+    return StreamingResponse(stall_events.stream(lot_id, request.headers.get("last-event-id")),
+                             media_type="text/event-stream", headers=headers)
+
+@common_router.get("/api/stalls/vacant")
+def get_vacant(lot_id: list[int] = Query(...)):
+    """Vacant stall numbers and counts right now for one or more lots (?lot_id=1&lot_id=2),
+    from the live state in Redis; "source" says whether Postgres had to be asked."""
+    lots, source = get_vacant_stalls(lot_id)
+    unknown = [l for l in lot_id if l not in lots]
+    if len(unknown) == len(lot_id):
+        raise HTTPException(404, f"No stalls in lot(s) {unknown}")
+    return {"source": source, "lots": [{"lot_id": l, **lots[l]} for l in lot_id if l in lots]}
 
 api_cache = {}
 CACHE_DURATION_SECONDS = 3600
-@app.get('/api/get-stall-numbers')
+@analytics_router.get('/api/get-stall-numbers')
 # Use FastAPI's type hints for automatic validation
 async def get_all_stall_numbers(lot_id: int = 1):
     current_time = time.time()
@@ -137,17 +146,9 @@ async def get_all_stall_numbers(lot_id: int = 1):
             return cache_entry["stall_ids"]
 
     try:
-        conn = pool.getconn()
-        conn.autocommit = True
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT stall_id, stall_number from public.stalls 
-            WHERE lot_id = %s 
-            ORDER BY CAST(stall_number AS INTEGER);
-            """, (lot_id,))
-        rows = cur.fetchall()
-        
-        
+        with pool.connection() as conn:
+            rows = run_query(conn, "stall_numbers", (lot_id,)).fetchall()
+
         stalls = [{"id": row[0], "number": row[1]} for row in rows]
     
         api_cache[lot_id] = {
@@ -160,173 +161,295 @@ async def get_all_stall_numbers(lot_id: int = 1):
         print(f"SQL command execution error: {e}")
         # --- FIX 3: Raise a proper HTTP Exception on error ---
         raise HTTPException(status_code=500, detail="Database query failed")
-        
-    finally:
-        if cur:
-            cur.close()
-        if conn:
-            pool.putconn(conn)
-
-@app.get("/api/availability/today")
-async def get_availability_today(lot_id: int):
-    """API endpoint to get the number of available spots throughout today, in 30-min intervals."""
-    conn = None
-    cur = None
-    local_tz = zoneinfo.ZoneInfo("America/Edmonton")
-    local_now = datetime.now(local_tz)
-    start_of_day_local = local_now.replace(hour=0, minute=0, second=0, microsecond=0)
-    start_of_day_utc = start_of_day_local.astimezone(timezone.utc)
-    now_utc = datetime.now(timezone.utc)
-    end_of_day_utc = now_utc
-
-    sql = """
-    WITH bounds AS (
-        SELECT
-            %s::timestamptz AS start_utc,
-            %s::timestamptz AS now_utc
-    ),
-    end_bin AS (
-        SELECT
-            date_trunc('hour', now_utc)
-            + floor(extract(minute FROM now_utc)/30) * interval '30 minutes' AS end_bin_utc
-        FROM bounds
-    ),
-    grid AS (
-        SELECT gs AS ts_utc
-        FROM bounds, end_bin,
-            generate_series(
-                (SELECT start_utc   FROM bounds),
-                (SELECT end_bin_utc FROM end_bin),      -- inclusive current bin
-                interval '30 minutes'
-            ) gs
-    ),
-    snap AS (
-        SELECT
-            timestamp AT TIME ZONE 'UTC' AS ts_utc,
-            array_length(available_stalls, 1) AS avail
-        FROM public.availabilitysnapshots, bounds
-        WHERE lot_id = %s
-            AND timestamp >= (SELECT start_utc FROM bounds)
-            AND timestamp <  (SELECT now_utc   FROM bounds)  -- don't look into the future
-    ),
-    binned AS (
-        SELECT
-            date_trunc('hour', ts_utc)
-            + floor(extract(minute FROM ts_utc)/30) * interval '30 minutes' AS bin_utc,
-            avail,
-            ts_utc,
-            row_number() OVER (
-            PARTITION BY date_trunc('hour', ts_utc)
-                        + floor(extract(minute FROM ts_utc)/30) * interval '30 minutes'
-            ORDER BY ts_utc DESC
-            ) AS rn
-        FROM snap
-    )
-    SELECT g.ts_utc, b.avail
-    FROM grid g
-    LEFT JOIN binned b ON b.bin_utc = g.ts_utc AND b.rn = 1
-    ORDER BY g.ts_utc;
-    """
 
+today_snapshots = TodaySnapshotStore(data_version=stall_events.data_version, timezone_of=lot_timezones.get,
+                                     lot_exists=lot_timezones.lot_exists)
+
+
+def require_known_lot(lot_id: int):
+    """Dependency for endpoints served from today's snapshots: 404 for lots that do not exist."""
+    if not lot_timezones.lot_exists(lot_id):
+        raise HTTPException(404, f"Unknown lot {lot_id}")
+
+
+async def load_today_snapshot(lot_id: int, response: Optional[Response] = None):
+    """Today's precomputed aggregates for a lot; X-Snapshot-Age tells how old they are."""
+    snap = await today_snapshots.get(lot_id)
+    if response is not None:
+        response.headers["X-Snapshot-Age"] = f"{snap.age():.1f}"
+    return snap
+
+
+@analytics_router.get("/api/availability/today", dependencies=[Depends(require_known_lot)])
+async def get_availability_today(lot_id: int, response: Response):
+    """API endpoint to get the number of available spots throughout today, in 30-min intervals."""
     try:
-        conn = pool.getconn()
-        cur = conn.cursor()
-        cur.execute(sql, (start_of_day_utc, now_utc, lot_id))
-        rows = cur.fetchall()
-        chart_data = {
-            "labels": [ts.astimezone(local_tz).strftime("%I:%M %p") for ts, _ in rows],
-            # Replace None with 0 so empty bins show as 0 available spots
-            "data": [(avail if avail is not None else 0) for _, avail in rows]
-        }
-        return chart_data
+        return (await load_today_snapshot(lot_id, response)).availability
     except Exception as e:
         print(f"SQL command execution error: {e}")
         return JSONResponse({"error": "Database query failed"}, status_code=500)
-    finally:
-        if cur:
-            cur.close()
-        if conn:
-            pool.putconn(conn)
 
     
 
-@app.get("/api/stall_durations")
-async def get_stall_durations(lot_id: int):
-    """API endpoint to get total parking duration for all stalls in a specific lot."""
-    conn = None
-    cur = None
-    
-    #UTC time: today
-    # utc_now = datetime.now(timezone.utc)
-    # start_of_day = utc_now.replace(hour=0, minute=0, second=0, microsecond=0)
-    
-    #local time zone: today
-    local_tz = zoneinfo.ZoneInfo("America/Edmonton")
-    local_now = datetime.now(local_tz)
-    start_of_day_local = local_now.replace(hour=0, minute=0, second=0, microsecond=0)
-    start_of_day_utc = start_of_day_local.astimezone(timezone.utc)
-    end_of_day_utc = start_of_day_utc + timedelta(days=1)
-    
-    cap_utc = min(datetime.now(timezone.utc), end_of_day_utc)
+def parse_local_bound(value: str, local_tz, end: bool = False) -> datetime:
+    """'YYYY-MM-DD' (local midnight; an end date is inclusive) or an ISO-8601 datetime."""
+    try:
+        if len(value) == 10:
+            d = date.fromisoformat(value)
+            dt = datetime(d.year, d.month, d.day, tzinfo=local_tz)
+            return dt + timedelta(days=1) if end else dt
+        dt = datetime.fromisoformat(value)
+        return dt if dt.tzinfo else dt.replace(tzinfo=local_tz)
+    except ValueError:
+        raise HTTPException(400, f"Invalid date or datetime: {value}")
+
+
+def fetch_availability_series(lot_id: int, start_utc: datetime, end_utc: datetime):
+    """(epoch seconds, available count) arrays for snapshots in [start_utc, end_utc)."""
+    with pool.connection() as conn:
+        epochs, counts = run_query(conn, "availability_series",
+                                   (lot_id, start_utc.replace(tzinfo=None), end_utc.replace(tzinfo=None)),
+                                   binary=True).fetchone()
+    return np.asarray(epochs, dtype=np.float64), np.asarray(counts, dtype=np.float64)
+
+
+@analytics_router.get("/api/availability/history")
+async def get_availability_history(lot_id: int, start: Optional[str] = None, end: Optional[str] = None,
+                                   points: int = 300, method: str = "lttb"):
+    """
+    Available spots over an arbitrary range, downsampled on the server to at most
+    `points` points. method=lttb keeps the visual shape, method=minmax keeps every
+    bucket's peak and trough.
+    """
+    if method not in DOWNSAMPLERS:
+        raise HTTPException(400, f"method must be one of {sorted(DOWNSAMPLERS)}")
+    if not 10 <= points <= 5000:
+        raise HTTPException(400, "points must be between 10 and 5000")
 
-    # test_date = date(2025, 7, 30) # For example, yesterday
-    # start_of_day = datetime.combine(test_date, datetime.min.time())
-    
-    # end_of_day = start_of_day + timedelta(days=1)
-    
-    sql = """
-        SELECT 
-            s.stall_id,
-            s.stall_number,
-            COALESCE(
-                SUM(
-                    EXTRACT(
-                        EPOCH FROM (
-                            COALESCE(LEAST(ps.exit_timestamp, %s), %s) - ps.entry_timestamp
-                        )
-                    )
-                ) / 3600.0,
-            0) AS total_duration
-        FROM public.stalls s
-        LEFT JOIN public.parkingsessions ps 
-            ON s.stall_id = ps.stall_id
-            AND ps.entry_timestamp >= %s
-            AND ps.entry_timestamp < %s
-            -- no exit filter: we include ongoing sessions
-        WHERE s.lot_id = %s
-        GROUP BY s.stall_id, s.stall_number
-        ORDER BY CAST(s.stall_number AS INTEGER);
+    local_tz = lot_timezones.get(lot_id)
+    end_dt = parse_local_bound(end, local_tz, end=True) if end else datetime.now(local_tz)
+    start_dt = parse_local_bound(start, local_tz) if start else end_dt - timedelta(days=7)
+    if start_dt >= end_dt:
+        raise HTTPException(400, "start must be before end")
+
+    loop = asyncio.get_running_loop()
+    try:
+        epochs, counts = await loop.run_in_executor(
+            None, fetch_availability_series, lot_id,
+            start_dt.astimezone(timezone.utc), end_dt.astimezone(timezone.utc))
+    except Exception as e:
+        print(f"SQL command execution error: {e}")
+        raise HTTPException(status_code=500, detail="Could not retrieve data")
+
+    source_points = len(epochs)
+    keep = DOWNSAMPLERS[method](epochs, counts, points)
+    epochs, counts = epochs[keep], counts[keep]
+    return {
+        "labels": [datetime.fromtimestamp(t, local_tz).strftime("%b %d, %Y %I:%M %p") for t in epochs.tolist()],
+        "data": counts.astype(int).tolist(),
+        "t": (epochs * 1000).astype(np.int64).tolist(),
+        "method": method,
+        "source_points": source_points,
+    }
+
+
+forecast_models = ForecastModels(timezone_of=lot_timezones.get)
+
+
+@analytics_router.get("/api/availability/forecast")
+async def get_availability_forecast(lot_id: int, hours: int = 6):
     """
-    
+    Expected available spots every 30 minutes for the next `hours`, with a 10-90%
+    band, from the lot's seasonal profile adjusted by how far today is off it.
+    """
+    if not 1 <= hours <= FORECAST_MAX_HOURS:
+        raise HTTPException(400, f"hours must be between 1 and {FORECAST_MAX_HOURS}")
+    try:
+        result = await forecast_models.forecast(lot_id, hours)
+    except Exception as e:
+        print(f"SQL command execution error: {e}")
+        raise HTTPException(status_code=500, detail="Could not retrieve data")
+    if result is None:
+        raise HTTPException(404, f"Lot {lot_id} has no stalls")
+    return result
+
+
+def fetch_availability_matrix(lot_id: int, start_utc: datetime, end_utc: datetime):
+    """Snapshot times (epoch seconds) and a (snapshots x stalls) availability matrix."""
+    with pool.connection() as conn:
+        n_stalls = run_query(conn, "lot_stall_count", (lot_id,)).fetchone()[0]
+        epochs, bitsets = run_query(conn, "availability_bitsets",
+                                    (lot_id, start_utc.replace(tzinfo=None), end_utc.replace(tzinfo=None)),
+                                    binary=True).fetchone()
+    return np.asarray(epochs, dtype=np.float64), decode_many(bitsets, n_stalls)
+
+
+@analytics_router.get("/api/stall_timeline")
+async def get_stall_timeline(lot_id: int, stall_number: Optional[int] = None,
+                             start: Optional[str] = None, end: Optional[str] = None):
+    """
+    When stalls were free. With stall_number: that stall's free intervals and free
+    fraction. Without: the free fraction of every stall in the lot.
+    """
+    local_tz = lot_timezones.get(lot_id)
+    end_dt = parse_local_bound(end, local_tz, end=True) if end else datetime.now(local_tz)
+    start_dt = parse_local_bound(start, local_tz) if start else end_dt - timedelta(days=7)
+    if start_dt >= end_dt:
+        raise HTTPException(400, "start must be before end")
+
+    loop = asyncio.get_running_loop()
+    try:
+        epochs, matrix = await loop.run_in_executor(
+            None, fetch_availability_matrix, lot_id,
+            start_dt.astimezone(timezone.utc), end_dt.astimezone(timezone.utc))
+    except Exception as e:
+        print(f"SQL command execution error: {e}")
+        raise HTTPException(status_code=500, detail="Could not retrieve data")
+
+    if stall_number is None:
+        fractions = matrix.mean(axis=0) if len(epochs) else np.zeros(matrix.shape[1])
+        return {
+            "snapshots": len(epochs),
+            "free_fraction": {str(i): round(float(f), 4) for i, f in enumerate(fractions)},
+        }
+
+    if not 0 <= stall_number < matrix.shape[1]:
+        raise HTTPException(404, f"Stall {stall_number} not found in lot {lot_id}")
+    column = matrix[:, stall_number]
+    to_iso = lambda t: datetime.fromtimestamp(t, local_tz).isoformat()
+    return {
+        "stall_number": stall_number,
+        "snapshots": len(epochs),
+        "free_fraction": round(float(column.mean()), 4) if len(epochs) else 0.0,
+        "free_intervals": [[to_iso(a), to_iso(b)] for a, b in free_intervals(epochs, column)],
+    }
+
+
+heatmap_cache = VersionedCache(max_entries=64)     # (lot_id, start, end) -> response
+
+
+def fetch_lot_sessions(lot_id: int, start_utc: datetime, end_utc: datetime):
+    """Stall count and (stall number, entry, exit) arrays of the lot's sessions clipped to the range."""
+    with pool.connection() as conn:
+        n_stalls = run_query(conn, "lot_stall_count", (lot_id,)).fetchone()[0]
+        numbers, entries, exits = run_query(conn, "lot_sessions_in_range",
+                                            (lot_id, start_utc, end_utc, start_utc,
+                                             start_utc, end_utc, end_utc), binary=True).fetchone()
+    return n_stalls, numbers, entries, exits
+
+
+def compute_occupancy_heatmap(lot_id: int, start_dt: datetime, end_dt: datetime, local_tz):
+    n_stalls, numbers, entries, exits = fetch_lot_sessions(
+        lot_id, start_dt.astimezone(timezone.utc), end_dt.astimezone(timezone.utc))
+    fraction, observed = hour_of_week_occupancy(numbers, entries, exits, n_stalls,
+                                                start_dt.timestamp(), end_dt.timestamp(), local_tz)
+    return {
+        "lot_id": lot_id,
+        "start": start_dt.isoformat(),
+        "end": end_dt.isoformat(),
+        "timezone": str(local_tz),
+        "sessions": len(numbers),
+        # column h = hour h of the week in local time, Monday 00:00 = 0
+        "observed_hours": np.round(observed, 2).tolist(),
+        "matrix": {str(i): np.round(row, 3).tolist() for i, row in enumerate(fraction)},
+    }
+
+
+@analytics_router.get("/api/occupancy_heatmap")
+async def get_occupancy_heatmap(lot_id: int, start: Optional[str] = None, end: Optional[str] = None):
+    """
+    Stall x hour-of-week occupied fraction for a lot. Defaults to the last 28 days.
+    The range ends at the latest full local hour at most, and results stay cached
+    until a session in the lot starts or ends.
+    """
+    local_tz = lot_timezones.get(lot_id)
+    hour_now = datetime.now(local_tz).replace(minute=0, second=0, microsecond=0)
+    end_dt = min(parse_local_bound(end, local_tz, end=True), hour_now) if end else hour_now
+    start_dt = parse_local_bound(start, local_tz) if start else end_dt - timedelta(days=28)
+    if start_dt >= end_dt:
+        raise HTTPException(400, "start must be before end")
+
+    key = (lot_id, start_dt.timestamp(), end_dt.timestamp())
+    version = stall_events.data_version(lot_id)
+    cached = heatmap_cache.get(key, version)
+    if cached is not None:
+        return cached
+
+    loop = asyncio.get_running_loop()
     try:
-        conn = pool.getconn()
-        cur = conn.cursor()
-        cur.execute(sql, (cap_utc, cap_utc, start_of_day_utc, end_of_day_utc, lot_id))
-        rows = cur.fetchall()
-
-        stalls_data = [
-            {"id": row[0], "number": row[1], "duration": round(float(row[2]), 2)}
-            for row in rows
-        ]
-        return stalls_data
+        result = await loop.run_in_executor(None, compute_occupancy_heatmap,
+                                            lot_id, start_dt, end_dt, local_tz)
+    except Exception as e:
+        print(f"SQL command execution error: {e}")
+        raise HTTPException(status_code=500, detail="Could not retrieve data")
+
+    heatmap_cache.put(key, version, result)
+    return result
+
+
+@analytics_router.get("/api/stall_durations", dependencies=[Depends(require_known_lot)])
+async def get_stall_durations(lot_id: int, response: Response):
+    """API endpoint to get total parking duration for all stalls in a specific lot."""
+    try:
+        return (await load_today_snapshot(lot_id, response)).durations
     except Exception as e:
         print(f"Database error: {e}")
         raise HTTPException(status_code=500, detail="Could not retrieve data")
-    finally:
-        if cur: 
-            cur.close()
-        if conn: 
-            pool.putconn(conn)
 
 
+
+portfolio_cache = VersionedCache(max_entries=32)   # lot ids (None = all) -> response
+portfolio_lock = asyncio.Lock()                    # one computation at a time; the rest reuse it
+
+
+def portfolio_version():
+    """Portfolio responses are as fresh as the per-lot snapshots."""
+    return int(time.time() // SNAPSHOT_INTERVAL_SEC)
+
+
+@analytics_router.get("/api/portfolio")
+async def get_portfolio(lot_id: Optional[list[int]] = Query(None)):
+    """
+    Today's KPIs for several lots at once, each over its own local day: current
+    occupancy, occupied hours, arrivals / turnover, and peak and trough availability. Pass lot_id repeatedly
+    to pick lots, or nothing for all of them. Computed by one grouped query and
+    cached as a whole for SNAPSHOT_INTERVAL_SEC.
+    """
+    key = tuple(sorted(set(lot_id))) if lot_id else None
+    cached = portfolio_cache.get(key, portfolio_version())
+    if cached is not None:
+        return cached
+    async with portfolio_lock:
+        version = portfolio_version()
+        cached = portfolio_cache.get(key, version)
+        if cached is not None:
+            return cached
+
+        def compute():
+            with pool.connection() as conn:
+                return compute_portfolio(conn, key)
+
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(None, compute)
+        except Exception as e:
+            print(f"SQL command execution error: {e}")
+            raise HTTPException(status_code=500, detail="Could not retrieve data")
+        portfolio_cache.put(key, version, result)
+        return result
+
 # === CSV export for today's availability timeline =========================
-@app.get("/api/availability_today_csv")
+@analytics_router.get("/api/availability_today_csv", dependencies=[Depends(require_known_lot)])
 async def availability_today_csv(lot_id: int):
     """
     Returns a CSV with two columns:
       timestamp (HH:MM AM/PM, local time) | available_spots
     """
-    chart = await get_availability_today(lot_id)           # reuse existing query
+    try:
+        snap = await load_today_snapshot(lot_id)
+    except Exception as e:
+        print(f"SQL command execution error: {e}")
+        raise HTTPException(status_code=500, detail="Could not retrieve data")
+    chart = snap.availability
 
     def csv_rows():
         buf = io.StringIO(); w = csv.writer(buf)
@@ -337,16 +460,21 @@ async def availability_today_csv(lot_id: int):
             w.writerow([ts, spots]); yield buf.getvalue()
             buf.seek(0); buf.truncate(0)
 
-    today = datetime.now(zoneinfo.ZoneInfo("America/Edmonton")).strftime("%Y-%m-%d")
     headers = {
-        "Content-Disposition": f'attachment; filename="availability_lot{lot_id}_{today}.csv"'
+        "Content-Disposition": f'attachment; filename="availability_lot{lot_id}_{snap.day:%Y-%m-%d}.csv"',
+        "X-Snapshot-Age": f"{snap.age():.1f}",
     }
     return StreamingResponse(csv_rows(), media_type="text/csv", headers=headers)
 
 
-@app.get("/api/stall_durations_csv")
+@analytics_router.get("/api/stall_durations_csv", dependencies=[Depends(require_known_lot)])
 async def get_stall_durations_csv(lot_id: int):
-    stalls_data = await get_stall_durations(lot_id)
+    try:
+        snap = await load_today_snapshot(lot_id)
+    except Exception as e:
+        print(f"Database error: {e}")
+        raise HTTPException(status_code=500, detail="Could not retrieve data")
+    stalls_data = snap.durations
 
     def csv_rows():
         buf = io.StringIO()
@@ -359,27 +487,21 @@ async def get_stall_durations_csv(lot_id: int):
             yield buf.getvalue(); buf.seek(0); buf.truncate(0)
 
     headers = {
-        "Content-Disposition": f'attachment; filename="stall_durations_lot{lot_id}.csv"'
+        "Content-Disposition": f'attachment; filename="stall_durations_lot{lot_id}.csv"',
+        "X-Snapshot-Age": f"{snap.age():.1f}",
     }
     return StreamingResponse(csv_rows(), media_type="text/csv", headers=headers)
 
 
 
-@app.get("/api/stall_history_csv")
+@analytics_router.get("/api/stall_history_csv")
 async def get_stall_history_csv(lot_id: int, stall_id: int, days: str = "7"):
     if days not in ("7", "30", "365", "all"):
         raise HTTPException(400, "days must be 7, 30, 365 or 'all'")
 
-    conn, cur = None, None
-    try:
-        conn = pool.getconn()
-        cur = conn.cursor()
-        cur.execute("SELECT stall_number FROM public.stalls WHERE stall_id = %s", (stall_id,))
-        row = cur.fetchone()
-        stall_number = row[0] if row else stall_id
-    finally:
-        if cur: cur.close()
-        if conn: pool.putconn(conn)
+    with pool.connection() as conn:
+        row = run_query(conn, "stall_number_by_id", (stall_id,)).fetchone()
+    stall_number = row[0] if row else stall_id
 
     hist = await get_stall_history(stall_id, days)
 
@@ -400,100 +522,270 @@ async def get_stall_history_csv(lot_id: int, stall_id: int, days: str = "7"):
     return StreamingResponse(csv_rows(), media_type="text/csv", headers=headers)
 
 
-@app.get("/api/stall_histories_zip")
+EXPORT_WAIT_POLL_SEC = 0.5
+
+
+@analytics_router.get("/api/stall_histories_zip")
 async def stall_histories_zip(lot_id: int, days: str = "7"):
+    """
+    Synchronous form of the stall_histories export job: waits for the job (or
+    reuses its artifact on disk) and sends the ZIP. The dashboard uses /api/exports.
+    """
     if days not in ("7", "30", "365", "all"):
         raise HTTPException(400, "days must be 7, 30, 365 or 'all'")
 
-    conn = cur = None
+    job, _ = await submit_export("stall_histories", lot_id, days=days)
+    while job.status in ("queued", "running"):
+        await asyncio.sleep(EXPORT_WAIT_POLL_SEC)
+    if job.status != "done":
+        raise HTTPException(500, "Failed to build ZIP")
+    return FileResponse(job.path, media_type="application/zip", filename=job.plan.filename)
+
+
+async def submit_export(kind: str, lot_id: int, **params):
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(
+            None, lambda: export_jobs.submit(kind, lot_id, lot_timezones.get(lot_id), **params))
+    except ExportBusyError:
+        raise HTTPException(503, "Too many exports queued, try again shortly", headers={"Retry-After": "30"})
+    except Exception as e:
+        print(f"Export submit error: {e}")
+        raise HTTPException(500, "Could not start export")
+
+
+@analytics_router.post("/api/exports")
+async def create_export(kind: str, lot_id: int, days: str = "7",
+                        start: Optional[str] = None, end: Optional[str] = None):
+    """
+    Start a background export. kind=stall_histories takes `days` (7, 30, 365, all);
+    kind=sessions takes `start` / `end` like /api/sessions_csv. Poll the returned
+    job at /api/exports/{id}; an identical earlier export is returned as done at once.
+    Identical running exports share one job; the returned `hold` is this request's
+    share of it, and DELETE /api/exports/{id}?hold=... releases only that share.
+    """
+    if kind == "stall_histories":
+        if days not in ("7", "30", "365", "all"):
+            raise HTTPException(400, "days must be 7, 30, 365 or 'all'")
+        params = {"days": days}
+    elif kind == "sessions":
+        local_tz = lot_timezones.get(lot_id)
+        end_dt = parse_local_bound(end, local_tz, end=True) if end else datetime.now(local_tz)
+        start_dt = parse_local_bound(start, local_tz) if start else end_dt - timedelta(days=30)
+        if start_dt >= end_dt:
+            raise HTTPException(400, "start must be before end")
+        params = {"start_dt": start_dt, "end_dt": end_dt}
+    else:
+        raise HTTPException(400, f"kind must be one of {sorted(EXPORT_KINDS)}")
+
+    job, hold = await submit_export(kind, lot_id, **params)
+    return JSONResponse({**job.to_dict(), "hold": hold}, status_code=200 if job.status == "done" else 202)
+
+
+def get_export_job(job_id: str):
+    job = export_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(404, "Unknown export job")
+    return job
+
+
+@analytics_router.get("/api/exports/{job_id}")
+def export_status(job_id: str):
+    return get_export_job(job_id).to_dict()
+
+
+@analytics_router.delete("/api/exports/{job_id}")
+def cancel_export(job_id: str, hold: str):
+    return export_jobs.cancel(get_export_job(job_id).id, hold).to_dict()
+
+
+@analytics_router.get("/api/exports/{job_id}/download")
+def download_export(job_id: str):
+    job = get_export_job(job_id)
+    if job.status != "done" or not os.path.exists(job.path):
+        raise HTTPException(409, f"Export is {job.status}")
+    media_type = "application/zip" if job.path.endswith(".zip") else "text/csv"
+    return FileResponse(job.path, media_type=media_type, filename=job.plan.filename)
+
+
+@analytics_router.get("/api/sessions_csv")
+async def sessions_csv(lot_id: int, start: Optional[str] = None, end: Optional[str] = None):
+    """
+    Every parking session of a lot that started in the range, as raw CSV.
+    Defaults to the last 30 days; timestamps are local time with their offset.
+    """
+    local_tz = lot_timezones.get(lot_id)
+    end_dt = parse_local_bound(end, local_tz, end=True) if end else datetime.now(local_tz)
+    start_dt = parse_local_bound(start, local_tz) if start else end_dt - timedelta(days=30)
+    if start_dt >= end_dt:
+        raise HTTPException(400, "start must be before end")
+    if exports_busy():
+        raise HTTPException(503, "Too many exports running, try again shortly",
+                            headers={"Retry-After": "10"})
+
+    filename = f"lot{lot_id}_sessions_{start_dt:%Y%m%d}_{end_dt:%Y%m%d}.csv"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+    return StreamingResponse(
+        copy_csv_chunks(SESSIONS_EXPORT_COPY_SQL,
+                        (lot_id, start_dt.astimezone(timezone.utc), end_dt.astimezone(timezone.utc)),
+                        str(local_tz)),
+        media_type="text/csv", headers=headers)
+
+
+SESSION_STATES = ("all", "open", "closed")
+SESSIONS_PAGE_MAX = 500
+
+
+def session_filters_key(lot_id, stall_id, start, end, state) -> str:
+    """Fingerprint of a listing's filters; a cursor is only valid for the filters it came from."""
+    return hashlib.sha1(repr((lot_id, stall_id, start, end, state)).encode()).hexdigest()[:8]
+
+
+def encode_session_cursor(entry: datetime, session_id: int, filters_key: str) -> str:
+    micros = (entry - datetime.fromtimestamp(0, timezone.utc)) // timedelta(microseconds=1)   # exact, unlike a float
+    token = f"{micros}.{session_id}.{filters_key}"
+    return base64.urlsafe_b64encode(token.encode()).decode().rstrip("=")
+
+
+def decode_session_cursor(cursor: str, filters_key: str):
+    """(entry_timestamp, session_id) to continue below, or HTTP 400."""
+    try:
+        token = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        micros, session_id, key = token.split(".")
+    except ValueError:
+        raise HTTPException(400, "Invalid cursor")
+    if key != filters_key:
+        raise HTTPException(400, "Cursor belongs to a different query; start again without it")
     try:
-        conn = pool.getconn()
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT stall_id, stall_number
-            FROM public.stalls
-            WHERE lot_id = %s
-            ORDER BY CAST(stall_number AS INTEGER)
-        """, (lot_id,))
-        stalls = cur.fetchall()  # [(stall_id, stall_number), ...]
-
-        suffix = export_suffix(days)
-        mem = io.BytesIO()
-        with ZipFile(mem, "w", ZIP_DEFLATED) as z:
-            for sid, snum in stalls:
-                # reuse your existing endpoint logic
-                hist = await get_stall_history(sid, days)
-
-                # write one CSV per stall
-                s_buf = io.StringIO()
-                w = csv.writer(s_buf)
-                w.writerow(["date", "occupied_hours"])
-                for lbl, hrs in zip(hist["labels"], hist["data"]):
-                    w.writerow([lbl, hrs])   # labels are already "Aug 12, 2025"
-                z.writestr(f"lot{lot_id}_stall_{snum}_{suffix}.csv", s_buf.getvalue())
-
-        mem.seek(0)
-        headers = {"Content-Disposition": f'attachment; filename="lot{lot_id}_stall_histories_{suffix}.zip"'}
-        return StreamingResponse(mem, media_type="application/zip", headers=headers)
+        entry = datetime.fromtimestamp(0, timezone.utc) + timedelta(microseconds=int(micros))
+        session_id = int(session_id)
+        if not 0 <= session_id < 2 ** 63:            # bigint
+            raise ValueError(session_id)
+    except (ValueError, OverflowError):
+        raise HTTPException(400, "Invalid cursor")
+    return entry, session_id
+
+
+def fetch_sessions_page(params: dict, by_stall: bool):
+    with pool.connection() as conn:
+        return run_query(conn, "sessions_page_stall" if by_stall else "sessions_page_lot", params).fetchall()
+
 
+@analytics_router.get("/api/sessions")
+async def list_sessions(lot_id: Optional[int] = None, stall_id: Optional[int] = None,
+                        start: Optional[str] = None, end: Optional[str] = None,
+                        state: str = "all", limit: int = 50, cursor: Optional[str] = None):
+    """
+    Parking sessions of a lot or a stall, newest entry first, one page at a time.
+    Filters: entry time in [start, end) (dates or ISO datetimes, local time) and
+    state = all | open | closed. Pass the returned `next_cursor` as `cursor` for
+    the next page; it is null on the last one. Every page costs the same, however
+    deep: it is an index range scan continuing after the previous page's last row.
+    """
+    if lot_id is None and stall_id is None:
+        raise HTTPException(400, "lot_id or stall_id is required")
+    if state not in SESSION_STATES:
+        raise HTTPException(400, f"state must be one of {SESSION_STATES}")
+    if not 1 <= limit <= SESSIONS_PAGE_MAX:
+        raise HTTPException(400, f"limit must be between 1 and {SESSIONS_PAGE_MAX}")
+    local_tz = lot_timezones.get(lot_id) if lot_id is not None else lot_timezones.for_stall(stall_id)
+    start_dt = parse_local_bound(start, local_tz) if start else datetime(1970, 1, 1, tzinfo=timezone.utc)
+    end_dt = parse_local_bound(end, local_tz, end=True) if end else datetime.now(timezone.utc) + timedelta(days=1)
+    if start_dt >= end_dt:
+        raise HTTPException(400, "start must be before end")
+
+    filters_key = session_filters_key(lot_id, stall_id, start, end, state)
+    # the first page continues below (end, 0): session ids start at 1
+    before_ts, before_id = decode_session_cursor(cursor, filters_key) if cursor else (end_dt, 0)
+    params = {"lot_id": lot_id, "stall_id": stall_id, "start": start_dt, "before_ts": before_ts,
+              "before_id": before_id, "state": state, "limit": limit + 1}
+    try:
+        loop = asyncio.get_running_loop()
+        rows = await loop.run_in_executor(None, fetch_sessions_page, params, stall_id is not None)
     except Exception as e:
-        print("stall_histories_zip error:", e)
-        raise HTTPException(500, "Failed to build ZIP")
-    finally:
-        if cur: cur.close()
-        if conn: pool.putconn(conn)
+        print(f"SQL command execution error: {e}")
+        raise HTTPException(status_code=500, detail="Could not retrieve data")
+
+    page = rows[:limit]
+    next_cursor = (encode_session_cursor(page[-1][3], page[-1][0], filters_key)
+                   if len(rows) > limit else None)
+    return {
+        "sessions": [{
+            "session_id": session_id,
+            "stall_id": sid,
+            "stall_number": number,
+            "entry": entry.astimezone(local_tz).isoformat(),
+            "exit": exit_ts.astimezone(local_tz).isoformat() if exit_ts else None,
+            "duration_hours": round((exit_ts - entry).total_seconds() / 3600, 2) if exit_ts else None,
+            "vehicle_identifier": vehicle,
+        } for session_id, sid, number, entry, exit_ts, vehicle in page],
+        "next_cursor": next_cursor,
+    }
+
+
+page_cache = VersionedCache(max_entries=256)     # ("lot" | "stall", id) -> (html bytes, etag)
+
+
+def render_page(request: Request, template: str, context: dict):
+    """Rendered template body plus an ETag for it, ready for page_cache."""
+    body = templates.TemplateResponse(request, template, context).body
+    return body, '"' + hashlib.md5(body).hexdigest() + '"'
+
 
+def cached_html(request: Request, page):
+    body, etag = page
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return HTMLResponse(body, headers={"ETag": etag, "Cache-Control": "no-cache"})
 
 
-@app.get("/dashboard/lot/{lot_id}", response_class=HTMLResponse)
+@analytics_router.get("/dashboard/lot/{lot_id}", response_class=HTMLResponse,
+                      dependencies=[Depends(require_known_lot)])
 async def get_dashboard(request: Request, lot_id: int):
-    """Renders the dashboard by calling the stall durations API internally."""
-    
-    # 2. Construct the full URL to your own API endpoint
-    api_url = f"{request.base_url}api/stall_durations?lot_id={lot_id}"
-    
+    """
+    Renders the dashboard from the lot's precomputed snapshot of today. The page
+    is cached until a newer snapshot replaces it (the scheduler refreshes it
+    every SNAPSHOT_INTERVAL_SEC, sooner after sessions change).
+    """
     try:
-        # call the existing coroutine directly
-        duration_data = await get_stall_durations(lot_id)
-
-        # 4. Pass the fetched data to the Jinja2 template
-        return templates.TemplateResponse("all_stalls_dashboard.html", {
-            "request": request,
-            "duration_data": duration_data,
-            "lot_id": lot_id
-        })
-
-    except httpx.RequestError as e:
-        print(f"HTTP request error: {e}")
-        return HTMLResponse("<h1>Error: Could not connect to the API service.</h1>", status_code=503)
+        snap = await load_today_snapshot(lot_id)
+        version = snap.computed_at
+        page = page_cache.get(("lot", lot_id), version)
+        if page is None:
+            page = render_page(request, "all_stalls_dashboard.html", {
+                "duration_data": snap.durations,
+                "lot_id": lot_id
+            })
+            page_cache.put(("lot", lot_id), version, page)
+        response = cached_html(request, page)
+        response.headers["X-Snapshot-Age"] = f"{snap.age():.1f}"
+        return response
+
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
         return HTMLResponse("<h1>An unexpected error occurred.</h1>", status_code=500)
 
 
 
-@app.get("/dashboard/stall/{stall_id}", response_class=HTMLResponse)
+@analytics_router.get("/dashboard/stall/{stall_id}", response_class=HTMLResponse)
 async def get_single_stall_dashboard(request: Request, stall_id: int):
     """Renders a detail page for a single stall using its unique ID."""
-    
-    # You can now use the stall_id to fetch specific data from the database
-    stall_data = {
-        "id": stall_id,        
-    }
-
-    return templates.TemplateResponse("single_stall_dashboard.html", {
-        "request": request,
-        "stall_data": stall_data
-    })
+    page = page_cache.get(("stall", stall_id))
+    if page is None:
+        # You can now use the stall_id to fetch specific data from the database
+        stall_data = {
+            "id": stall_id,
+        }
+        page = render_page(request, "single_stall_dashboard.html", {"stall_data": stall_data})
+        page_cache.put(("stall", stall_id), None, page)
+    return cached_html(request, page)
 
-@app.get("/api/stall-history")
+@analytics_router.get("/api/stall-history")
 async def get_stall_history(stall_id: int, days: str = "7"):
     """
     Daily occupied hours for a stall, correctly including today and sessions
     that cross midnight / are still open.
     """
-    conn = cur = None
-
     # --- Parse days arg ---
     if days == "all":
         days_int = None
@@ -505,90 +797,41 @@ async def get_stall_history(stall_id: int, days: str = "7"):
         if days_int not in (7, 30, 365):
             raise HTTPException(400, "days must be 7, 30, 365 or 'all'")
 
-    local_tz = zoneinfo.ZoneInfo("America/Edmonton")
-    local_now = datetime.now(local_tz)
-    # end bound = now (local) -> convert to UTC once for SQL
-    end_utc = local_now.astimezone(timezone.utc)
-
     try:
-        conn = pool.getconn()
-        cur  = conn.cursor()
-
-        # Determine start of range (local midnight) based on days/all
-        if days_int is None:
-            # all-time: start from the day of the earliest session (local)
-            cur.execute("""
-                SELECT MIN((entry_timestamp AT TIME ZONE %s)::date)
-                FROM public.parkingsessions
-                WHERE stall_id = %s
-            """, ("America/Edmonton", stall_id))
-            min_local_date = cur.fetchone()[0]
-            if min_local_date is None:
-                # no data at all -> return a single "today" zero
-                return {
-                    "labels": [local_now.date().strftime("%b %d, %Y")],
-                    "data":   [0.0],
-                    "kpi":    {"total":"0.0 hrs","avg":"0.0 hrs","busiest":"N/A"}
-                }
-            start_local_dt = datetime(min_local_date.year, min_local_date.month, min_local_date.day,
-                                      tzinfo=local_tz)
-        else:
-            # last N days including today: start at local midnight N-1 days ago
-            start_local_dt = (local_now.replace(hour=0, minute=0, second=0, microsecond=0)
-                              - timedelta(days=days_int - 1))
-
-        start_utc = start_local_dt.astimezone(timezone.utc)
-
-        # SQL: build per-day grid (UTC based), intersect with sessions, sum overlaps
-        sql = """
-        WITH bounds AS (
-            SELECT %s::timestamptz AS start_utc,
-                   %s::timestamptz AS end_utc
-        ),
-        day_grid AS (
-            SELECT generate_series(
-                       (SELECT start_utc FROM bounds),
-                       (SELECT end_utc   FROM bounds),
-                       interval '1 day'
-                   ) AS day_start_utc
-        ),
-        sess AS (
-            SELECT
-              ps.entry_timestamp                         AS entry_utc,
-              COALESCE(ps.exit_timestamp,
-                       (SELECT end_utc FROM bounds))      AS exit_utc
-            FROM public.parkingsessions ps, bounds b
-            WHERE ps.stall_id = %s
-              -- session intersects the [start,end) window:
-              AND ps.entry_timestamp <  b.end_utc
-              AND COALESCE(ps.exit_timestamp, b.end_utc) > b.start_utc
-        ),
-        perday AS (
-            SELECT
-                g.day_start_utc,
-                CASE
-                WHEN s.entry_utc IS NULL THEN interval '0 second'
-                ELSE GREATEST(
-                        interval '0 second',
-                        LEAST(s.exit_utc, g.day_start_utc + interval '1 day')
-                        - GREATEST(s.entry_utc, g.day_start_utc)
-                    )
-                END AS overlap
-            FROM day_grid g
-            LEFT JOIN sess s
-                ON s.entry_utc < g.day_start_utc + interval '1 day'
-            AND s.exit_utc  > g.day_start_utc
-            )
-        SELECT
-          ((day_start_utc AT TIME ZONE 'America/Edmonton')::date) AS local_date,
-          COALESCE(SUM(EXTRACT(EPOCH FROM overlap)),0)/3600.0     AS hours
-        FROM perday
-        GROUP BY local_date
-        ORDER BY local_date;
-        """
-
-        cur.execute(sql, (start_utc, end_utc, stall_id))
-        rows = cur.fetchall()  # [(date, hours), ...]
+        local_tz = lot_timezones.for_stall(stall_id)
+        cal = calendar_for(local_tz)
+        local_now = datetime.now(local_tz)
+        # end bound = now (local) -> convert to UTC once for SQL
+        end_utc = local_now.astimezone(timezone.utc)
+
+        with pool.connection() as conn:
+            cur = conn.cursor()
+
+            # Determine the first local day of the range based on days/all
+            if days_int is None:
+                # all-time: start from the day of the earliest session (local)
+                run_query(cur, "stall_first_session_date", (str(local_tz), stall_id))
+                first_day = cur.fetchone()[0]
+                if first_day is None:
+                    # no data at all -> return a single "today" zero
+                    return {
+                        "labels": [local_now.date().strftime("%b %d, %Y")],
+                        "data":   [0.0],
+                        "kpi":    {"total":"0.0 hrs","avg":"0.0 hrs","busiest":"N/A"}
+                    }
+            else:
+                # last N days including today
+                first_day = local_now.date() - timedelta(days=days_int - 1)
+
+            start_utc = cal.midnight(first_day)
+
+            # a session already running at start_utc is counted from its entry on
+            run_query(cur, "stall_session_at", {"stall_id": stall_id, "at": start_utc})
+            running = cur.fetchone()
+            run_query(cur, "stall_history", {"tz": str(local_tz), "start": start_utc, "end": end_utc,
+                                             "stall_id": stall_id,
+                                             "since": running[0] if running else start_utc})
+            rows = cur.fetchall()  # [(date, hours), ...]
 
         # Build a full continuous local date range (ensures today appears)
         dates_to_hours = {d: float(h) for d, h in rows}
@@ -596,7 +839,7 @@ async def get_stall_history(stall_id: int, days: str = "7"):
 
         # inclusive range
         all_dates = []
-        d = start_local_dt.date()
+        d = first_day
         while d <= last_local_date:
             all_dates.append(d)
             d += timedelta(days=1)
@@ -628,9 +871,70 @@ async def get_stall_history(stall_id: int, days: str = "7"):
     except Exception as e:
         print("get_stall_history error:", e)
         raise HTTPException(status_code=500, detail="Could not retrieve data")
-    finally:
-        if cur: cur.close()
-        if conn: pool.putconn(conn)
+
+
+@common_router.get("/api/db/pool_stats")
+def get_pool_stats():
+    """Checkout wait / hold times per endpoint, saturation, failed checkouts and
+    connections held past the leak threshold."""
+    return pool.instrumentation()
+
+
+@common_router.get("/api/db/query_stats")
+def get_query_stats():
+    """Executions, latency percentiles and row counts per named query."""
+    return query_registry.stats()
+
+
+@common_router.get("/api/db/partitions")
+def get_partitions():
+    """Monthly partitions of the session and snapshot tables (estimated rows, size)
+    and the outcome of the last maintenance pass."""
+    return partition_manager.status()
+
+
+def require_session(request: Request):
+    """Dependency for endpoints that change or expose more than stats: a logged-in session."""
+    if not request.session.get("authenticated"):
+        raise HTTPException(401, "Log in first")
+
+
+@common_router.get("/api/profiler", dependencies=[Depends(require_session)])
+def get_profiler(limit: int = 50):
+    """Profiler settings, per-route wall / db / cpu / loop-lag percentiles and the
+    latest profiled requests."""
+    return request_profiler.report(limit=max(0, min(limit, 500)))
+
+
+@common_router.post("/api/profiler", dependencies=[Depends(require_session)])
+def configure_profiler(enabled: Optional[bool] = None, sample_rate: Optional[float] = None,
+                       route: Optional[list[str]] = Query(None), stacks: Optional[bool] = None,
+                       interval_ms: Optional[float] = None):
+    """
+    Switch request profiling on or off at runtime. route (repeatable) limits it
+    to request paths matching these glob patterns (e.g. /api/stall-history,
+    /dashboard/*); route= with no value clears the filter. stacks=true also keeps
+    collapsed stacks for /api/profiler/stacks.
+    """
+    if sample_rate is not None and not 0 <= sample_rate <= 1:
+        raise HTTPException(400, "sample_rate must be between 0 and 1")
+    return request_profiler.configure(enabled=enabled, sample_rate=sample_rate, routes=route,
+                                      stacks=stacks, interval_ms=interval_ms)
+
+
+@common_router.delete("/api/profiler", dependencies=[Depends(require_session)])
+def clear_profiler():
+    request_profiler.clear()
+    return request_profiler.settings()
+
+
+@common_router.get("/api/profiler/stacks", dependencies=[Depends(require_session)])
+def download_profiler_stacks(route: Optional[str] = None):
+    """Collapsed stacks of the profiled requests (flamegraph.pl / speedscope input),
+    optionally only routes whose label contains `route`."""
+    filename = f"profile-{datetime.now():%Y%m%d-%H%M%S}.folded"
+    return PlainTextResponse(request_profiler.collapsed_stacks(route),
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
 
 
 # ---- HTML snippets ----
@@ -658,62 +962,63 @@ LOGIN_HTML = """<!DOCTYPE html><html><head>
 </body></html>"""
 
 
-# ----- Stream helper functions -----------------------------------
-def deserialize_frame(buf: bytes):
-    off = 0
-    slen = struct.unpack_from('<i', buf, off)[0]; off += 4
-    fid = float(buf[off:off+slen].decode()); off += slen
-    mtype = struct.unpack_from('<i', buf, off)[0]; off += 4
-    rows = struct.unpack_from('<i', buf, off)[0]; off += 4
-    cols = struct.unpack_from('<i', buf, off)[0]; off += 4
-    channels = ((mtype >> 3) & 0x3F) + 1
-    size = rows*cols*channels
-    img = np.frombuffer(buf[off:off+size], dtype=np.uint8).reshape((rows, cols, channels))
-    if img.ndim == 3 and img.shape[2] == 2:
-        img = cv2.cvtColor(img, cv2.COLOR_YUV2BGR_YUY2)
-    return fid, img
-
-def img_to_b64(img: np.ndarray):
-    ok, enc = cv2.imencode('.jpg', img)
-    if not ok:
-        return None
-    return 'data:image/jpeg;base64,' + base64.b64encode(enc.tobytes()).decode()
-
-
-@app.get("/", include_in_schema=False)
-def home_redirect():
-    return RedirectResponse(url="/stream", status_code=307)
-
-# ----- Background tasks -----------------------------------------------
-async def list_consumer():
-    loop = asyncio.get_running_loop()
-    while True:
-        _, raw = await loop.run_in_executor(None, lambda: r_bin.blpop(LIST_KEY, 0))
-        fid, img = deserialize_frame(raw)
-        pending[fid] = (img, loop.time())
 
-async def zset_matcher():
-    loop = asyncio.get_running_loop()
-    while True:
-        now = loop.time()
-        for fid in list(pending.keys()):
-            raw_img, ts = pending[fid]
-            zdata = await loop.run_in_executor(None,
-                     lambda fid=fid: r_bin.zrangebyscore(ZSET_KEY, fid, fid, 0, 1))
-            if zdata:
-                loop.run_in_executor(None, r_bin.zrem, ZSET_KEY, zdata[0])
-                _, res_img = deserialize_frame(zdata[0])
-                try:
-                    global latest_pair
-                    latest_pair = (raw_img, res_img)
-                except asyncio.QueueFull:
-                    pass
-                del pending[fid]
-            elif now - ts > MAX_WAIT_SEC:
-                del pending[fid]
-        await asyncio.sleep(POLL_MS/1000)
-
-@app.on_event('startup')
-async def startup_tasks():
-    asyncio.create_task(list_consumer())
-    asyncio.create_task(zset_matcher())
+
+# ----- App factory -----------------------------------------------------
+def create_app(mode: str = "full") -> FastAPI:
+    """
+    Assemble the app for one deployment role:
+      analytics  dashboards, chart APIs and exports; never loads OpenCV, and Redis
+                 only for the live stall state
+      stream     the camera stream page, /frames and detections
+      full       both
+    Login, the stall event feed, vacant stalls and the DB stats endpoints are served in every mode.
+    """
+    if mode not in APP_MODES:
+        raise ValueError(f"APP_MODE must be one of {APP_MODES}, not {mode!r}")
+    serve_stream = mode in ("stream", "full")
+    serve_analytics = mode in ("analytics", "full")
+
+    app = FastAPI()
+    app.mount("/static", StaticFiles(directory="static"), name="static")
+    app.add_middleware(SessionMiddleware, secret_key=os.getenv("SESSION_SECRET_KEY", "super-secret"))
+    app.add_middleware(RequestProfilerMiddleware, profiler=request_profiler)
+    labelled = [Depends(label_endpoint)]
+    app.include_router(common_router, dependencies=labelled)
+    if serve_stream:
+        import Stream_Pipeline          # Redis client and frame pipeline; OpenCV loads with the first frame
+        app.include_router(Stream_Pipeline.router, dependencies=labelled)
+    if serve_analytics:
+        app.include_router(analytics_router, dependencies=labelled)
+
+    app.state.mode = mode
+    if os.getenv("PROFILE_REQUESTS"):                    # e.g. PROFILE_REQUESTS=0.05: profile 5% from the start
+        request_profiler.configure(enabled=True, sample_rate=float(os.getenv("PROFILE_REQUESTS")))
+    app.state.home_url = "/stream" if serve_stream else f"/dashboard/lot/{DEFAULT_LOT_ID}"
+    if not serve_stream:
+        @app.get("/", include_in_schema=False)
+        def home_redirect():
+            return RedirectResponse(url=app.state.home_url, status_code=307)
+
+    @app.on_event('startup')
+    async def startup_tasks():
+        # run_in_executor(None, ...) work keeps the request's endpoint label and profile
+        asyncio.get_running_loop().set_default_executor(
+            ProfilingThreadPoolExecutor(request_profiler, thread_name_prefix="app"))
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, lot_timezones.load)
+        except Exception as e:
+            print(f"Lot time zones load error: {e}")
+        asyncio.create_task(lot_timezones.maintain())
+        asyncio.create_task(stall_events.listen())
+        asyncio.create_task(live_stalls.maintain(rebuild_live_stall_state))
+        asyncio.create_task(partition_manager.maintain())
+        if serve_analytics:
+            asyncio.create_task(today_snapshots.run())
+        if serve_stream:
+            Stream_Pipeline.start_stream_tasks()
+
+    return app
+
+
+app = create_app(os.getenv("APP_MODE", "full"))
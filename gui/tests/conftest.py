@@ -0,0 +1,43 @@
+import os
+import sys
+
+import pytest
+
+# the app modules are flat files in gui/ and resolve templates/ and static/ from the cwd
+GUI_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, GUI_DIR)
+os.chdir(GUI_DIR)
+
+
+@pytest.fixture
+def scratch_db(monkeypatch):
+    """A migrated throwaway database on the PG_* server, set as PG_DBNAME; skipped without one."""
+    psycopg = pytest.importorskip("psycopg")
+    from User_Authentication import load_env
+    from ParkingLot_Database_Utils import get_conninfo, close_connection_pool
+    from ParkingLot_Schema_Migrations import apply_migrations
+    load_env("./.env")
+    name = f"parking_test_{os.getpid()}"
+    try:
+        admin = psycopg.connect(**{**get_conninfo(), "dbname": "postgres"}, autocommit=True, connect_timeout=3)
+    except psycopg.OperationalError as e:
+        pytest.skip(f"no database server: {e}")
+    admin.execute(f"DROP DATABASE IF EXISTS {name} WITH (FORCE)")
+    admin.execute(f"CREATE DATABASE {name}")
+    close_connection_pool()                  # a pool opened before (e.g. by importing main) targets another db
+    monkeypatch.setenv("PG_DBNAME", name)
+    with psycopg.connect(**get_conninfo(), autocommit=True) as conn:
+        apply_migrations(conn)
+    yield name
+    close_connection_pool()
+    admin.execute(f"DROP DATABASE IF EXISTS {name} WITH (FORCE)")
+    admin.close()
+
+
+@pytest.fixture
+def db_conn(scratch_db):
+    """Autocommit connection to the scratch database."""
+    import psycopg
+    from ParkingLot_Database_Utils import get_conninfo
+    with psycopg.connect(**get_conninfo(), autocommit=True) as conn:
+        yield conn
@@ -0,0 +1,53 @@
+import contextlib
+import zoneinfo
+
+import numpy as np
+
+import Availability_Forecast
+from Availability_Forecast import ForecastModels, SeasonalProfile
+
+TZ = zoneinfo.ZoneInfo("America/Los_Angeles")
+START = 1767225600.0                      # 2026-01-01 00:00 UTC
+
+
+def snapshots(days):
+    epochs = START + 600.0 * np.arange(days * 144)
+    return epochs, 40 + 20 * np.sin(epochs / 86400 * 2 * np.pi)
+
+
+def test_advancing_leaves_the_old_profile_alone_and_matches_one_fit():
+    epochs, counts = snapshots(14)
+    half = epochs < START + 7 * 86400
+    first = SeasonalProfile(TZ).advanced(epochs[half], counts[half], START + 7 * 86400)
+    before = [a.copy() for a in (first.w, first.wx, first.wxx)]
+    second = first.advanced(epochs[~half], counts[~half], START + 14 * 86400)
+
+    for old, now in zip(before, (first.w, first.wx, first.wxx)):
+        assert np.array_equal(old, now)
+    assert first.fitted_until == START + 7 * 86400 and first.observations == half.sum()
+    whole = SeasonalProfile(TZ).advanced(epochs, counts, START + 14 * 86400)
+    assert np.allclose(second.wx, whole.wx) and second.observations == whole.observations
+
+
+def test_refresh_swaps_in_a_new_model(monkeypatch):
+    epochs, counts = snapshots(7)
+
+    class Pool:
+        def connection(self):
+            return contextlib.nullcontext(None)
+
+    class Count:
+        def fetchone(self):
+            return (60,)
+
+    monkeypatch.setattr(Availability_Forecast, "get_connection_pool", Pool)
+    monkeypatch.setattr(Availability_Forecast, "run_query", lambda conn, name, params: Count())
+    monkeypatch.setattr(Availability_Forecast, "fetch_snapshots",
+                        lambda conn, lot_id, since, until: (epochs[epochs >= since], counts[epochs >= since]))
+    models = ForecastModels(timezone_of=lambda lot_id: TZ)
+
+    held = models.refresh(1)
+    profile, w = held.profile, held.profile.w.copy()
+    fresh = models.refresh(1)
+    assert fresh is not held and models._models[1] is fresh
+    assert held.profile is profile and np.array_equal(held.profile.w, w)
@@ -0,0 +1,45 @@
+import contextlib
+import threading
+import time
+
+import Export_Jobs
+from Export_Jobs import ExportJobManager, ExportPlan
+
+
+def test_a_requester_releases_only_its_own_hold(monkeypatch, tmp_path):
+    started = threading.Event()
+
+    def build(job, path):
+        started.set()
+        for _ in range(500):            # runs until cancelled, 5 s at most
+            job.report(0)
+            time.sleep(0.01)
+        with open(path, "w") as f:
+            f.write("done")
+
+    def plan(conn, lot_id, local_tz, **params):
+        return ExportPlan("bench_1", "bench", "bench.csv", 1, build)
+
+    class Pool:
+        def connection(self):
+            return contextlib.nullcontext(None)
+
+    monkeypatch.setattr(Export_Jobs, "get_connection_pool", Pool)
+    monkeypatch.setitem(Export_Jobs.EXPORT_KINDS, "bench", (plan, ".csv"))
+    jobs = ExportJobManager(export_dir=str(tmp_path), workers=1)
+
+    job, first = jobs.submit("bench", 1, None)
+    shared, second = jobs.submit("bench", 1, None)
+    assert shared is job and first != second
+    assert started.wait(5)
+
+    jobs.cancel(job.id, first)
+    jobs.cancel(job.id, first)          # a repeated DELETE from the same client
+    jobs.cancel(job.id, "not-a-hold")
+    assert not job._cancel.is_set()
+    assert job.status == "running"
+
+    jobs.cancel(job.id, second)         # the last holder leaves
+    assert job._cancel.is_set()
+    jobs._executor.shutdown(wait=True)
+    assert job.status == "cancelled"
@@ -0,0 +1,47 @@
+import asyncio
+from types import SimpleNamespace
+
+import ipaddress
+import pytest
+
+import User_Authentication as auth
+
+
+@pytest.fixture
+def proxy(monkeypatch):
+    monkeypatch.setattr(auth, "TRUSTED_PROXIES", [ipaddress.ip_network("10.0.0.0/8")])
+
+
+def test_forwarded_for_only_from_trusted_proxies(proxy):
+    assert auth.client_ip("203.0.113.9", "198.51.100.1") == "203.0.113.9"
+    assert auth.client_ip("10.0.0.2", "198.51.100.1") == "198.51.100.1"
+    # a client-written entry left of the real one is never reached
+    assert auth.client_ip("10.0.0.2", "1.2.3.4, 198.51.100.1, 10.0.0.3") == "198.51.100.1"
+    assert auth.client_ip("10.0.0.2", None) == "10.0.0.2"
+
+
+def test_unknown_user_still_runs_bcrypt(monkeypatch):
+    checked = []
+    monkeypatch.setattr(auth, "get_password_hash", lambda username: None)
+    monkeypatch.setattr(auth.bcrypt, "checkpw", lambda password, hashed: checked.append(hashed) or False)
+    assert asyncio.run(auth.authenticate_user_async("nobody", "guess")) is False
+    assert checked == [auth.DUMMY_PASSWORD_HASH]
+
+
+def test_account_limit_holds_across_addresses(proxy, monkeypatch):
+    main = pytest.importorskip("main")
+    monkeypatch.setattr(main, "ip_rate_limiter", auth.SlidingWindowRateLimiter(1000, 60))
+    monkeypatch.setattr(main, "user_rate_limiter", auth.SlidingWindowRateLimiter(5, 300))
+
+    async def wrong_password(username, password):
+        return False
+    monkeypatch.setattr(main, "authenticate_user_async", wrong_password)
+
+    def attempt(address):
+        request = SimpleNamespace(client=SimpleNamespace(host="10.0.0.2"), session={},
+                                  headers={"x-forwarded-for": address}, app=None)
+        return asyncio.run(main.login_post(request, username="admin", password="guess")).headers["location"]
+
+    for i in range(5):
+        assert "Too+many" not in attempt(f"198.51.100.{i}")
+    assert "Too+many" in attempt("198.51.100.99")
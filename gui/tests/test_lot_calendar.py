@@ -0,0 +1,64 @@
+import zoneinfo
+
+import pytest
+
+import Lot_Calendar
+from Lot_Calendar import LotTimezones, DEFAULT_TIMEZONE
+
+
+@pytest.fixture
+def no_database(monkeypatch):
+    def refuse():
+        raise AssertionError("lookup touched the database")
+    monkeypatch.setattr(Lot_Calendar, "get_connection_pool", refuse)
+
+
+def test_lookups_only_read_the_cache(no_database):
+    zones = LotTimezones()
+    zones._zones = {2: zoneinfo.ZoneInfo("Asia/Kathmandu")}
+    zones._stall_lots = {7: 2}
+    zones.needs_reload = False
+
+    assert zones.get(2) == zoneinfo.ZoneInfo("Asia/Kathmandu")
+    assert zones.get(3) == zoneinfo.ZoneInfo(DEFAULT_TIMEZONE)
+    assert zones.for_stall(7) == zoneinfo.ZoneInfo("Asia/Kathmandu")
+    assert not zones.needs_reload
+
+    # a stall added since the last load: default zone now, reload on the next pass
+    assert zones.for_stall(8) == zoneinfo.ZoneInfo(DEFAULT_TIMEZONE)
+    assert zones.needs_reload
+
+
+def test_load_reads_zones_and_stall_lots(db_conn):
+    db_conn.execute("INSERT INTO public.stalls (lot_id, stall_number, stall_type, current_status, is_operational) "
+                    "VALUES (2, 0, 'Regular', 'Vacant', true)")
+    Lot_Calendar.set_lot_timezone(db_conn, 2, "Asia/Kathmandu")
+    stall_id = db_conn.execute("SELECT stall_id FROM public.stalls").fetchone()[0]
+
+    zones = LotTimezones()
+    zones.load()
+    assert zones.for_stall(stall_id) == zoneinfo.ZoneInfo("Asia/Kathmandu")
+    assert not zones.needs_reload
+
+
+def test_availability_today_bins_a_quarter_hour_zone(db_conn):
+    from datetime import datetime, timedelta, timezone
+    from Today_Snapshot import compute_availability_today
+
+    kathmandu = zoneinfo.ZoneInfo("Asia/Kathmandu")              # UTC+05:45
+    now = datetime(2026, 3, 10, 6, 0, tzinfo=timezone.utc)        # 11:45 local
+    midnight = datetime(2026, 3, 10, tzinfo=kathmandu).astimezone(timezone.utc)
+    db_conn.execute("SELECT public.create_month_partitions('availabilitysnapshots', '2026-03-01', '2026-03-31')")
+    # a snapshot every 5 minutes from local midnight; n stalls free at minute 5n of the day
+    last = int((now - midnight).total_seconds()) // 300 - 1          # 11:40, the last before now
+    for n in range(1, last + 1):
+        ts = midnight + timedelta(minutes=5 * n)
+        db_conn.execute('INSERT INTO public.availabilitysnapshots (lot_id, "timestamp", available_stalls) '
+                        "VALUES (2, %s, %s)", (ts.replace(tzinfo=None), list(range(n % 60))))
+
+    result = compute_availability_today(db_conn, 2, kathmandu, now_utc=now)
+    assert result["labels"][:3] == ["12:00 AM", "12:30 AM", "01:00 AM"]
+    assert result["labels"][-1] == "11:30 AM"
+    # each bin holds the last snapshot of its half hour: minute 25, or 11:40 in the current one
+    expected = [min(6 * (i + 1) - 1, last) % 60 for i in range(len(result["data"]))]
+    assert result["data"] == expected
@@ -0,0 +1,57 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+import Request_Profiler
+from Request_Profiler import RequestProfiler, RequestProfilerMiddleware
+
+
+def profile_busy_request(profiler):
+    app = FastAPI()
+    app.add_middleware(RequestProfilerMiddleware, profiler=profiler)
+
+    @app.get("/busy")
+    async def busy():
+        end = time.perf_counter() + 0.2      # holds the loop, so the sampler sees this task
+        while time.perf_counter() < end:
+            pass
+        return {}
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            await client.get("/busy")
+    profiler.configure(enabled=True, interval_ms=2)
+    asyncio.run(run())
+    profiler.configure(enabled=False)
+    return profiler.report()["recent"][0]
+
+
+def test_loop_samples_are_attributed_to_the_running_request():
+    record = profile_busy_request(RequestProfiler())
+    assert record["cpu_ms"] > 100
+
+
+def test_loop_sampling_falls_back_when_the_task_lookup_fails(monkeypatch):
+    profiler = RequestProfiler()
+    def unavailable(loop=None):
+        raise RuntimeError("no task lookup here")
+    monkeypatch.setattr(Request_Profiler.asyncio, "current_task", unavailable)
+    assert profiler._loop_task(object()) is None
+    monkeypatch.undo()
+
+    record = profile_busy_request(profiler)    # still profiled, minus the loop samples
+    assert record["wall_ms"] > 100 and record["cpu_ms"] == 0
+
+
+def test_profiler_report_needs_a_session():
+    main = pytest.importorskip("main")
+
+    async def get():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.get("/api/profiler")
+    assert asyncio.run(get()).status_code == 401
@@ -0,0 +1,37 @@
+import json
+
+import numpy as np
+import pytest
+
+from Stall_Occupancy_Geometry import StallOccupancyEngine, fit_homography, project_points
+
+MAP_PATH = "static/Brentwood_parking_lot_top_down_map_74.json"
+
+
+def test_vehicle_polygons_are_not_stall_regions():
+    with pytest.raises(ValueError, match="car"):
+        StallOccupancyEngine.from_labelme("static/gt_74.json")
+
+
+def test_fit_homography_recovers_a_projection():
+    truth = np.array([[1.8, 0.3, 650.0], [0.05, 1.2, 240.0], [0.0002, 0.0011, 1.0]])
+    src = np.array([[0, 0], [468, 0], [468, 584], [0, 584], [200, 300], [90, 410]], dtype=float)
+    h = fit_homography(src, project_points(truth, src))
+    assert np.allclose(h, truth, rtol=1e-6, atol=1e-9)
+
+
+def test_map_points_are_keyed_by_their_labels(tmp_path):
+    calibration = tmp_path / "calibration.json"
+    calibration.write_text(json.dumps({
+        "map_points": [[0, 0], [468, 0], [468, 584], [0, 584]],
+        "camera_points": [[700, 250], [1900, 250], [2550, 1900], [50, 1900]],
+    }))
+    engine = StallOccupancyEngine.from_map_points(MAP_PATH, str(calibration))
+    assert sorted(engine.stall_numbers.tolist()) == list(range(74))
+
+    # a car parked on stall 42 marks stall 42, wherever 42 sits in the file
+    i = int(np.flatnonzero(engine.stall_numbers == 42)[0])
+    region = engine.polygons[i]
+    car = (region - region.mean(axis=0)) * 1.5 + region.mean(axis=0)
+    occupied, _ = engine.occupancy([car])
+    assert engine.stall_numbers[occupied].tolist() == [42]
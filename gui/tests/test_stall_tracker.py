@@ -0,0 +1,48 @@
+import json
+from datetime import datetime, timezone
+
+import numpy as np
+
+import ParkingLot_Database_Utils as db
+from Stall_Occupancy_Geometry import StallOccupancyEngine, StallOccupancyTracker
+
+LOT_ID = 1
+
+
+def square(x, y, side=100):
+    return [[x, y], [x + side, y], [x + side, y + side], [x, y + side]]
+
+
+def drain(conn):
+    return [json.loads(n.payload) for n in conn.notifies(timeout=0.5, stop_after=10)]
+
+
+def test_one_change_sends_one_notification(db_conn, monkeypatch):
+    for number in range(3):
+        db_conn.execute("INSERT INTO public.stalls (lot_id, stall_number, stall_type, current_status, is_operational) "
+                        "VALUES (%s, %s, 'Regular', 'Vacant', true)", (LOT_ID, number))
+    live_writes = []
+    monkeypatch.setattr(db.live_stalls, "set_status", lambda *args: live_writes.append(args))
+    db_conn.execute("LISTEN stall_events")
+
+    # stall numbers deliberately out of polygon order
+    engine = StallOccupancyEngine([square(0, 0), square(200, 0), square(400, 0)], stall_numbers=[2, 0, 1])
+    tracker = StallOccupancyTracker(LOT_ID, engine)
+    now = datetime.now(timezone.utc)
+
+    _, _, changed = tracker.process([square(190, -10, 120)], now)
+    assert changed == [0]
+    events = drain(db_conn)
+    assert [(e["event"], e["stall_number"], e["status"]) for e in events] == [("start_session", "0", "Occupied")]
+    assert live_writes == [(LOT_ID, "0", "Occupied")]
+
+    tracker.process([square(190, -10, 120)], now)           # no change, no writes
+    assert drain(db_conn) == []
+
+    _, _, changed = tracker.process([], now)
+    assert changed == [0]
+    events = drain(db_conn)
+    assert [(e["event"], e["stall_number"], e["status"]) for e in events] == [("end_session", "0", "Vacant")]
+    assert len(live_writes) == 2
+    assert db_conn.execute("SELECT current_status FROM public.stalls WHERE stall_number = '0'").fetchone()[0] == "Vacant"
+    assert db_conn.execute("SELECT count(*) FROM public.parkingsessions WHERE exit_timestamp IS NOT NULL").fetchone()[0] == 1
@@ -0,0 +1,48 @@
+import asyncio
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import Stream_Pipeline as sp
+
+
+@pytest.fixture
+def stream(monkeypatch):
+    frame = sp.EncodedFrame(0, "data:raw", "data:cam")
+    async def encode_latest():
+        return frame._replace(seq=sp.latest_seq)
+    monkeypatch.setattr(sp, "encode_latest", encode_latest)
+    monkeypatch.setattr(sp, "latest_pair", (np.zeros((2, 2)), np.zeros((2, 2))))
+    monkeypatch.setattr(sp, "latest_seq", 0)
+    return sp
+
+
+def get_frames(after="", map_version=""):
+    request = SimpleNamespace(session={"authenticated": True})
+    return asyncio.run(sp.frames(request, after=after, map_version=map_version))
+
+
+def test_unchanged_frame_is_204(stream):
+    stream.latest_seq = 7
+    assert get_frames(after=stream.cursor(7)).status_code == 204
+    assert get_frames(after=stream.cursor(6)).status_code == 200
+
+
+def test_cursor_from_before_a_restart_gets_the_current_frame(stream, monkeypatch):
+    stream.latest_seq = 500
+    held = stream.cursor(500)
+    assert get_frames(after=held).status_code == 204
+
+    # restart: a new boot id and the counter back at the start
+    monkeypatch.setattr(sp, "BOOT_ID", "restarted")
+    stream.latest_seq = 1
+    resp = get_frames(after=held)
+    assert resp.status_code == 200
+    assert resp.body.decode().count('"seq":"restarted.1"') == 1
+
+
+@pytest.mark.parametrize("after", ["", "-1", "garbage", "x.y", "."])
+def test_malformed_cursor_gets_the_current_frame(stream, after):
+    stream.latest_seq = 1
+    assert get_frames(after=after).status_code == 200
@@ -0,0 +1,27 @@
+import asyncio
+import time
+
+import pytest
+
+import Today_Snapshot
+from Today_Snapshot import TodaySnapshotStore, UnknownLotError
+
+
+def test_unknown_lots_are_refused_and_quiet_lots_forgotten(monkeypatch):
+    store = TodaySnapshotStore(lot_exists=lambda lot_id: lot_id in (1, 2))
+    monkeypatch.setattr(store, "compute", lambda lot_id: store._snapshots.setdefault(lot_id, object()))
+    monkeypatch.setattr(store, "_usable", lambda snap: False)
+
+    async def requests():
+        for lot_id in range(1000):
+            try:
+                await store.get(lot_id)
+            except UnknownLotError:
+                pass
+    asyncio.run(requests())
+    assert sorted(store._last_request) == [1, 2]
+    assert sorted(store._locks) == [1, 2]
+
+    store._last_request[1] = time.time() - Today_Snapshot.ACTIVE_LOT_TTL_SEC - 1
+    store._forget_quiet_lots()
+    assert list(store._last_request) == list(store._locks) == list(store._snapshots) == [2]